@@ -0,0 +1,261 @@
+"""Архив отправленных постов: append-only JSONL-сегменты по месяцам
+
+Доставленные посты send_post.py дописывает в сегмент месяца отправки
+(archive/2026-10.jsonl), а из расписания удаляет - рабочее расписание остаётся
+маленьким, история хранится отдельно. Строка сегмента - пост в формате JSON-файла
+расписания и время отправки sent_at.
+
+Пост, доставленный не во все чаты сразу, попадает в архив несколькими записями:
+при каждой частичной доставке - с чатами, куда он дошёл. При чтении и сжатии
+записи одного поста объединяются, targets - все чаты доставки.
+
+Сегменты прошлых месяцев больше не дописываются; сжатие переписывает их без
+повторов (пост мог попасть в архив дважды при падении между записью в архив и
+удалением из расписания), по порядку отправки и в gzip:
+
+    python archive.py compact            # все закрытые месяцы
+    python archive.py months             # месяцы в архиве и число постов
+    python archive.py show 2026-10       # посты месяца
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from schedule_store import BASE_DIR, FileLock, normalize_post
+
+ARCHIVE_DIR = os.path.join(BASE_DIR, "archive")
+MONTH_RE = re.compile(r"^(\d{4})-(\d{2})$")
+SEGMENT_RE = re.compile(r"^(\d{4}-\d{2})\.jsonl(\.gz)?$")
+
+UTC_TZ = timezone.utc
+
+
+def month_of(epoch):
+    """Месяц 'YYYY-MM' (UTC) для epoch-секунд"""
+    return datetime.fromtimestamp(epoch, UTC_TZ).strftime("%Y-%m")
+
+
+def parse_month(text):
+    """Проверяет строку 'YYYY-MM' и возвращает её (None, если формат неверный)"""
+    match = MONTH_RE.match(text.strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        return None
+    return match.group(0)
+
+
+def archive_entry(post, sent_at):
+    """Строка сегмента: пост и время отправки"""
+    entry = post.to_json()
+    entry["sent_at"] = datetime.fromtimestamp(sent_at, UTC_TZ).isoformat()
+    return entry
+
+
+class Archive:
+    """Каталог сегментов. Запись дописывает строки в конец сегмента под FileLock,
+    чтение сегмента кэшируется до его изменения."""
+
+    def __init__(self, path=ARCHIVE_DIR):
+        self.path = path
+        self._lock = FileLock(os.path.join(path, ".lock"))
+        self._cache = {}  # месяц -> (отпечаток файлов, записи)
+        self._cache_lock = threading.Lock()
+
+    def _segment(self, month, compressed=False):
+        return os.path.join(self.path, f"{month}.jsonl" + (".gz" if compressed else ""))
+
+    def append(self, posts, sent_at=None):
+        """Дописывает отправленные посты в сегмент месяца sent_at (по умолчанию - сейчас)"""
+        sent_at = time.time() if sent_at is None else sent_at
+        self.append_entries([archive_entry(post, sent_at) for post in posts])
+
+    def append_entries(self, entries):
+        """Дописывает готовые записи архива, каждую - в сегмент месяца её sent_at.
+        Одна запись на диск (с fsync) на сегмент."""
+        by_month = {}
+        for entry in entries:
+            by_month.setdefault(entry["sent_at"][:7], []).append(json.dumps(entry, ensure_ascii=False) + "\n")
+        if not by_month:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            for month, lines in by_month.items():
+                with open(self._segment(month), "a", encoding="utf-8") as file:
+                    file.write("".join(lines))
+                    file.flush()
+                    os.fsync(file.fileno())
+
+    def months(self):
+        """Месяцы, за которые есть сегменты, по возрастанию"""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted({match.group(1) for match in map(SEGMENT_RE.match, names) if match})
+
+    def _signature(self, month):
+        signature = []
+        for path in (self._segment(month, compressed=True), self._segment(month)):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _read_segment(self, month):
+        """Все строки месяца: сжатая часть и дописанная после сжатия"""
+        entries = []
+        for path, opener in ((self._segment(month, compressed=True), gzip.open), (self._segment(month), open)):
+            try:
+                with opener(path, "rt", encoding="utf-8") as file:
+                    for line in file:
+                        # Недописанная строка (падение во время записи) пропускается
+                        if line.endswith("\n"):
+                            try:
+                                entries.append(json.loads(line))
+                            except json.JSONDecodeError:
+                                continue
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def lookup(self, month):
+        """Посты, отправленные в месяце 'YYYY-MM', по времени отправки, без повторов.
+        Читается только сегмент этого месяца."""
+        signature = self._signature(month)
+        with self._cache_lock:
+            cached = self._cache.get(month)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        entries = _dedupe(self._read_segment(month))
+        with self._cache_lock:
+            self._cache[month] = (signature, entries)
+        return entries
+
+    def compact(self, month):
+        """Переписывает сегмент месяца в gzip без повторов и по порядку отправки.
+        Возвращает (строк было, строк стало)."""
+        with self._lock:
+            entries = self._read_segment(month)
+            if not entries:
+                return 0, 0
+            compacted = _dedupe(entries)
+            compressed = self._segment(month, compressed=True)
+            temp_file = compressed + ".tmp"
+            with gzip.open(temp_file, "wt", encoding="utf-8") as file:
+                file.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in compacted)
+            os.replace(temp_file, compressed)
+            if os.path.exists(self._segment(month)):
+                os.remove(self._segment(month))
+        return len(entries), len(compacted)
+
+    def compact_closed(self, now=None):
+        """Сжимает сегменты всех прошедших месяцев, текущий продолжает дописываться"""
+        current = month_of(time.time() if now is None else now)
+        return {month: self.compact(month) for month in self.months()
+                if month < current and os.path.exists(self._segment(month))}
+
+
+def _dedupe(entries):
+    """Последняя запись каждого поста, по возрастанию sent_at. targets - объединение
+    чатов всех записей поста (частичные доставки); без targets - чаты по умолчанию"""
+    latest = {}
+    for entry in entries:
+        previous = latest.get(entry.get("id"))
+        if previous is not None and previous.get("targets") and entry.get("targets"):
+            entry = dict(entry, targets=list(dict.fromkeys(previous["targets"] + entry["targets"])))
+        latest[entry.get("id")] = entry
+    return sorted(latest.values(), key=lambda entry: entry.get("sent_at", ""))
+
+
+def archive_legacy_sent(path, archive, marker=None):
+    """Переносит записи старого schedule.json с "sent": true в архив и убирает их из файла,
+    чтобы их больше не пропускали при каждом чтении. Возвращает число перенесённых.
+    marker - файл-отметка о выполненном переносе: пока он есть, schedule.json не разбирается
+    (новых записей с "sent" не бывает, а файл читается при каждом запуске send_post.py)."""
+    if not os.path.exists(path) or (marker and os.path.exists(marker)):
+        return 0
+    with FileLock(path + ".lock"):
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (json.JSONDecodeError, IOError):
+            return 0
+        if not isinstance(data, list):
+            return 0
+        sent = [item for item in data if isinstance(item, dict) and item.get("sent")]
+        if not sent:
+            _mark_done(marker)
+            return 0
+        entries = []
+        for item in sent:
+            post = normalize_post(dict(item, sent=False))
+            if post is not None:
+                # Время отправки старых записей неизвестно - считаем, что ушли вовремя
+                entries.append(archive_entry(post, post.dispatch_at))
+        archive.append_entries(entries)
+        remaining = [item for item in data if not (isinstance(item, dict) and item.get("sent"))]
+        temp_file = path + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as file:
+            json.dump(remaining, file, ensure_ascii=False, indent=2)
+        os.replace(temp_file, path)
+        _mark_done(marker)
+    print(f"Перенесено в архив отправленных постов из {os.path.basename(path)}: {len(sent)}")
+    return len(sent)
+
+
+def _mark_done(marker):
+    if marker:
+        with open(marker, "w", encoding="utf-8"):
+            pass
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Архив в каталоге ARCHIVE_DIR (переменная окружения)"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = Archive(os.getenv("ARCHIVE_DIR", ARCHIVE_DIR))
+        return _archive
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Архив отправленных постов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="сжать сегменты прошедших месяцев")
+    compact_parser.add_argument("--month", help="сжать только этот месяц (YYYY-MM), в том числе текущий")
+    subparsers.add_parser("months", help="месяцы в архиве")
+    show_parser = subparsers.add_parser("show", help="посты месяца")
+    show_parser.add_argument("month", help="YYYY-MM")
+    args = parser.parse_args()
+
+    archive = get_archive()
+    if args.command == "compact":
+        if args.month:
+            if parse_month(args.month) is None:
+                parser.error("месяц в формате YYYY-MM")
+            results = {args.month: archive.compact(args.month)}
+        else:
+            results = archive.compact_closed()
+        for month, (before, after) in results.items():
+            print(f"{month}: строк {before} -> {after}")
+        if not results:
+            print("Нечего сжимать")
+    elif args.command == "months":
+        for month in archive.months():
+            print(f"{month}: {len(archive.lookup(month))}")
+    else:
+        if parse_month(args.month) is None:
+            parser.error("месяц в формате YYYY-MM")
+        for entry in archive.lookup(args.month):
+            print(json.dumps(entry, ensure_ascii=False))
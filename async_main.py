@@ -0,0 +1,315 @@
+"""Асинхронный режим бота на AsyncTeleBot (запуск: python async_main.py или python main.py --async)
+
+Те же команды и ответы, что и в main.py. Это отдельная точка входа: main.py при
+импорте строит синхронный TeleBot, очередь заявок и обработчики, которые здесь не нужны. Все запросы к Telegram идут через одну
+общую aiohttp-сессию с keep-alive, а запись в хранилища расписания и состояния
+диалога вынесена в поток (asyncio.to_thread), чтобы не блокировать цикл событий.
+"""
+import argparse
+import asyncio
+import os
+
+import aiohttp
+import telebot
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from bot_common import (
+    ADMIN_ONLY_TEXT,
+    ALBUM_ADDED_TEXT,
+    ALLOWED_UPDATES,
+    ARCHIVE_PAGE_CALLBACK,
+    BOT_TOKEN,
+    IMPORT_PROMPT_TEXT,
+    MEDIA_ADDED_TEXT,
+    MEDIA_PROMPT_TEXT,
+    STATUS_PAGE_CALLBACK,
+    STEP_NOT_FOUND_TEXT,
+    TELEGRAM_API_URL,
+    AlbumCollector,
+    accept_message_text,
+    add_media,
+    awaiting_import,
+    awaiting_message_text,
+    cancel_repeat_rule,
+    collecting_media,
+    done_markup,
+    finish_media_upload,
+    import_document,
+    is_admin,
+    is_not_modified,
+    parse_archive_command,
+    parse_page,
+    parse_repeat_command,
+    parse_schedule_command,
+    render_archive,
+    render_dead_letters,
+    render_join_status,
+    render_repeat_status,
+    render_schedule_status,
+    requeue_dead_letters,
+    save_scheduled_post,
+    start_import,
+    start_schedule,
+)
+from join_queue import JoinApprovalQueue
+from metrics import instrument_api, instrument_async_api, start_metrics, timed_handler
+
+# Размер пула соединений общей сессии и время жизни простаивающего соединения
+ASYNC_CONNECTIONS = int(os.getenv("ASYNC_CONNECTIONS", "100"))
+KEEPALIVE_TIMEOUT = 60
+
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL
+
+bot = AsyncTeleBot(BOT_TOKEN)
+# Рабочие потоки очереди заявок вызывают синхронный API, цикл событий они не занимают
+join_queue = JoinApprovalQueue(telebot.TeleBot(BOT_TOKEN, threaded=False).approve_chat_join_request)
+_loop = None  # цикл событий бота, в него таймеры альбомов передают ответ
+
+
+def _reply_album(message, count):
+    asyncio.run_coroutine_threadsafe(
+        bot.reply_to(message, ALBUM_ADDED_TEXT.format(count=count), reply_markup=done_markup()), _loop
+    ).result()
+
+
+album_collector = AlbumCollector(_reply_album)
+
+
+async def _awaiting_message_text(message):
+    # Фильтр проверяется на каждом сообщении: чтение state_store - в потоке, не в цикле событий
+    return await asyncio.to_thread(awaiting_message_text, message.from_user.id)
+
+
+# Регистрируется первым: следующее сообщение после /schedule - текст поста.
+# Шаг хранится в state_store, поэтому диалог переживает перезапуск бота
+@bot.message_handler(
+    func=_awaiting_message_text,
+    content_types=["text", "photo", "document", "video", "audio"],
+)
+@timed_handler
+async def handle_schedule_message_text(message):
+    if not await asyncio.to_thread(accept_message_text, message.from_user.id, message.text):
+        await bot.reply_to(message, STEP_NOT_FOUND_TEXT)
+        return
+    await bot.reply_to(message, MEDIA_PROMPT_TEXT, reply_markup=done_markup())
+
+
+@bot.message_handler(commands=["schedule"])
+@timed_handler
+async def handle_schedule(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+
+    dispatch_at_utc, reply_text = parse_schedule_command(message.text)
+    if dispatch_at_utc is None:
+        await bot.reply_to(message, reply_text)
+        return
+
+    await asyncio.to_thread(start_schedule, message.from_user.id, dispatch_at_utc)
+    await bot.reply_to(message, reply_text)
+
+
+@bot.message_handler(commands=["schedule_repeat"])
+@timed_handler
+async def handle_schedule_repeat(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+
+    rule, next_run, reply_text = parse_repeat_command(message.text)
+    if rule is None:
+        await bot.reply_to(message, reply_text)
+        return
+
+    await asyncio.to_thread(start_schedule, message.from_user.id, next_run, rule)
+    await bot.reply_to(message, reply_text)
+
+
+@bot.message_handler(commands=["repeat_status"])
+@timed_handler
+async def handle_repeat_status(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, await asyncio.to_thread(render_repeat_status))
+
+
+@bot.message_handler(commands=["repeat_cancel"])
+@timed_handler
+async def handle_repeat_cancel(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, await asyncio.to_thread(cancel_repeat_rule, message.text))
+
+
+@bot.message_handler(commands=["dead_letters"])
+@timed_handler
+async def handle_dead_letters(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, await asyncio.to_thread(render_dead_letters))
+
+
+@bot.message_handler(commands=["requeue"])
+@timed_handler
+async def handle_requeue(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, await asyncio.to_thread(requeue_dead_letters, message.text))
+
+
+@bot.message_handler(commands=["import"])
+@timed_handler
+async def handle_import(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await asyncio.to_thread(start_import, message.from_user.id)
+    await bot.reply_to(message, IMPORT_PROMPT_TEXT)
+
+
+async def _awaiting_import(message):
+    return await asyncio.to_thread(awaiting_import, message)
+
+
+# Раньше обработчика файлов поста: документ после /import - это файл импорта
+@bot.message_handler(func=_awaiting_import, content_types=["document"])
+@timed_handler
+async def handle_import_document(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    document = message.document
+    await bot.reply_to(
+        message,
+        await asyncio.to_thread(import_document, message.from_user.id, document.file_id, document.file_name),
+    )
+
+
+@bot.message_handler(content_types=["photo", "document", "video", "audio"])
+@timed_handler
+async def handle_media_during_schedule(message):
+    if message.media_group_id:
+        # Альбом: файлы копятся и подтверждаются одним ответом после паузы
+        if await asyncio.to_thread(collecting_media, message.from_user.id):
+            album_collector.add(message)
+        return
+    if await asyncio.to_thread(add_media, message.from_user.id, message):
+        await bot.reply_to(message, MEDIA_ADDED_TEXT, reply_markup=done_markup())
+
+
+@bot.callback_query_handler(func=lambda call: call.data == 'done_media_upload')
+@timed_handler
+async def schedule_inline_finish(call):
+    await asyncio.to_thread(album_collector.flush_user, call.from_user.id)
+    data = await asyncio.to_thread(finish_media_upload, call.from_user.id)
+    if data is None:
+        await bot.answer_callback_query(call.id, text="Этап не найден, начните сначала /schedule.")
+        return
+    reply_text = await asyncio.to_thread(save_scheduled_post, data)
+    await bot.reply_to(call.message, reply_text)
+    await bot.answer_callback_query(call.id, text="Пост сохранён!")
+
+
+@bot.message_handler(commands=["schedule_status"])
+@timed_handler
+async def handle_schedule_status(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    text, markup = await asyncio.to_thread(render_schedule_status)
+    await bot.reply_to(message, text, reply_markup=markup)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(STATUS_PAGE_CALLBACK))
+@timed_handler
+async def handle_schedule_status_page(call):
+    if not is_admin(call.from_user.id):
+        await bot.answer_callback_query(call.id, text=ADMIN_ONLY_TEXT)
+        return
+    text, markup = await asyncio.to_thread(render_schedule_status, parse_page(call.data))
+    try:
+        await bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except asyncio_helper.ApiTelegramException as e:
+        if not is_not_modified(e):
+            raise
+    await bot.answer_callback_query(call.id)
+
+
+@bot.message_handler(commands=["archive"])
+@timed_handler
+async def handle_archive(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    text, markup = await asyncio.to_thread(render_archive, parse_archive_command(message.text))
+    await bot.reply_to(message, text, reply_markup=markup)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(ARCHIVE_PAGE_CALLBACK))
+@timed_handler
+async def handle_archive_page(call):
+    if not is_admin(call.from_user.id):
+        await bot.answer_callback_query(call.id, text=ADMIN_ONLY_TEXT)
+        return
+    text, markup = await asyncio.to_thread(render_archive, parse_archive_command(call.data), parse_page(call.data))
+    try:
+        await bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except asyncio_helper.ApiTelegramException as e:
+        if not is_not_modified(e):
+            raise
+    await bot.answer_callback_query(call.id)
+
+
+@bot.message_handler(commands=["join_status"])
+@timed_handler
+async def handle_join_status(message):
+    if not is_admin(message.from_user.id):
+        await bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    await bot.reply_to(message, render_join_status(join_queue.stats()))
+
+
+@bot.chat_join_request_handler()
+@timed_handler
+async def approve_join_request(message):
+    join_queue.submit(message.chat.id, message.from_user.id)
+
+
+async def open_session():
+    """Создаёт общую для всех запросов aiohttp-сессию с keep-alive соединениями"""
+    manager = asyncio_helper.session_manager
+    if manager.session is not None and not manager.session.closed:
+        await manager.session.close()
+    connector = aiohttp.TCPConnector(
+        limit=ASYNC_CONNECTIONS,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ssl=manager.ssl_context,
+    )
+    manager.session = aiohttp.ClientSession(connector=connector)
+    return manager.session
+
+
+async def run():
+    global _loop
+    _loop = asyncio.get_running_loop()
+    await open_session()
+    try:
+        await bot.infinity_polling(allowed_updates=ALLOWED_UPDATES)
+    finally:
+        await bot.close_session()
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="Бот планирования постов на AsyncTeleBot (asyncio)").parse_args()
+    start_metrics()
+    # Синхронный TeleBot здесь только у очереди заявок, его запросы тоже в метриках
+    instrument_api()
+    instrument_async_api()
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+"""Отправка постов с файлами с диска: загрузка один раз и кэш file_id (file_cache).
+
+Fake Bot API (bench/fake_api.py) запускается отдельным процессом, чтобы его память
+не смешивалась с памятью отправителя. Проходы send_post.dispatch_due:
+  первый    - пост с --files файлами по --size МБ в --chats чатов: файлы загружает
+              первый чат, остальные получают их по file_id;
+  повторный - другой пост с теми же файлами (кросспост): загрузок нет;
+  изменён   - один файл переписан: загружается только он.
+Для сравнения - сколько байт ушло бы без кэша (загрузка в каждый чат каждого поста)
+и пик памяти Python (tracemalloc) на загрузку одного файла: потоком через
+file_cache.upload и через requests с files=, как в telebot.
+
+    python bench/bench_file_cache.py --files 4 --size 20 --chats 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MB = 1024 * 1024
+
+
+def start_api():
+    """fake_api.py отдельным процессом; возвращает (процесс, шаблон адреса API)"""
+    process = subprocess.Popen([sys.executable, "-u", os.path.join(ROOT, "bench", "fake_api.py"), "--port", "0"],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    return process, line.split("'")[1]
+
+
+def api_stats(api_url):
+    with urllib.request.urlopen(api_url.split("/bot")[0] + "/_stats") as response:
+        return json.load(response)
+
+
+def write_file(path, size, seed):
+    with open(path, "wb") as file:
+        for _ in range(size // MB):
+            file.write(os.urandom(MB - 8) + seed.to_bytes(8, "big"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--size", type=int, default=20, help="размер файла, МБ")
+    parser.add_argument("--chats", type=int, default=5)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_file_cache_")
+    api, api_url = start_api()
+    os.environ.update(
+        BOT_TOKEN="123:bench",
+        TARGET_CHAT_ID=",".join(str(1000 + chat) for chat in range(args.chats)),
+        TELEGRAM_API_URL=api_url,
+        SCHEDULE_BACKEND="sqlite",
+        SCHEDULE_DB=os.path.join(tmp_dir, "schedule.db"),
+        OUTBOX_FILE=os.path.join(tmp_dir, "schedule.outbox"),
+        ARCHIVE_DIR=os.path.join(tmp_dir, "archive"),
+        FILE_CACHE_DB=os.path.join(tmp_dir, "file_cache.db"),
+        MEDIA_ROOT=tmp_dir,
+    )
+    import requests
+
+    import send_post
+    from file_cache import upload_file
+    from outbox import DeliveryLog
+    from schedule_store import Post, get_store
+
+    paths = [os.path.join(tmp_dir, f"report-{number}.bin") for number in range(args.files)]
+    for number, path in enumerate(paths):
+        write_file(path, args.size * MB, number)
+    media = [{"type": "document", "path": path} for path in paths]
+    store = get_store()
+    outbox = DeliveryLog(os.environ["OUTBOX_FILE"])
+    print(f"{args.files} файлов по {args.size} МБ, {args.chats} чатов")
+    try:
+        before = api_stats(api_url)
+        for number, name in enumerate(["первый", "повторный", "изменён"]):
+            if name == "изменён":
+                write_file(paths[0], args.size * MB, 100)
+            store.add_many([Post(f"post-{number}", int(time.time()) - 1, "отчёт", media)])
+            started = time.perf_counter()
+            retries = send_post.dispatch_due(store, time.time(), outbox)
+            elapsed = time.perf_counter() - started
+            stats = api_stats(api_url)
+            uploads = stats["uploads"] - before["uploads"]
+            uploaded = stats["uploaded_bytes"] - before["uploaded_bytes"]
+            before = stats
+            naive = args.files * args.size * args.chats
+            print(f"  {name:<10} {elapsed:6.2f} с, загрузок {uploads}, загружено {uploaded / MB:7.1f} МБ "
+                  f"(без кэша {naive} МБ), повторов {len(retries)}")
+
+        chat_id = os.environ["TARGET_CHAT_ID"].split(",")[0]
+        item = {"type": "document", "path": paths[1]}
+        tracemalloc.start()
+        upload_file("123:bench", chat_id, item)
+        streamed = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        with open(paths[1], "rb") as file:
+            requests.post(api_url.format("123:bench", "sendDocument"), data={"chat_id": chat_id},
+                          files={"document": file}).raise_for_status()
+        buffered = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  пик памяти на загрузку {args.size} МБ: потоком {streamed / MB:.1f} МБ, "
+              f"requests files= {buffered / MB:.1f} МБ")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Запросы к API на пост с большим количеством смешанных вложений.
+
+Посты с N вложениями случайных типов отправляются через send_post.send_post
+в один личный чат; ответы Telegram подменяются заглушкой, которая отклоняет
+недопустимые группы так же, как настоящий API (больше 10 файлов, документы или
+аудио вперемешку с другими типами). Для сравнения приведены старый способ (одна
+группа из всех файлов - часто отклоняется) и отправка по одному файлу.
+
+    python bench/bench_media_plan.py --posts 200 --max-media 40
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ.setdefault("TARGET_CHAT_ID", "500")
+
+from telebot import apihelper  # noqa: E402
+
+import send_post  # noqa: E402
+from media_plan import GROUP_KINDS, MEDIA_GROUP_LIMIT  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+from schedule_store import Post  # noqa: E402
+
+MEDIA_TYPES = ["photo", "photo", "photo", "video", "document", "audio"]
+
+
+def make_post(number, count, rng):
+    media = [{"type": rng.choice(MEDIA_TYPES), "file_id": f"file-{number}-{i}"} for i in range(count)]
+    return Post(str(number), 0, "бенчмарк", media)
+
+
+def valid_group(media_types):
+    kinds = {GROUP_KINDS[media_type] for media_type in media_types}
+    return 2 <= len(media_types) <= MEDIA_GROUP_LIMIT and len(kinds) == 1
+
+
+class _FakeResponse:
+    def __init__(self, ok, result=None):
+        self.status_code = 200 if ok else 400
+        self._payload = {"ok": True, "result": result} if ok else {
+            "ok": False, "error_code": 400, "description": "Bad Request: invalid media group"}
+        self.text = json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeApi:
+    """Считает запросы и отклоняет группы, которые не принял бы Telegram"""
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+
+    def __call__(self, method, url, **kwargs):
+        self.calls += 1
+        message = {"message_id": 1, "date": 0, "chat": {"id": 500, "type": "private"}}
+        if url.endswith("sendMediaGroup"):
+            group = json.loads(kwargs["params"]["media"])
+            if not valid_group([item["type"] for item in group]):
+                self.rejected += 1
+                return _FakeResponse(False)
+            return _FakeResponse(True, [message] * len(group))
+        return _FakeResponse(True, message)
+
+
+def old_rejected(post):
+    """Старый send_post: одна группа из всех файлов - 1 запрос, но Telegram может её отклонить"""
+    types = [item["type"] for item in post.media]
+    return len(types) > 1 and not valid_group(types)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--max-media", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    posts = [make_post(i, rng.randint(1, args.max_media), rng) for i in range(args.posts)]
+    media_total = sum(len(post.media) for post in posts)
+
+    # Бенчмарк меряет число запросов, а не лимиты Telegram
+    send_post.limiter = RateLimiter(global_rate=1_000_000, chat_rate=1_000_000)
+    api = FakeApi()
+    apihelper.CUSTOM_REQUEST_SENDER = api
+    failed_posts = 0
+    started = time.perf_counter()
+    try:
+        for post in posts:
+            try:
+                send_post.send_post(post, "500")
+            except apihelper.ApiTelegramException:
+                failed_posts += 1
+    finally:
+        apihelper.CUSTOM_REQUEST_SENDER = None
+    elapsed = time.perf_counter() - started
+
+    old_failed = sum(1 for post in posts if old_rejected(post))
+    print(f"постов: {len(posts)}, вложений: {media_total} (в среднем {media_total / len(posts):.1f} на пост)")
+    print(f"   план: {api.calls / len(posts):.2f} запросов на пост, отклонённых групп {api.rejected}, "
+          f"неотправленных постов {failed_posts}, {elapsed * 1000 / len(posts):.2f} мс на пост")
+    print(f" старый: 1.00 запрос на пост, неотправленных постов {old_failed} "
+          f"(повторялись бы при каждом запуске)")
+    print(f"поштучно: {media_total / len(posts):.2f} запросов на пост")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Сравнение пропускной способности синхронного (main.py) и асинхронного (async_main.py) режимов.
+
+Сеть не используется: ответы Telegram подменяются заглушкой с задержкой --latency,
+которая имитирует время ответа API. Прогоняются синтетические апдейты
+(заявки на вступление и /schedule_status от администратора) через
+process_new_updates, считается апдейтов в секунду до последнего ответа API
+(заявки одобряет фоновая очередь, её тоже дожидаемся).
+
+    python bench/bench_runtime.py --updates 2000 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADMIN_ID = 1000
+_tmp_dir = tempfile.mkdtemp(prefix="bench_runtime_")
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ.setdefault("ADMIN_ID", str(ADMIN_ID))
+os.environ["SCHEDULE_DB"] = os.path.join(_tmp_dir, "schedule.db")
+os.environ["SCHEDULE_FILE"] = os.path.join(_tmp_dir, "schedule.json")
+os.environ["STATE_DB"] = os.path.join(_tmp_dir, "state.db")
+os.environ["ARCHIVE_DIR"] = os.path.join(_tmp_dir, "archive")
+
+from telebot import apihelper, types  # noqa: E402
+
+from rate_limit import AdaptiveTokenBucket  # noqa: E402
+
+
+def make_updates(count):
+    """Синтетические апдейты: 90% заявок на вступление, 10% команд администратора"""
+    updates = []
+    for i in range(count):
+        if i % 10 == 0:
+            updates.append({
+                "update_id": i,
+                "message": {
+                    "message_id": i,
+                    "date": 0,
+                    "chat": {"id": ADMIN_ID, "type": "private"},
+                    "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "admin"},
+                    "text": "/schedule_status",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 16}],
+                },
+            })
+        else:
+            updates.append({
+                "update_id": i,
+                "chat_join_request": {
+                    "chat": {"id": -100500, "type": "channel", "title": "bench"},
+                    "from": {"id": 10_000 + i, "is_bot": False, "first_name": "user"},
+                    "user_chat_id": 10_000 + i,
+                    "date": 0,
+                },
+            })
+    return [types.Update.de_json(json.dumps(update)) for update in updates]
+
+
+def fake_result(method):
+    if method.lower().endswith("approvechatjoinrequest"):
+        return True
+    return {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": ADMIN_ID, "type": "private"},
+        "text": "ok",
+    }
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, method):
+        self._payload = {"ok": True, "result": fake_result(method)}
+        self.text = json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+def _unthrottle(join_queue):
+    """Бенчмарк меряет сами режимы, а не лимит одобрений Telegram"""
+    join_queue.bucket = AdaptiveTokenBucket(1_000_000)
+
+
+def bench_sync(updates, latency):
+    import main
+
+    _unthrottle(main.join_queue)
+
+    done = threading.Semaphore(0)
+
+    def sender(method, url, **kwargs):
+        time.sleep(latency)
+        done.release()
+        return _FakeResponse(url.rsplit("/", 1)[-1])
+
+    apihelper.CUSTOM_REQUEST_SENDER = sender
+    try:
+        started = time.perf_counter()
+        main.bot.process_new_updates(updates)
+        # Каждый апдейт порождает ровно один запрос к API
+        for _ in updates:
+            done.acquire()
+        return time.perf_counter() - started
+    finally:
+        apihelper.CUSTOM_REQUEST_SENDER = None
+
+
+def bench_async(updates, latency):
+    from telebot import asyncio_helper
+
+    import async_main
+
+    _unthrottle(async_main.join_queue)
+
+    async def fake_process_request(token, url, method="get", params=None, files=None, **kwargs):
+        await asyncio.sleep(latency)
+        return fake_result(url)
+
+    asyncio_helper._process_request = fake_process_request
+
+    # Заявки одобряет синхронный API из потоков очереди
+    done = threading.Semaphore(0)
+
+    def sender(method, url, **kwargs):
+        time.sleep(latency)
+        done.release()
+        return _FakeResponse(url.rsplit("/", 1)[-1])
+
+    apihelper.CUSTOM_REQUEST_SENDER = sender
+    join_requests = sum(1 for update in updates if update.chat_join_request is not None)
+
+    async def run():
+        started = time.perf_counter()
+        await async_main.bot.process_new_updates(updates)
+        for _ in range(join_requests):
+            await asyncio.to_thread(done.acquire)
+        return time.perf_counter() - started
+
+    try:
+        return asyncio.run(run())
+    finally:
+        apihelper.CUSTOM_REQUEST_SENDER = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="имитация времени ответа API, секунд")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates)
+    results = {}
+    if args.mode in ("sync", "both"):
+        results["sync"] = bench_sync(updates, args.latency)
+    if args.mode in ("async", "both"):
+        try:
+            results["async"] = bench_async(updates, args.latency)
+        except ImportError as e:
+            print(f"async пропущен: {e}")
+
+    for mode, elapsed in results.items():
+        print(f"{mode:>5}: {len(updates)} апдейтов за {elapsed:.2f} с - {len(updates) / elapsed:.0f} апдейтов/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Бенчмарк горячих путей расписания: хранилище, ответы бота и рассылка.
+
+Генерирует синтетические расписания (по умолчанию 1k/10k/100k постов, --sizes
+до 1M) с файлами и без и замеряет:
+  read          - store.all() (бывший _read_schedule)
+  due           - store.due_before(now), выборка постов к отправке
+  write         - store.add() одного поста в большое расписание (бывший _write_schedule)
+  save_post     - main.finish_schedule_with_media: проверка дубликата, запись, ответ
+  status        - main.handle_schedule_status
+  dispatch      - send_post.main(), 1% постов к отправке
+  import_legacy - перенос старого schedule.json (список с отправленными постами)
+для каждого бэкенда (sqlite, binary, json). Telegram подменяется заглушкой без задержки.
+
+Каждый замер - отдельный процесс, поэтому пиковый RSS (ru_maxrss) относится
+к одному сценарию. Время меряется без трассировки, выделения памяти
+(tracemalloc: пик и число блоков) - повторным прогоном с ней.
+Результаты пишутся в JSON вместе с коммитом, --compare печатает отношение
+времени к прошлому прогону:
+
+    python bench/bench_schedule.py --sizes 1000,10000 --output before.json
+    python bench/bench_schedule.py --sizes 1000,10000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN_ID = 1000
+CASES = ["read", "due", "write", "save_post", "status", "dispatch", "import_legacy"]
+BACKENDS = ["sqlite", "binary", "json"]
+DUE_FRACTION = 0.01
+
+
+def make_posts(count, media, seed=1):
+    """Синтетическое расписание: посты на год вперёд, DUE_FRACTION из них уже пора отправлять"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    posts = []
+    for i in range(count):
+        if rng.random() < DUE_FRACTION:
+            dispatch_at = now - timedelta(seconds=rng.randint(1, 3600))
+        else:
+            dispatch_at = now + timedelta(seconds=rng.randint(60, 365 * 86400))
+        post = {
+            "id": f"post-{i}",
+            "dispatch_at": dispatch_at,
+            "message_text": f"Синтетический пост {i} " + "текст " * rng.randint(1, 40),
+            "media": [],
+        }
+        if media:
+            post["media"] = [
+                {"type": rng.choice(["photo", "video", "document"]), "file_id": f"file-{i}-{n}"}
+                for n in range(rng.randint(1, 5))
+            ]
+        posts.append(post)
+    return posts
+
+
+def write_legacy_json(posts, path):
+    """Старый формат schedule.json: список словарей, часть постов помечена отправленными"""
+    items = []
+    for i, post in enumerate(posts):
+        item = dict(post, dispatch_at=post["dispatch_at"].isoformat())
+        if i % 10 == 0:
+            item["sent"] = True
+        items.append(item)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(items, file, ensure_ascii=False)
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, result):
+        self._payload = {"ok": True, "result": result}
+        self.text = json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+def fake_sender(method, url, **kwargs):
+    message = {"message_id": 1, "date": 0, "chat": {"id": ADMIN_ID, "type": "private"}, "text": "ok"}
+    if url.endswith("sendMediaGroup"):
+        return _FakeResponse([message])
+    if url.endswith("answerCallbackQuery"):
+        return _FakeResponse(True)
+    return _FakeResponse(message)
+
+
+def admin_message(text):
+    from telebot import types
+
+    message = {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": ADMIN_ID, "type": "private"},
+        "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "admin"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return types.Message.de_json(json.dumps(message))
+
+
+def prepare(case, backend, size, media, tmp_dir):
+    """Готовит данные сценария (не входит в замер) и возвращает замеряемую функцию"""
+    os.environ["SCHEDULE_BACKEND"] = backend
+    os.environ["SCHEDULE_DB"] = os.path.join(tmp_dir, "schedule.db")
+    os.environ["SCHEDULE_FILE"] = os.path.join(tmp_dir, "schedule.json")
+    os.environ["SCHEDULE_BIN"] = os.path.join(tmp_dir, "schedule.bin")
+    os.environ["STATE_DB"] = os.path.join(tmp_dir, "state.db")
+    os.environ["OUTBOX_FILE"] = os.path.join(tmp_dir, "schedule.outbox")
+    os.environ["ARCHIVE_DIR"] = os.path.join(tmp_dir, "archive")
+    os.environ.setdefault("BOT_TOKEN", "123:bench")
+    os.environ.setdefault("ADMIN_ID", str(ADMIN_ID))
+    os.environ.setdefault("TARGET_CHAT_ID", str(ADMIN_ID))
+
+    from telebot import apihelper
+
+    import schedule_store
+
+    apihelper.CUSTOM_REQUEST_SENDER = fake_sender
+    posts = make_posts(size, media)
+
+    if case == "import_legacy":
+        write_legacy_json(posts, os.environ["SCHEDULE_FILE"])
+        if backend == "json":
+            # JSON-бэкенд читает старый формат напрямую
+            return lambda: schedule_store.get_store().all()
+        if backend == "binary":
+            store = schedule_store.BinaryScheduleStore(os.environ["SCHEDULE_BIN"])
+        else:
+            store = schedule_store.SQLiteScheduleStore(os.environ["SCHEDULE_DB"])
+        return lambda: schedule_store.import_json_schedule(store, os.environ["SCHEDULE_FILE"])
+
+    schedule_store.get_store().add_many(posts)
+    # Замеряем холодный старт: новый экземпляр хранилища без кэшей, как в свежем процессе
+    schedule_store._store = None
+    store = schedule_store.get_store()
+    new_post = make_posts(1, media, seed=size + 1)[0]
+    new_post["id"] = "new-post"
+
+    if case == "read":
+        return store.all
+    if case == "due":
+        return lambda: store.due_before(datetime.now(timezone.utc))
+    if case == "write":
+        return lambda: store.add(new_post)
+    if case in ("save_post", "status"):
+        import main
+
+        main.bot.threaded = False
+        if case == "status":
+            message = admin_message("/schedule_status")
+            return lambda: main.handle_schedule_status(message)
+        data = {
+            "dispatch_at": int(new_post["dispatch_at"].timestamp()),
+            "message_text": new_post["message_text"],
+            "media": new_post["media"],
+        }
+        message = admin_message("ok")
+        return lambda: main.finish_schedule_with_media(message, data)
+    if case == "dispatch":
+        import send_post
+        from rate_limit import RateLimiter
+
+        # Меряем сам путь рассылки, а не лимиты Telegram
+        send_post.limiter = RateLimiter(global_rate=1_000_000, chat_rate=1_000_000)
+        return send_post.main
+    raise ValueError(f"Неизвестный сценарий: {case}")
+
+
+def run_worker(case, backend, size, media, trace):
+    """Один замер в текущем процессе; печатает результат JSON-строкой"""
+    with tempfile.TemporaryDirectory(prefix="bench_schedule_") as tmp_dir:
+        func = prepare(case, backend, size, media, tmp_dir)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = {}
+        if trace:
+            tracemalloc.start()
+            func()
+            snapshot = tracemalloc.take_snapshot()
+            result["alloc_peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            result["alloc_blocks"] = sum(stat.count for stat in snapshot.statistics("filename"))
+            tracemalloc.stop()
+        else:
+            started = time.perf_counter()
+            func()
+            result["wall_s"] = round(time.perf_counter() - started, 6)
+            result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["setup_rss_kb"] = rss_before
+    # send_post и main печатают свои сообщения, результат - последняя строка вывода
+    print(json.dumps(result))
+
+
+def measure(case, backend, size, media, repeat):
+    """Запускает замеры в отдельных процессах: repeat раз без трассировки (берётся лучшее
+    время) и один раз с tracemalloc"""
+    def spawn(trace):
+        command = [sys.executable, os.path.abspath(__file__), "--worker", case, backend, str(size),
+                   "1" if media else "0", "1" if trace else "0"]
+        output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    runs = [spawn(False) for _ in range(repeat)]
+    result = min(runs, key=lambda run: run["wall_s"])
+    result.update(spawn(True))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result["case"], result["backend"], result["size"], result["media"]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        case, backend, size, media, trace = sys.argv[2:7]
+        run_worker(case, backend, int(size), media == "1", trace == "1")
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры расписаний через запятую")
+    parser.add_argument("--cases", default=",".join(CASES))
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--media", choices=["with", "without", "both"], default="both")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов замера времени")
+    parser.add_argument("--output", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--compare", help="результаты прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    media_options = {"with": [True], "without": [False], "both": [False, True]}[args.media]
+    previous = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            previous = {result_key(result): result for result in json.load(file)["results"]}
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for backend in args.backends.split(","):
+            for media in media_options:
+                for case in args.cases.split(","):
+                    result = {"case": case, "backend": backend, "size": size, "media": media}
+                    result.update(measure(case, backend, size, media, args.repeat))
+                    results.append(result)
+                    line = (f"{case:>13} {backend:>6} {size:>8} {'media' if media else '':>5}: "
+                            f"{result['wall_s'] * 1000:10.2f} мс, RSS {result['peak_rss_kb'] / 1024:7.1f} МБ, "
+                            f"выделено {result['alloc_peak_kb'] / 1024:7.1f} МБ ({result['alloc_blocks']} блоков)")
+                    old = previous.get(result_key(result))
+                    if old:
+                        line += f", x{result['wall_s'] / old['wall_s']:.2f} к {args.compare}"
+                    print(line, flush=True)
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
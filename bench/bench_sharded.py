@@ -0,0 +1,131 @@
+"""Пропускная способность main.py: один процесс (infinity_polling) против --shards N.
+
+Бот запускается отдельным процессом и направляется на локальный bench/fake_api.py
+с задержкой ответа --latency. Нагрузка - --updates команд /schedule_status от
+--users пользователей (не администраторов: на каждую бот отвечает одним
+sendMessage). Сначала каждый пользователь присылает по команде для прогрева
+(импорт, соединения), затем вся пачка сразу; время - до последнего ответа.
+
+Проверяется и порядок: ответы каждому пользователю должны идти в порядке его
+сообщений (reply_parameters.message_id). Остановка - SIGTERM: печатается её время
+и сколько обработанных апдейтов осталось неподтверждёнными (пришли бы повторно).
+
+    python bench/bench_sharded.py --updates 2000 --users 200 --shards 1,2,4
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from fake_api import FakeTelegramApi  # noqa: E402
+
+ADMIN_ID = 1000
+USER_BASE = 5000
+
+
+def make_update(user_id, message_id):
+    return {
+        "message": {
+            "message_id": message_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "text": "/schedule_status",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 16}],
+        },
+    }
+
+
+def replies(api):
+    """(chat_id, message_id исходного сообщения) ответов бота по порядку"""
+    with api._lock:
+        requests = list(api.requests)
+    result = []
+    for _, method, params in requests:
+        if method.lower() != "sendmessage":
+            continue
+        reply = json.loads(params.get("reply_parameters") or "{}")
+        result.append((int(params["chat_id"]), reply.get("message_id")))
+    return result
+
+
+def wait_replies(api, count, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if api.stats()["counts"].get("sendMessage", 0) >= count:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def run_case(name, extra_args, args, env):
+    api = FakeTelegramApi(latency=args.latency).start()
+    env = dict(env, TELEGRAM_API_URL=api.api_url)
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")] + extra_args, env=env, cwd=ROOT,
+                           stdout=subprocess.DEVNULL)
+    try:
+        # Прогрев: по сообщению от каждого пользователя
+        api.push_updates([make_update(USER_BASE + user, 1) for user in range(args.users)])
+        if not wait_replies(api, args.users, 120):
+            raise SystemExit(f"{name}: бот не ответил на прогрев")
+        started = time.perf_counter()
+        api.push_updates([make_update(USER_BASE + number % args.users, 2 + number // args.users)
+                          for number in range(args.updates)])
+        if not wait_replies(api, args.users + args.updates, 600):
+            raise SystemExit(f"{name}: не дождались ответов")
+        elapsed = time.perf_counter() - started
+    finally:
+        stop_started = time.perf_counter()
+        bot.send_signal(signal.SIGTERM)
+        bot.wait(120)
+        stopped = time.perf_counter() - stop_started
+        api.stop()
+
+    last = {}
+    reordered = 0
+    for chat_id, message_id in replies(api):
+        if message_id is not None and message_id < last.get(chat_id, 0):
+            reordered += 1
+        last[chat_id] = max(last.get(chat_id, 0), message_id or 0)
+    # Апдейты, которые Telegram прислал бы повторно после перезапуска
+    unconfirmed = api.pending_updates()
+    print(f"{name:<10} {args.updates / elapsed:8.1f} апд/с, {elapsed:6.2f} с, "
+          f"ответов не по порядку {reordered}, остановка {stopped:.1f} с, неподтверждённых {unconfirmed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="имитация времени ответа API, секунд")
+    parser.add_argument("--shards", default="1,2,4", help="числа процессов через запятую")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_sharded_")
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123:bench",
+        ADMIN_ID=str(ADMIN_ID),
+        SCHEDULE_DB=os.path.join(tmp_dir, "schedule.db"),
+        SCHEDULE_FILE=os.path.join(tmp_dir, "schedule.json"),
+        STATE_DB=os.path.join(tmp_dir, "state.db"),
+        ARCHIVE_DIR=os.path.join(tmp_dir, "archive"),
+    )
+    env.pop("METRICS_PORT", None)
+    env.pop("METRICS_FILE", None)
+    print(f"{args.updates} апдейтов от {args.users} пользователей, задержка API {args.latency * 1000:.0f} мс")
+    run_case("polling", [], args, env)
+    for shards in (int(value) for value in args.shards.split(",")):
+        run_case(f"shards={shards}", ["--shards", str(shards)], args, env)
+
+
+if __name__ == "__main__":
+    main()
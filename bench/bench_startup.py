@@ -0,0 +1,106 @@
+"""Бенчмарк запуска send_post.py из cron, когда отправлять нечего.
+
+Каждый прогон - отдельный процесс, как запуск из cron раз в минуту. Сценарии:
+  python - пустой интерпретатор (python -c pass), нижняя граница
+  fast   - есть файл-подсказка next_due, ближайший пост в будущем: выход до импортов
+  full   - подсказки нет: импорт telebot и хранилища, чтение расписания (поведение до неё)
+Для каждого печатаются медиана и минимум времени, пиковый RSS процесса и число
+импортированных модулей (по -X importtime). Расписание - --posts будущих постов.
+
+    python bench/bench_startup.py --backend sqlite --posts 10000 --runs 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEND_POST = os.path.join(ROOT, "send_post.py")
+
+
+def run_once(command, env):
+    """(секунды, пиковый RSS в МБ) одного процесса"""
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise SystemExit(f"{' '.join(command)} завершился с кодом {process.returncode}")
+    # ru_maxrss на Linux в килобайтах, на macOS - в байтах
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return elapsed, rss
+
+
+def count_imports(command, env):
+    """Сколько модулей импортирует процесс"""
+    result = subprocess.run([command[0], "-X", "importtime"] + command[1:], env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    return sum(1 for line in result.stderr.splitlines() if line.startswith("import time:") and "|" in line) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "binary", "json"], default="sqlite")
+    parser.add_argument("--posts", type=int, default=10000, help="постов в расписании")
+    parser.add_argument("--runs", type=int, default=20, help="запусков на сценарий")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(
+        os.environ,
+        SCHEDULE_BACKEND=args.backend,
+        SCHEDULE_DB=os.path.join(tmp_dir, "schedule.db"),
+        SCHEDULE_FILE=os.path.join(tmp_dir, "schedule.json"),
+        SCHEDULE_BIN=os.path.join(tmp_dir, "schedule.bin"),
+        OUTBOX_FILE=os.path.join(tmp_dir, "schedule.outbox"),
+        ARCHIVE_DIR=os.path.join(tmp_dir, "archive"),
+        BOT_TOKEN=os.getenv("BOT_TOKEN", "123:bench"),
+        TARGET_CHAT_ID=os.getenv("TARGET_CHAT_ID", "1000"),
+        # Отправлять нечего, но на всякий случай - никуда не ходить
+        TELEGRAM_API_URL="http://127.0.0.1:9/bot{0}/{1}",
+    )
+    os.environ.update(env)
+    from next_due import next_due_path
+    from schedule_store import Post, get_store
+
+    now = int(time.time())
+    get_store().add_many([Post(f"post-{number}", now + 3600 + number, f"пост {number}") for number in range(args.posts)])
+    hint = next_due_path()
+
+    def drop_hint():
+        if os.path.exists(hint):
+            os.remove(hint)
+
+    scenarios = [
+        ("python", [sys.executable, "-c", "pass"], None),
+        ("fast", [sys.executable, SEND_POST], None),
+        ("full", [sys.executable, SEND_POST], drop_hint),
+    ]
+    print(f"{args.backend}, {args.posts} постов в расписании, {args.runs} запусков")
+    for name, command, prepare in scenarios:
+        timings, peaks = [], []
+        for _ in range(args.runs):
+            if prepare:
+                prepare()
+            elapsed, rss = run_once(command, env)
+            timings.append(elapsed)
+            peaks.append(rss)
+        if prepare:
+            prepare()
+        modules = count_imports(command, env)
+        print(f"  {name:<7} медиана {statistics.median(timings) * 1000:7.1f} мс, "
+              f"минимум {min(timings) * 1000:7.1f} мс, RSS {max(peaks):6.1f} МБ, модулей {modules}")
+    # Полный проход восстанавливает подсказку
+    if not os.path.exists(hint):
+        subprocess.run([sys.executable, SEND_POST], env=env, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+    print(f"  подсказка после полного прохода: {open(hint).read()}")
+
+
+if __name__ == "__main__":
+    main()
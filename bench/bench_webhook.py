@@ -0,0 +1,174 @@
+"""Сквозная задержка обработки апдейта: long polling против webhook.
+
+Задержка - время от появления апдейта (в очереди getUpdates для polling или
+начала POST-запроса для webhook) до ответа бота. Ответы Telegram подменяются
+заглушкой с задержкой --latency. Апдейты - /schedule_status от --users
+пользователей по кругу, на каждый бот отвечает одним sendMessage. Webhook-сервер
+обрабатывает апдейты одного пользователя по порядку в одном потоке, поэтому
+при одном пользователе его пул не помогает.
+
+    python bench/bench_webhook.py --updates 300 --interval 0.01
+"""
+import argparse
+import json
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADMIN_ID = 1000
+USER_BASE = 5000
+_tmp_dir = tempfile.mkdtemp(prefix="bench_webhook_")
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ.setdefault("ADMIN_ID", str(ADMIN_ID))
+os.environ["SCHEDULE_DB"] = os.path.join(_tmp_dir, "schedule.db")
+os.environ["SCHEDULE_FILE"] = os.path.join(_tmp_dir, "schedule.json")
+os.environ["STATE_DB"] = os.path.join(_tmp_dir, "state.db")
+os.environ["ARCHIVE_DIR"] = os.path.join(_tmp_dir, "archive")
+
+from telebot import apihelper  # noqa: E402
+
+import main  # noqa: E402
+from webhook import WebhookServer  # noqa: E402
+
+SECRET = "bench-secret"
+
+
+def make_update(update_id, users):
+    user_id = USER_BASE + update_id % users
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "text": "/schedule_status",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 16}],
+        },
+    }
+
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, result):
+        self._payload = {"ok": True, "result": result}
+        self.text = json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeApi:
+    """Заглушка Bot API: очередь для getUpdates и фиксация времени ответов бота"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.pending = queue.Queue()
+        self.replied = {}  # message_id исходного сообщения -> время ответа
+        self.done = threading.Semaphore(0)
+
+    def __call__(self, method, url, params=None, **kwargs):
+        method_name = url.rsplit("/", 1)[-1]
+        if method_name == "getUpdates":
+            return _FakeResponse(self._get_updates(params or {}))
+        if method_name == "getMe":
+            return _FakeResponse({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        time.sleep(self.latency)
+        if method_name == "sendMessage":
+            reply = json.loads(params.get("reply_parameters", "{}"))
+            self.replied[reply.get("message_id")] = time.perf_counter()
+            self.done.release()
+            return _FakeResponse({"message_id": 1, "date": 0, "chat": {"id": ADMIN_ID, "type": "private"}})
+        return _FakeResponse(True)
+
+    def _get_updates(self, params):
+        # Long polling: ждём первый апдейт до timeout, затем забираем всё накопившееся
+        time.sleep(self.latency)
+        try:
+            updates = [self.pending.get(timeout=float(params.get("timeout", 1)))]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                updates.append(self.pending.get_nowait())
+            except queue.Empty:
+                return updates
+
+
+def bench_polling(api, count, interval, users):
+    sent = {}
+    thread = threading.Thread(
+        target=main.bot.polling, kwargs={"non_stop": True, "timeout": 1, "long_polling_timeout": 1}, daemon=True
+    )
+    thread.start()
+    for update_id in range(1, count + 1):
+        sent[update_id] = time.perf_counter()
+        api.pending.put(make_update(update_id, users))
+        time.sleep(interval)
+    for _ in range(count):
+        api.done.acquire()
+    main.bot.stop_polling()
+    return [api.replied[update_id] - started for update_id, started in sent.items()]
+
+
+def bench_webhook(api, count, interval, users):
+    main.bot.threaded = False
+    server = WebhookServer(main.bot, "127.0.0.1", 0, secret_token=SECRET)
+    server.start()
+    host, port = server.address
+    url = f"http://{host}:{port}/telegram"
+    sent = {}
+    try:
+        for update_id in range(count + 1, 2 * count + 1):
+            body = json.dumps(make_update(update_id, users)).encode()
+            request = urllib.request.Request(url, data=body, headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": SECRET,
+            })
+            sent[update_id] = time.perf_counter()
+            urllib.request.urlopen(request).read()
+            time.sleep(interval)
+        for _ in range(count):
+            api.done.acquire()
+    finally:
+        server.stop()
+        main.bot.threaded = True
+    return [api.replied[update_id] - started for update_id, started in sent.items()]
+
+
+def describe(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:>8}: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+        f"p95 {p95 * 1000:.1f} мс, максимум {latencies[-1] * 1000:.1f} мс"
+    )
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01, help="пауза между апдейтами, секунд")
+    parser.add_argument("--latency", type=float, default=0.02, help="имитация времени ответа API, секунд")
+    parser.add_argument("--users", type=int, default=20, help="сколько пользователей присылают апдейты")
+    args = parser.parse_args()
+
+    api = FakeApi(args.latency)
+    apihelper.CUSTOM_REQUEST_SENDER = api
+    try:
+        describe("polling", bench_polling(api, args.updates, args.interval, args.users))
+        describe("webhook", bench_webhook(api, args.updates, args.interval, args.users))
+    finally:
+        apihelper.CUSTOM_REQUEST_SENDER = None
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,300 @@
+"""Локальная замена Telegram Bot API для нагрузочных и регрессионных прогонов
+
+Реализует методы, которыми пользуются main.py и send_post.py: getMe, getUpdates
+(с long polling), sendMessage, sendPhoto/Document/Video/Audio, sendMediaGroup,
+approveChatJoinRequest, answerCallbackQuery, deleteWebhook/setWebhook.
+Загруженные файлы получают новый file_id в ответе, как у настоящего API; их число
+и объём видны в /_stats.
+Умеет отвечать с задержкой, с заданной вероятностью возвращать 429 (flood control)
+и записывает все запросы.
+
+Запуск отдельным процессом и бот, направленный на него:
+
+    python bench/fake_api.py --port 8081 --latency 0.05 --error-rate 0.01 --record requests.jsonl
+    TELEGRAM_API_URL='http://127.0.0.1:8081/bot{0}/{1}' python main.py
+
+Служебные адреса для генератора нагрузки:
+    POST /_updates  - JSON-апдейт или список апдейтов, отдаются боту через getUpdates
+    GET  /_stats    - число запросов по методам, ответов 429 и необработанных апдейтов
+
+Из кода бенчмарков сервер запускается так же: FakeTelegramApi(...).start().
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+SEND_METHODS = {"sendmessage", "sendphoto", "senddocument", "sendvideo", "sendaudio"}
+MEDIA_METHODS = {"sendphoto": "photo", "senddocument": "document", "sendvideo": "video", "sendaudio": "audio"}
+# Поля вложения в ответе, без которых telebot не разберёт сообщение
+MEDIA_FIELDS = {"photo": {"width": 1, "height": 1}, "video": {"width": 1, "height": 1, "duration": 1},
+                "audio": {"duration": 1}, "document": {}}
+TRUE_METHODS = {"approvechatjoinrequest", "answercallbackquery", "deletewebhook", "setwebhook"}
+
+
+def parse_body(content_type, body):
+    """Параметры из тела запроса: form-urlencoded, JSON или multipart
+    (вместо содержимого файла - {"upload": размер в байтах})"""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is None:
+                params[name] = part.get_content()
+            else:
+                params[name] = {"upload": len(part.get_payload(decode=True))}
+        return params
+    return dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+
+
+class FakeTelegramApi:
+    """HTTP-сервер, отвечающий как Bot API. Потокобезопасен, каждый запрос - свой поток."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, retry_after=1,
+                 record=True, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.record = record
+        self.requests = []  # (время, метод, параметры)
+        self.counts = {}
+        self.throttled = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._updates = []  # апдейты, ещё не подтверждённые offset'ом
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._next_file_id = 1
+        self._updates_ready = threading.Condition(self._lock)
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self):
+        """Шаблон для telebot.apihelper.API_URL"""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+            # Заголовки и тело уходят разными записями: с Nagle и отложенным ACK клиента
+            # каждый ответ keep-alive соединения задерживался бы на ~40 мс
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if url.path == "/_stats":
+                    self._respond(200, api.stats())
+                    return
+                try:
+                    if url.path == "/_updates":
+                        updates = json.loads(body)
+                        api.push_updates(updates if isinstance(updates, list) else [updates])
+                        self._respond(200, {"ok": True})
+                        return
+                    params = dict(parse_qsl(url.query, keep_blank_values=True))
+                    params.update(parse_body(self.headers.get("Content-Type", ""), body))
+                except ValueError:
+                    self._respond(400, {"ok": False, "error_code": 400, "description": "Bad Request"})
+                    return
+                self._respond(*api.handle(url.path.rsplit("/", 1)[-1], params))
+
+            def _respond(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # клиент закрыл соединение, не дождавшись ответа (остановка бота)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def push_updates(self, updates):
+        """Ставит апдейты в очередь getUpdates; update_id назначается, если его нет"""
+        with self._updates_ready:
+            for update in updates:
+                update = dict(update)
+                update.setdefault("update_id", self._next_update_id)
+                self._next_update_id = max(self._next_update_id, update["update_id"]) + 1
+                self._updates.append(update)
+            self._updates_ready.notify_all()
+
+    def pending_updates(self):
+        with self._lock:
+            return len(self._updates)
+
+    def handle(self, method, params):
+        """Ответ на вызов метода: (HTTP-статус, JSON)"""
+        name = method.lower()
+        with self._lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+            if self.record:
+                self.requests.append((time.time(), method, params))
+            throttle = name != "getupdates" and self.error_rate and self._random.random() < self.error_rate
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        if name == "getupdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        if name == "getme":
+            return 200, {"ok": True, "result": BOT_USER}
+        if name in TRUE_METHODS:
+            return 200, {"ok": True, "result": True}
+        if name in SEND_METHODS:
+            message = self._message(params, params.get("text") or params.get("caption"))
+            if name in MEDIA_METHODS:
+                media_type = MEDIA_METHODS[name]
+                self._attach(message, media_type, params.get(media_type))
+            return 200, {"ok": True, "result": message}
+        if name == "sendmediagroup":
+            media = json.loads(params.get("media") or "[]")
+            messages = []
+            for item in media:
+                message = self._message(params, item.get("caption"))
+                reference = item.get("media", "")
+                if reference.startswith("attach://"):
+                    reference = params.get(reference[len("attach://"):])
+                self._attach(message, item.get("type", "document"), reference)
+                messages.append(message)
+            return 200, {"ok": True, "result": messages}
+        return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._updates_ready:
+            # offset подтверждает все апдейты с меньшим id, как в настоящем API
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            return self._updates[:limit]
+
+    def _message(self, params, text):
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        chat_id = params.get("chat_id", 0)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+            "from": BOT_USER,
+        }
+        if text:
+            message["text"] = text
+        return message
+
+    def _attach(self, message, media_type, reference):
+        """Вложение в ответе: загруженный файл получает новый file_id, переданный file_id - тот же"""
+        if isinstance(reference, dict):
+            with self._lock:
+                file_id = f"fake-file-{self._next_file_id}"
+                self._next_file_id += 1
+                self.uploads += 1
+                self.uploaded_bytes += reference["upload"]
+        else:
+            file_id = str(reference)
+        attachment = dict(MEDIA_FIELDS.get(media_type, {}), file_id=file_id, file_unique_id=file_id)
+        message[media_type] = [attachment] if media_type == "photo" else attachment
+
+    def stats(self):
+        with self._lock:
+            return {
+                "counts": dict(self.counts),
+                "throttled": self.throttled,
+                "uploads": self.uploads,
+                "uploaded_bytes": self.uploaded_bytes,
+                "pending_updates": len(self._updates),
+            }
+
+    def dump_requests(self, path):
+        """Записывает журнал запросов в JSONL"""
+        with self._lock:
+            requests = list(self.requests)
+        with open(path, "w", encoding="utf-8") as file:
+            for at, method, params in requests:
+                file.write(json.dumps({"at": at, "method": method, "params": params}, ensure_ascii=False) + "\n")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument("--record", help="куда записать журнал запросов (JSONL) при остановке")
+    args = parser.parse_args()
+
+    api = FakeTelegramApi(args.host, args.port, args.latency, args.error_rate, args.retry_after,
+                          record=bool(args.record))
+    api.start()
+    print(f"Fake Bot API: TELEGRAM_API_URL='{api.api_url}'")
+    try:
+        api._thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.stop()
+        print(json.dumps(api.stats(), ensure_ascii=False))
+        if args.record:
+            api.dump_requests(args.record)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Стресс-тест расписания: бот и рассылка одновременно пишут в одно хранилище.
+
+Несколько процессов-писателей (как бот на /schedule) добавляют по --posts постов,
+половина из них уже к отправке. Параллельно процесс-рассыльщик (как send_post.py)
+в цикле забирает наступившие посты, удаляет их и переписывает чаты у одного из
+будущих постов. В конце проверяется, что ни одно обновление не потеряно:
+  потеряно    - пост добавлен, но его нет ни в расписании, ни среди отправленных
+  воскрешено  - пост отправлен и удалён, но снова оказался в расписании
+
+    python bench/stress_schedule.py --backend json --writers 2 --posts 2000
+    python bench/stress_schedule.py --backend json --unlocked   # без межпроцессной блокировки
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FUTURE = 10 ** 6  # насколько вперёд планируются посты, которые не должны отправиться
+
+
+def open_store(args):
+    from schedule_store import get_store
+
+    store = get_store()
+    if args.unlocked and hasattr(store, "_lock"):
+        # Как было раньше: блокировка только внутри процесса
+        store._lock = threading.Lock()
+    return store
+
+
+def run_writer(args):
+    from schedule_store import Post
+
+    store = open_store(args)
+    now = int(time.time())
+    for number in range(args.posts):
+        dispatch_at = now - 1 if number % 2 else now + FUTURE
+        store.add(Post(f"w{args.index}-{number}", dispatch_at, f"пост {number} писателя {args.index}"))
+
+
+def run_dispatcher(args):
+    store = open_store(args)
+    stop_file = os.path.join(args.dir, "stop")
+    with open(os.path.join(args.dir, "sent.log"), "a", encoding="utf-8") as sent_log:
+        while True:
+            stopping = os.path.exists(stop_file)
+            due = store.due_before(time.time())
+            if due:
+                sent_log.write("".join(post.id + "\n" for post in due))
+                sent_log.flush()
+                store.delete_many([post.id for post in due])
+            future = store.all()
+            if future:
+                # Чтение-изменение-запись одного поста, как при частичной доставке
+                store.set_targets(future[-1].id, ["1", "2"])
+            if stopping:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["json", "binary", "sqlite"], default="json")
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--posts", type=int, default=1000, help="постов на писателя")
+    parser.add_argument("--unlocked", action="store_true", help="отключить межпроцессную блокировку")
+    parser.add_argument("--role", choices=["writer", "dispatcher"], help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "writer":
+        run_writer(args)
+        return
+    if args.role == "dispatcher":
+        run_dispatcher(args)
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix="stress_schedule_")
+    env = dict(
+        os.environ,
+        SCHEDULE_BACKEND=args.backend,
+        SCHEDULE_FILE=os.path.join(tmp_dir, "schedule.json"),
+        SCHEDULE_BIN=os.path.join(tmp_dir, "schedule.bin"),
+        SCHEDULE_DB=os.path.join(tmp_dir, "schedule.db"),
+    )
+    common = [sys.executable, os.path.abspath(__file__), "--backend", args.backend, "--posts", str(args.posts),
+              "--dir", tmp_dir] + (["--unlocked"] if args.unlocked else [])
+
+    started = time.perf_counter()
+    dispatcher = subprocess.Popen(common + ["--role", "dispatcher"], env=env)
+    writers = [subprocess.Popen(common + ["--role", "writer", "--index", str(index)], env=env)
+               for index in range(args.writers)]
+    for writer in writers:
+        writer.wait()
+    open(os.path.join(tmp_dir, "stop"), "w").close()
+    dispatcher.wait()
+    elapsed = time.perf_counter() - started
+
+    os.environ.update(env)
+    from schedule_store import get_store
+
+    remaining = {post.id for post in get_store().all()}
+    with open(os.path.join(tmp_dir, "sent.log"), encoding="utf-8") as sent_log:
+        sent = {line.strip() for line in sent_log if line.strip()}
+    expected = {f"w{index}-{number}" for index in range(args.writers) for number in range(args.posts)}
+    lost = expected - remaining - sent
+    resurrected = remaining & sent
+
+    print(f"{args.backend}{' без блокировки' if args.unlocked else ''}: "
+          f"{len(expected)} вставок от {args.writers} процессов за {elapsed:.1f} с, "
+          f"отправлено {len(sent)}, в расписании {len(remaining)}, "
+          f"потеряно {len(lost)}, воскрешено {len(resurrected)}")
+    if lost or resurrected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Запросы к Bot API мимо методов TeleBot: потоковая загрузка файлов (file_cache),
+скачивание документов (bulk_import), подтверждение offset (sharded)
+
+Используются только публичные части pyTelegramBotAPI - настройки apihelper
+(API_URL, proxy, CONNECT_TIMEOUT, READ_TIMEOUT, CUSTOM_REQUEST_SENDER) и
+классы исключений; HTTP - свой requests.Session на поток, ответ разбирается здесь.
+Поэтому обновление библиотеки не ломает эти запросы через её внутренние функции,
+а ошибки выглядят так же, как у методов TeleBot (ApiTelegramException).
+"""
+import threading
+
+import requests
+from telebot import apihelper
+
+_local = threading.local()
+
+
+def session():
+    """requests.Session текущего потока (соединения переиспользуются, как в TeleBot)"""
+    if getattr(_local, "session", None) is None:
+        _local.session = requests.Session()
+    return _local.session
+
+
+def method_url(token, method_name):
+    """Адрес метода с учётом apihelper.API_URL (например, локальный bench/fake_api.py)"""
+    if apihelper.API_URL:
+        return apihelper.API_URL.format(token, method_name)
+    return f"https://api.telegram.org/bot{token}/{method_name}"
+
+
+def send(method, url, **kwargs):
+    """HTTP-запрос; через CUSTOM_REQUEST_SENDER, если он задан, - так запрос попадает в метрики API"""
+    kwargs.setdefault("timeout", (apihelper.CONNECT_TIMEOUT, apihelper.READ_TIMEOUT))
+    kwargs.setdefault("proxies", apihelper.proxy)
+    if apihelper.CUSTOM_REQUEST_SENDER:
+        return apihelper.CUSTOM_REQUEST_SENDER(method, url, **kwargs)
+    return session().request(method, url, **kwargs)
+
+
+def parse_result(method_name, response):
+    """result ответа Bot API; ошибки - исключениями apihelper, как у методов TeleBot"""
+    try:
+        payload = response.json()
+    except ValueError:
+        if response.status_code != 200:
+            raise apihelper.ApiHTTPException(method_name, response) from None
+        raise apihelper.ApiInvalidJSONException(method_name, response) from None
+    if not isinstance(payload, dict):
+        raise apihelper.ApiInvalidJSONException(method_name, response)
+    if not payload.get("ok"):
+        # ApiTelegramException требует error_code и description
+        error = {"error_code": response.status_code, "description": response.reason or ""}
+        error.update(payload)
+        raise apihelper.ApiTelegramException(method_name, response, error)
+    return payload.get("result")
+
+
+def call(token, method_name, params=None, **kwargs):
+    """Вызов метода Bot API с параметрами формы; возвращает result"""
+    return parse_result(method_name, send("post", method_url(token, method_name), data=params, **kwargs))
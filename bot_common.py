@@ -0,0 +1,559 @@
+"""Общая логика бота: настройки и шаги /schedule без привязки к конкретному TeleBot.
+
+Используется синхронным режимом (main.py) и асинхронным (async_main.py),
+поэтому набор команд и тексты ответов у них одинаковые.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from telebot import apihelper
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from archive import get_archive, parse_month
+from bulk_import import ImportReport, detect_format, download_lines, import_lines
+from metrics import SCHEDULE_POSTS, STORE_SECONDS
+from recurrence import parse_rule
+from schedule_store import Post, Rule, get_store
+from state_store import get_state_store
+
+# Часовые пояса
+MSK_TZ = timezone(timedelta(hours=3))  # МСК = UTC+3
+UTC_TZ = timezone.utc  # UTC
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+ADMIN_ID = os.getenv("ADMIN_ID")
+
+if not BOT_TOKEN:
+    raise ValueError("BOT_TOKEN не найден в переменных окружения!")
+if not ADMIN_ID:
+    raise ValueError("ADMIN_ID не найден в переменных окружения!")
+try:
+    ADMIN_ID_INT = int(ADMIN_ID)
+except ValueError as exc:
+    raise ValueError("ADMIN_ID должен быть числом Telegram пользователя.") from exc
+
+# Адрес Bot API в формате apihelper.API_URL, например http://127.0.0.1:8081/bot{0}/{1}
+# для локального bench/fake_api.py; по умолчанию - настоящий api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL
+
+ALLOWED_UPDATES = ["message", "callback_query", "chat_join_request"]
+
+# Шаги диалога /schedule; само состояние живёт в state_store
+STEP_TEXT = "text"  # ждём текст поста
+STEP_MEDIA = "media"  # собираем файлы до нажатия 'Продолжить'
+STEP_IMPORT = "import"  # ждём документ для /import
+
+SUPPORTED_MEDIA_TYPES = ("photo", "document", "video", "audio")
+
+ADMIN_ONLY_TEXT = "Эта команда доступна только администратору."
+STEP_NOT_FOUND_TEXT = "Ошибка: этап не найден. Начните с /schedule."
+MEDIA_PROMPT_TEXT = (
+    "Теперь вы можете отправить 1 или несколько файлов (фото, видео, документ, аудио).\n"
+    "Когда закончите — нажмите 'Продолжить'."
+)
+MEDIA_ADDED_TEXT = "Файл добавлен! Можете отправить ещё или нажмите 'Продолжить' для завершения."
+ALBUM_ADDED_TEXT = "Альбом добавлен, файлов: {count}! Можете отправить ещё или нажмите 'Продолжить' для завершения."
+
+ALBUM_DEBOUNCE = 1.0  # секунд тишины, после которых альбом считается полученным
+
+PAGE_SIZE = 20  # постов на странице /schedule_status и /archive
+PREVIEW_LENGTH = 30  # символов текста поста в списках
+ERROR_PREVIEW_LENGTH = 200  # символов ошибки в /dead_letters
+# callback_data кнопок листания: префикс, затем номер страницы
+# (у архива между ними ещё месяц: archive_page:2026-10:3)
+STATUS_PAGE_CALLBACK = "status_page:"
+ARCHIVE_PAGE_CALLBACK = "archive_page:"
+STATUS_CACHE_PAGES = 64  # сколько готовых страниц держать для одной версии расписания
+ARCHIVE_USAGE_TEXT = "Укажите месяц в формате: /archive YYYY-MM"
+IMPORT_PROMPT_TEXT = (
+    "Отправьте файл CSV (колонки dispatch_at, message_text, media, targets) или JSON Lines "
+    "(по посту на строку). Время - YYYY-MM-DD HH:MM по Москве. "
+    "Можно сразу прислать файл с подписью /import."
+)
+REPEAT_USAGE_TEXT = (
+    "Формат: /schedule_repeat <минута час день месяц день_недели> (cron, по Москве)\n"
+    "Например: /schedule_repeat 0 9 * * 1-5 - по будням в 09:00"
+)
+REQUEUE_USAGE_TEXT = "Формат: /requeue ID или /requeue all (список - /dead_letters)"
+
+
+def is_admin(user_id):
+    return str(user_id) == ADMIN_ID
+
+
+def done_markup():
+    """Инлайн-кнопка завершения загрузки файлов"""
+    markup = InlineKeyboardMarkup()
+    markup.add(InlineKeyboardButton("Продолжить", callback_data="done_media_upload"))
+    return markup
+
+
+def parse_schedule_command(text):
+    """Разбирает '/schedule YYYY-MM-DD HH:MM'. Возвращает (dispatch_at_utc, текст ответа);
+    при ошибке dispatch_at_utc равен None."""
+    parts = text.split(maxsplit=2)
+    if len(parts) < 3:
+        return None, (
+            "Формат: /schedule YYYY-MM-DD HH:MM\n"
+            "Сначала отправьте дату и время, например:/schedule 2025-12-01 16:30"
+        )
+
+    time_part = parts[1] + " " + parts[2]
+    try:
+        dispatch_at_msk = datetime.strptime(time_part, "%Y-%m-%d %H:%M")
+        dispatch_at_msk = dispatch_at_msk.replace(tzinfo=MSK_TZ)
+    except ValueError:
+        return None, "Неверный формат даты. Используй YYYY-MM-DD HH:MM."
+
+    dispatch_at_utc = dispatch_at_msk.astimezone(UTC_TZ)
+    now_utc = datetime.now(UTC_TZ)
+    if dispatch_at_utc <= now_utc:
+        return None, "Время должно быть в будущем."
+
+    return dispatch_at_utc, (
+        f"ОК! Дата и время запланированы: {dispatch_at_msk.strftime('%Y-%m-%d %H:%M')} МСК\n"
+        "Теперь отправьте текст сообщения, который надо запланировать."
+    )
+
+
+def start_import(user_id):
+    """/import: следующий документ от пользователя - файл для импорта"""
+    get_state_store().set(user_id, {"step": STEP_IMPORT})
+
+
+def awaiting_import(message):
+    """Документ для импорта: с подписью /import или присланный после команды /import"""
+    if (message.caption or "").startswith("/import"):
+        return True
+    data = get_state_store().get(message.from_user.id)
+    return data is not None and data.get("step") == STEP_IMPORT
+
+
+def import_document(user_id, file_id, file_name):
+    """Импортирует присланный документ (см. bulk_import) и возвращает текст отчёта.
+    Файл скачивается и разбирается потоком, посты пишутся пачками."""
+    # Незаконченный диалог /schedule не трогаем, снимаем только ожидание файла
+    get_state_store().update(
+        user_id, lambda data: (None if data and data.get("step") == STEP_IMPORT else data, None)
+    )
+    report = ImportReport()
+    try:
+        url = apihelper.get_file_url(BOT_TOKEN, file_id)
+        with STORE_SECONDS.time(operation="import"):
+            import_lines(download_lines(url), detect_format(file_name), report=report)
+    except (apihelper.ApiException, OSError) as e:
+        if not report.imported:
+            return f"Не удалось скачать файл: {str(e)[:200]}"
+        # Пачки, записанные до обрыва, остаются в расписании
+        SCHEDULE_POSTS.set(get_store().count())
+        return (f"Файл скачан не полностью: {str(e)[:200]}\n"
+                f"Посты до обрыва уже в расписании. {report.render()}\n"
+                "При повторном /import этого файла уже записанные посты будут пропущены как дубликаты.")
+    SCHEDULE_POSTS.set(get_store().count())
+    return report.render()
+
+
+def parse_repeat_command(text):
+    """Разбирает '/schedule_repeat <cron>'. Возвращает (выражение, первая отправка в UTC,
+    текст ответа); при ошибке выражение равно None."""
+    parts = text.split(maxsplit=1)
+    rule = parse_rule(parts[1]) if len(parts) > 1 else None
+    next_run = rule.next_after(time.time()) if rule else None
+    if next_run is None:
+        return None, None, REPEAT_USAGE_TEXT
+    return rule.expression, datetime.fromtimestamp(next_run, UTC_TZ), (
+        f"ОК! Повтор по правилу '{rule.expression}', первая отправка {format_msk(next_run)} МСК\n"
+        "Теперь отправьте текст сообщения, который надо запланировать."
+    )
+
+
+def start_schedule(user_id, dispatch_at_utc, rule=None):
+    """Первый шаг /schedule: запоминаем время отправки и ждём текст.
+    rule - cron-выражение для /schedule_repeat"""
+    data = {
+        "step": STEP_TEXT,
+        "dispatch_at": int(dispatch_at_utc.timestamp()),
+    }
+    if rule:
+        data["rule"] = rule
+    get_state_store().set(user_id, data)
+
+
+def awaiting_message_text(user_id):
+    """Ждём ли от пользователя текст поста (шаг сразу после /schedule)"""
+    data = get_state_store().get(user_id)
+    return data is not None and data.get("step") == STEP_TEXT
+
+
+def accept_message_text(user_id, text):
+    """Второй шаг /schedule: запоминаем текст и открываем этап сбора файлов.
+    Возвращает False, если этап не найден."""
+    def step(data):
+        if data is None:
+            return None, False
+        # Начинаем этап сбора файлов
+        result = {
+            "step": STEP_MEDIA,
+            "dispatch_at": data["dispatch_at"],
+            "message_text": text if text else "Привет",
+            "media": [],
+        }
+        if data.get("rule"):
+            result["rule"] = data["rule"]
+        return result, True
+
+    return get_state_store().update(user_id, step)
+
+
+def collecting_media(user_id):
+    """Открыт ли у пользователя этап сбора файлов (проверка без записи)"""
+    data = get_state_store().get(user_id)
+    return data is not None and data.get("step") == STEP_MEDIA
+
+
+def extract_media(message):
+    """Файлы сообщения. Telegram присылает фото в нескольких размерах - берём только самый большой."""
+    media = []
+    for attr in SUPPORTED_MEDIA_TYPES:
+        file = getattr(message, attr, None)
+        if file:
+            if isinstance(file, list):
+                file = max(file, key=lambda size: (size.width * size.height, size.file_size or 0))
+            media.append({"type": attr, "file_id": file.file_id})
+    return media
+
+
+def add_media_items(user_id, items):
+    """Добавляет файлы к открытому этапу сбора одной записью. Возвращает True, если что-то добавлено."""
+    if not items:
+        return False
+
+    def step(data):
+        if not data or data.get("step") != STEP_MEDIA:
+            return data, False
+        data["media"].extend(items)
+        return data, True
+
+    return get_state_store().update(user_id, step)
+
+
+def add_media(user_id, message):
+    """Добавляет файлы сообщения к открытому этапу сбора. Возвращает True, если что-то добавлено."""
+    # Быстрая проверка без записи: медиа от пользователей вне диалога просто игнорируем
+    if not collecting_media(user_id):
+        return False  # Игнор отсутсвия этапа
+    return add_media_items(user_id, extract_media(message))
+
+
+class AlbumCollector:
+    """Собирает сообщения одного альбома (media_group_id) в одну пачку.
+
+    Telegram присылает альбом отдельными сообщениями подряд. Каждое новое сообщение
+    откладывает сброс на ALBUM_DEBOUNCE секунд; после тишины файлы альбома пишутся
+    в состояние одной записью и вызывается on_album(первое сообщение, число файлов) -
+    один ответ на весь альбом."""
+
+    def __init__(self, on_album, delay=ALBUM_DEBOUNCE):
+        self.on_album = on_album
+        self.delay = delay
+        self._albums = {}  # (user_id, media_group_id) -> {"message", "items", "timer"}
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        key = (message.from_user.id, message.media_group_id)
+        with self._lock:
+            album = self._albums.get(key)
+            if album is None:
+                album = {"message": message, "items": [], "timer": None}
+                self._albums[key] = album
+            album["items"].extend(extract_media(message))
+            if album["timer"] is not None:
+                album["timer"].cancel()
+            album["timer"] = threading.Timer(self.delay, self._flush, args=(key,))
+            album["timer"].daemon = True
+            album["timer"].start()
+
+    def flush_user(self, user_id):
+        """Сразу сбрасывает недособранные альбомы пользователя (перед нажатием 'Продолжить')"""
+        with self._lock:
+            keys = [key for key in self._albums if key[0] == user_id]
+        for key in keys:
+            self._flush(key)
+
+    def _flush(self, key):
+        with self._lock:
+            album = self._albums.pop(key, None)
+        if album is None:
+            return
+        album["timer"].cancel()
+        if add_media_items(key[0], album["items"]):
+            self.on_album(album["message"], len(album["items"]))
+
+
+def finish_media_upload(user_id):
+    """Закрывает этап сбора файлов и возвращает данные поста (None, если этапа нет)"""
+    data = get_state_store().update(
+        user_id, lambda data: (None, data) if data and data.get("step") == STEP_MEDIA else (data, None)
+    )
+    return data
+
+
+def format_msk(epoch):
+    """Время отправки (epoch-секунды UTC) в виде 'YYYY-MM-DD HH:MM' по Москве"""
+    return datetime.fromtimestamp(epoch, MSK_TZ).strftime('%Y-%m-%d %H:%M')
+
+
+def save_scheduled_post(data):
+    """Сохраняет пост в расписание и возвращает текст ответа администратору"""
+    store = get_store()
+    if data.get("rule"):
+        return save_repeat_rule(store, data)
+    post = Post(str(uuid.uuid4()), data["dispatch_at"], data["message_text"], data.get("media") or [])
+    # Дубликаты запрещаем если совпадает всё (поиск по индексу хэшей содержимого)
+    with STORE_SECONDS.time(operation="lookup"):
+        duplicate = store.has_duplicate(post)
+    if duplicate:
+        return "Пост с таким содержимым уже есть!"
+    # Добавляем пост
+    with STORE_SECONDS.time(operation="write"):
+        store.add(post)
+    verify_count = store.count()
+    SCHEDULE_POSTS.set(verify_count)
+    return (
+        f"Пост запланирован на {format_msk(post.dispatch_at)} МСК!\n"
+        f"Всего запланировано: {verify_count}\nФайлов прикреплено: {len(post.media)}"
+    )
+
+
+def save_repeat_rule(store, data):
+    """Сохраняет повторяющийся пост одним правилом (см. recurrence)"""
+    # Первая отправка считается заново: диалог мог занять больше минуты
+    next_run = parse_rule(data["rule"]).next_after(time.time())
+    rule = Rule(uuid.uuid4().hex[:8], data["rule"], next_run, data["message_text"], data.get("media") or [])
+    with STORE_SECONDS.time(operation="write"):
+        store.add_rule(rule)
+    return (
+        f"Повторяющийся пост {rule.id} сохранён: '{rule.cron}', ближайшая отправка {format_msk(next_run)} МСК\n"
+        f"Файлов прикреплено: {len(rule.media)}. Отменить: /repeat_cancel {rule.id}"
+    )
+
+
+def render_repeat_status():
+    """Текст ответа на /repeat_status: правила по времени ближайшей отправки"""
+    rules = get_store().rules()
+    if not rules:
+        return "Нет повторяющихся постов."
+    lines = [f"Повторяющихся постов: {len(rules)}", ""]
+    # Правил единицы-сотни, но ответ всё равно ограничен размером одной страницы
+    for rule in rules[:PAGE_SIZE]:
+        lines.append(f"{rule.id}: '{rule.cron}', ближайшая {format_msk(rule.next_run)} МСК")
+        lines.append(f"   {preview(rule.message_text)}")
+    if len(rules) > PAGE_SIZE:
+        lines.append(f"... и ещё {len(rules) - PAGE_SIZE}")
+    return "\n".join(lines)
+
+
+def cancel_repeat_rule(text):
+    """Удаляет правило по '/repeat_cancel <id>' и возвращает текст ответа"""
+    parts = text.split(maxsplit=1)
+    if len(parts) < 2:
+        return "Формат: /repeat_cancel ID (список - /repeat_status)"
+    rule_id = parts[1].strip()
+    if get_store().delete_rule(rule_id):
+        return f"Повторяющийся пост {rule_id} отменён."
+    return f"Повторяющийся пост {rule_id} не найден."
+
+
+def render_dead_letters():
+    """Текст ответа на /dead_letters: снятые с рассылки посты, последние - первыми"""
+    letters = get_store().dead_letters()
+    if not letters:
+        return "Мёртвых писем нет."
+    lines = [f"Снято с рассылки постов: {len(letters)}", ""]
+    for letter in letters[::-1][:PAGE_SIZE]:
+        post = letter.post
+        lines.append(f"{post.id}: на {format_msk(post.dispatch_at)} МСК, попыток {post.attempts}, "
+                     f"последняя {format_msk(letter.failed_at)} МСК")
+        lines.append(f"   {preview(post.message_text)}")
+        lines.append(f"   ❌ {letter.error[:ERROR_PREVIEW_LENGTH]}")
+    if len(letters) > PAGE_SIZE:
+        lines.append(f"... и ещё {len(letters) - PAGE_SIZE}")
+    lines.append("")
+    lines.append(REQUEUE_USAGE_TEXT)
+    return "\n".join(lines)
+
+
+def requeue_dead_letters(text):
+    """Возвращает в расписание мёртвое письмо по '/requeue <id>' или все по '/requeue all'.
+    Посты уходят на ближайшем проходе рассылки, счётчик попыток начинается заново."""
+    parts = text.split(maxsplit=1)
+    if len(parts) < 2:
+        return REQUEUE_USAGE_TEXT
+    store = get_store()
+    argument = parts[1].strip()
+    post_ids = [letter.post.id for letter in store.dead_letters()] if argument == "all" else [argument]
+    now = int(time.time())
+    with STORE_SECONDS.time(operation="write"):
+        requeued = [post_id for post_id in post_ids if store.requeue(post_id, now) is not None]
+    if not requeued:
+        return "Мёртвых писем нет." if argument == "all" else f"Мёртвое письмо {argument} не найдено."
+    SCHEDULE_POSTS.set(store.count())
+    return f"Возвращено в рассылку постов: {len(requeued)}. Отправка - на ближайшем проходе."
+
+
+def page_markup(callback_prefix, page, pages):
+    """Кнопки листания списка (None, если страница одна)"""
+    if pages <= 1:
+        return None
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("« Назад", callback_data=f"{callback_prefix}{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Вперёд »", callback_data=f"{callback_prefix}{page + 1}"))
+    markup = InlineKeyboardMarkup()
+    markup.row(*buttons)
+    return markup
+
+
+def parse_page(callback_data):
+    """Номер страницы из callback_data кнопки листания (после последнего двоеточия)"""
+    try:
+        return max(int(callback_data.rpartition(":")[2]), 0)
+    except ValueError:
+        return 0
+
+
+def preview(text):
+    """Начало текста поста для списков"""
+    if len(text) > PREVIEW_LENGTH:
+        return text[:PREVIEW_LENGTH] + "..."
+    return text
+
+
+def is_not_modified(error):
+    """Ошибка Telegram при правке сообщения тем же текстом (повторное нажатие кнопки)"""
+    return "message is not modified" in (getattr(error, "description", None) or "")
+
+
+# Готовые страницы /schedule_status одной версии расписания: номер -> (текст, кнопки).
+# При смене store.version() кэш сбрасывается целиком
+_status_cache = {"version": None, "count": None, "pages": {}}
+_status_lock = threading.Lock()
+
+
+def _render_status_page(store, page, count):
+    pages = max((count + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+    page = min(page, pages - 1)
+    if count == 0:
+        return "Нет запланированных постов.", None
+
+    with STORE_SECONDS.time(operation="read"):
+        posts = store.page(page * PAGE_SIZE, PAGE_SIZE)
+    if count == 1 and posts:
+        post = posts[0]
+        return (
+            f"Пост запланирован на {format_msk(post.dispatch_at)} МСК.\n"
+            f"Текст: {post.message_text}"
+        ), None
+
+    lines = [f"Всего запланировано постов: {count}"]
+    if pages > 1:
+        lines[0] += f" (страница {page + 1} из {pages})"
+    lines.append("")
+    for i, post in enumerate(posts, page * PAGE_SIZE + 1):
+        lines.append(f"{i}. {format_msk(post.dispatch_at)} МСК - ⏳ ожидает отправки")
+        lines.append(f"   {preview(post.message_text)}")
+    return "\n".join(lines), page_markup(STATUS_PAGE_CALLBACK, page, pages)
+
+
+def render_schedule_status(page=0):
+    """Страница ответа на /schedule_status: (текст, кнопки листания или None).
+
+    Посты по возрастанию времени, по PAGE_SIZE на странице, так что ответ
+    не упирается в лимит длины сообщения. Из хранилища читается только нужная
+    страница, а готовые страницы переиспользуются, пока не изменилась store.version()."""
+    store = get_store()
+    version = store.version()
+    with _status_lock:
+        if _status_cache["version"] != version:
+            _status_cache.update(version=version, count=None, pages={})
+        cached = _status_cache["pages"].get(page)
+        count = _status_cache["count"]
+    if cached is not None:
+        return cached
+
+    if count is None:
+        count = store.count()
+        SCHEDULE_POSTS.set(count)
+    rendered = _render_status_page(store, page, count)
+    with _status_lock:
+        if _status_cache["version"] == version:
+            _status_cache["count"] = count
+            pages = _status_cache["pages"]
+            if len(pages) >= STATUS_CACHE_PAGES:
+                pages.pop(next(iter(pages)))
+            pages[page] = rendered
+    return rendered
+
+
+def parse_archive_command(text):
+    """Месяц из '/archive YYYY-MM' или из callback_data кнопки листания архива
+    ('' - месяц не указан, None - указан неверно)"""
+    if text.startswith(ARCHIVE_PAGE_CALLBACK):
+        argument = text[len(ARCHIVE_PAGE_CALLBACK):].rpartition(":")[0]
+    else:
+        parts = text.split(maxsplit=1)
+        argument = parts[1] if len(parts) > 1 else ""
+    if not argument.strip():
+        return ""
+    return parse_month(argument)
+
+
+def render_archive(month, page=0):
+    """Страница ответа на /archive YYYY-MM: (текст, кнопки листания или None).
+    Читается только сегмент архива за этот месяц, рабочее расписание не трогается."""
+    archive = get_archive()
+    if month is None:
+        return ARCHIVE_USAGE_TEXT, None
+    if not month:
+        months = archive.months()
+        if not months:
+            return "Архив отправленных постов пуст.", None
+        return f"Месяцы в архиве: {', '.join(months)}\n{ARCHIVE_USAGE_TEXT}", None
+
+    with STORE_SECONDS.time(operation="archive"):
+        entries = archive.lookup(month)
+    if not entries:
+        return f"За {month} отправленных постов нет.", None
+    pages = (len(entries) + PAGE_SIZE - 1) // PAGE_SIZE
+    page = min(page, pages - 1)
+    lines = [f"Отправлено за {month}: {len(entries)}"]
+    if pages > 1:
+        lines[0] += f" (страница {page + 1} из {pages})"
+    lines.append("")
+    start = page * PAGE_SIZE
+    for i, entry in enumerate(entries[start:start + PAGE_SIZE], start + 1):
+        sent_at = datetime.fromisoformat(entry["sent_at"]).timestamp()
+        lines.append(f"{i}. {format_msk(sent_at)} МСК - ✅ отправлен")
+        lines.append(f"   {preview(entry.get('message_text', ''))}")
+    return "\n".join(lines), page_markup(f"{ARCHIVE_PAGE_CALLBACK}{month}:", page, pages)
+
+
+def render_join_status(stats):
+    """Текст ответа на /join_status по статистике очереди заявок"""
+    return (
+        f"Заявки на вступление:\n"
+        f"В очереди: {stats['backlog']} (в работе: {stats['in_flight']})\n"
+        f"Одобрено: {stats['approved']}, ошибок: {stats['failed']}, склеено повторов: {stats['coalesced']}\n"
+        f"Не принято (очередь заполнена): {stats['dropped']}\n"
+        f"Задержка одобрения: p50 {stats['latency_p50']} с, p95 {stats['latency_p95']} с\n"
+        f"Скорость: {stats['rate']} в секунду, ответов 429: {stats['rate_limited']}"
+    )
@@ -0,0 +1,252 @@
+"""Массовый импорт расписания из CSV или JSON Lines (команда бота /import и CLI)
+
+Файл читается построчно, без загрузки целиком: документ из Telegram скачивается
+потоком, строки проверяются по одной, а годные посты пишутся пачками по
+store.write_batch через store.add_many - одна запись в хранилище на пачку. В памяти
+только текущая пачка и первые IMPORT_MAX_ERRORS ошибок, поэтому с SQLite файл на
+десятки тысяч строк не требует больше памяти, чем на сотню (файловые бэкенды и так
+держат расписание в памяти целиком и пишут крупнее).
+
+CSV - с заголовком; обязательна колонка dispatch_at, остальные необязательны:
+    dispatch_at,message_text,media,targets
+    2026-12-01 16:30,Текст поста,photo:FILE_ID;document:/srv/reports/week.pdf,-100123;-100456
+JSON Lines - по объекту на строку, поля как в schedule.json:
+    {"dispatch_at": "2026-12-01 16:30", "message_text": "...", "media": [{"type": "photo", "file_id": "..."}]}
+Вместо file_id можно указать абсолютный путь к файлу на сервере ({"type", "path"}
+в JSON) внутри каталога MEDIA_ROOT: send_post.py загрузит его при первой отправке
+(см. file_cache).
+Время без часового пояса - московское, как в /schedule.
+
+    python bulk_import.py calendar.csv
+"""
+import argparse
+import codecs
+import csv
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from schedule_store import Post, content_hash, get_store, to_epoch
+
+MSK_TZ = timezone(timedelta(hours=3))
+IMPORT_MAX_ERRORS = 20  # сколько ошибок по строкам показывать (остальные только считаются)
+MESSAGE_LIMIT = 4096
+MEDIA_TYPES = ("photo", "document", "video", "audio")
+
+
+class RowError(ValueError):
+    """Строка файла не прошла проверку"""
+
+
+def parse_time(value):
+    """dispatch_at строки: 'YYYY-MM-DD HH:MM' или ISO (без пояса - по Москве) либо epoch-секунды"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if not isinstance(value, str) or not value.strip():
+        raise RowError("не указано dispatch_at")
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError(f"неверное время '{value}', нужно YYYY-MM-DD HH:MM") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=MSK_TZ)
+    return to_epoch(moment)
+
+
+def parse_media(value):
+    """Вложения: список {"type", "file_id"} или {"type", "path"} (JSON) либо строка
+    'тип:file_id;тип:/путь/к/файлу' (CSV). file_id Telegram не содержит '/', поэтому
+    значение, начинающееся с '/', - путь к файлу на сервере; он должен лежать в MEDIA_ROOT
+    (сохраняется раскрытым через os.path.realpath)"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        items = []
+        for part in value.split(";"):
+            media_type, _, reference = part.strip().partition(":")
+            key = "path" if reference.strip().startswith("/") else "file_id"
+            items.append({"type": media_type.strip(), key: reference.strip()})
+        value = items
+    if not isinstance(value, list):
+        raise RowError("media должно быть списком")
+    media = []
+    for item in value:
+        if not isinstance(item, dict) or item.get("type") not in MEDIA_TYPES or not (
+                item.get("file_id") or item.get("path")):
+            raise RowError(f"неверное вложение {item!r}, нужно {{type: {'/'.join(MEDIA_TYPES)}, file_id или path}}")
+        if item.get("file_id"):
+            media.append({"type": item["type"], "file_id": str(item["file_id"])})
+            continue
+        from file_cache import MediaPathError, media_path
+        path = str(item["path"])
+        if not os.path.isabs(path):
+            raise RowError(f"путь к файлу должен быть абсолютным: {path}")
+        try:
+            path = media_path(path)
+        except MediaPathError as error:
+            raise RowError(str(error)) from None
+        if not os.path.isfile(path):
+            raise RowError(f"файл не найден: {path}")
+        media.append({"type": item["type"], "path": path})
+    return media
+
+
+def parse_targets(value):
+    """Свои чаты поста: список или строка через ';' (None - чаты по умолчанию)"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = [chat_id.strip() for chat_id in value.split(";") if chat_id.strip()]
+    if not isinstance(value, list):
+        raise RowError("targets должно быть списком")
+    return [str(chat_id) for chat_id in value] or None
+
+
+def row_to_post(row, now):
+    """Проверенный Post из строки файла (dict с полями schedule.json)"""
+    if not isinstance(row, dict):
+        raise RowError("строка должна быть объектом")
+    dispatch_at = parse_time(row.get("dispatch_at"))
+    if dispatch_at <= now:
+        raise RowError("время должно быть в будущем")
+    message_text = row.get("message_text") or ""
+    if not isinstance(message_text, str):
+        raise RowError("message_text должно быть строкой")
+    media = parse_media(row.get("media"))
+    if not message_text and not media:
+        raise RowError("нет ни текста, ни вложений")
+    if len(message_text) > MESSAGE_LIMIT:
+        raise RowError(f"текст длиннее {MESSAGE_LIMIT} символов")
+    return Post(str(uuid.uuid4()), dispatch_at, message_text, media, parse_targets(row.get("targets")))
+
+
+def detect_format(file_name):
+    """'jsonl' или 'csv' по расширению имени файла"""
+    extension = os.path.splitext(file_name or "")[1].lower()
+    return "jsonl" if extension in (".jsonl", ".ndjson", ".json") else "csv"
+
+
+def iter_rows(lines, file_format):
+    """(номер строки, dict или исключение) из итератора текстовых строк"""
+    if file_format == "jsonl":
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, RowError(f"неверный JSON: {e.msg}")
+        return
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # Номер строки файла (с учётом заголовка и многострочных полей)
+        if None in row:
+            yield reader.line_num, RowError("лишние колонки")
+        else:
+            yield reader.line_num, row
+
+
+class ImportReport:
+    """Итог импорта: счётчики и первые ошибки по строкам"""
+
+    def __init__(self):
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []  # (номер строки, текст ошибки), не больше IMPORT_MAX_ERRORS
+
+    def error(self, number, message):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append((number, message))
+
+    def render(self):
+        lines = [f"Импортировано постов: {self.imported}, дубликатов пропущено: {self.duplicates}, "
+                 f"строк с ошибками: {self.failed}"]
+        for number, message in self.errors:
+            lines.append(f"строка {number}: {message}")
+        if self.failed > len(self.errors):
+            lines.append(f"... и ещё {self.failed - len(self.errors)} ошибок")
+        return "\n".join(lines)
+
+
+def import_lines(lines, file_format, store=None, now=None, report=None):
+    """Импортирует посты из итератора строк файла и возвращает ImportReport.
+    Дубликаты (совпадают время, текст и вложения) отсекаются и внутри файла, и с расписанием.
+    report заполняется по ходу: если чтение файла оборвётся, в нём видно, что уже записано."""
+    store = store or get_store()
+    now = time.time() if now is None else now
+    report = ImportReport() if report is None else report
+    batch = {}  # хэш содержимого -> пост
+
+    def flush():
+        # Посты, уже записанные прошлыми пачками или бывшие в расписании, находит хранилище
+        existing = store.existing_hashes(list(batch))
+        posts = [post for post_hash, post in batch.items() if post_hash not in existing]
+        report.duplicates += len(batch) - len(posts)
+        store.add_many(posts)
+        report.imported += len(posts)
+        batch.clear()
+
+    for number, row in iter_rows(lines, file_format):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            post = row_to_post(row, now)
+        except RowError as e:
+            report.error(number, str(e))
+            continue
+        post_hash = content_hash(post)
+        if post_hash in batch:
+            report.duplicates += 1
+            continue
+        batch[post_hash] = post
+        if store.write_batch and len(batch) >= store.write_batch:
+            flush()
+    if batch:
+        flush()
+    return report
+
+
+def _decode_chunks(chunks, decoder):
+    """Текстовые строки из потока байтовых кусков по мере скачивания"""
+    tail = ""
+    for chunk in chunks:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split("\n")
+        for line in lines:
+            yield line + "\n"
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def download_lines(url):
+    """Строки файла по URL, скачиваемого потоком (документ из Telegram)"""
+    from telebot import apihelper
+
+    from bot_api import session
+
+    response = session().get(url, stream=True, proxies=apihelper.proxy, timeout=60)
+    if response.status_code != 200:
+        raise apihelper.ApiHTTPException("Download file", response)
+    try:
+        # utf-8-sig отбрасывает BOM, который добавляет Excel
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        yield from _decode_chunks(response.iter_content(64 * 1024), decoder)
+    finally:
+        response.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт постов из CSV или JSON Lines")
+    parser.add_argument("path", help="файл .csv или .jsonl")
+    args = parser.parse_args()
+
+    with open(args.path, "r", encoding="utf-8-sig", newline="") as file:
+        print(import_lines(file, detect_format(args.path)).render())
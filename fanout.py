@@ -0,0 +1,31 @@
+"""Параллельная рассылка одного поста в несколько чатов
+
+Каждый чат отправляется в отдельной задаче ограниченного пула потоков,
+лимиты на чат и на бота соблюдает общий RateLimiter внутри функции отправки.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+FANOUT_WORKERS = 8
+
+
+class FanOut:
+    """Отправляет пост во все чаты сразу и возвращает статус доставки по каждому чату"""
+
+    def __init__(self, max_workers=FANOUT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
+
+    def deliver(self, targets, send):
+        """Вызывает send(chat_id) для всех чатов параллельно.
+        Возвращает {chat_id: None при успехе или исключение при ошибке}."""
+        futures = {chat_id: self._executor.submit(send, chat_id) for chat_id in targets}
+        results = {}
+        for chat_id, future in futures.items():
+            try:
+                future.result()
+                results[chat_id] = None
+            except Exception as e:
+                results[chat_id] = e
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,307 @@
+"""Вложения из файлов на диске сервера: загрузка один раз и кэш file_id
+
+Кроме {"type", "file_id"} из Telegram, в media поста можно указать файл:
+{"type": "photo", "path": "/srv/reports/week.png"}. При первой отправке файл
+загружается, а file_id из ответа запоминается по SHA-256 содержимого и типу
+вложения (file_id фото нельзя отправить документом). Следующие отправки, другие
+чаты рассылки и тот же файл под другим путём идут по file_id, без загрузки.
+file_id действует только для загрузившего бота, поэтому ключ включает и его id.
+
+Публиковать можно только файлы внутри каталога MEDIA_ROOT (без него файлы с диска
+отключены): путь раскрывается через os.path.realpath и проверяется при импорте,
+при построении плана и ещё раз перед загрузкой - файл могли подменить ссылкой
+на /etc/passwd или .env бота уже после импорта.
+
+Хэш не пересчитывается на каждой отправке: для пути запоминаются размер и mtime,
+и пока они прежние, берётся сохранённый хэш. Кэш - SQLite (FILE_CACHE_DB), общий
+для прохода из cron и демона; записи, которыми дольше всего не пользовались,
+вытесняются сверх FILE_CACHE_MAX_ENTRIES. file_id, который Telegram отверг,
+забывается (forget), и файл загружается заново.
+
+Загрузка потоковая: тело multipart/form-data читается с диска кусками по
+UPLOAD_CHUNK_SIZE во время отправки, а не собирается в памяти целиком, как
+у requests с files=.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from bot_api import call
+from retry_policy import PermanentError
+from schedule_store import BASE_DIR
+
+FILE_CACHE_DB = os.getenv("FILE_CACHE_DB", os.path.join(BASE_DIR, "file_cache.db"))
+FILE_CACHE_MAX_ENTRIES = int(os.getenv("FILE_CACHE_MAX_ENTRIES", "10000"))
+MEDIA_ROOT = os.getenv("MEDIA_ROOT")  # каталог, файлы из которого можно публиковать
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Методы Bot API для загрузки одного файла; имя поля файла совпадает с типом вложения
+UPLOAD_METHODS = {"photo": "sendPhoto", "video": "sendVideo", "document": "sendDocument", "audio": "sendAudio"}
+
+
+class MediaPathError(PermanentError, ValueError):
+    """Путь вложения вне MEDIA_ROOT (или MEDIA_ROOT не задан)"""
+
+
+def media_path(path, root=None):
+    """Настоящий путь файла вложения (os.path.realpath); MediaPathError, если он вне MEDIA_ROOT"""
+    root = MEDIA_ROOT if root is None else root
+    if not root:
+        raise MediaPathError("файлы с диска отключены: не задан MEDIA_ROOT")
+    root = os.path.realpath(root)
+    real_path = os.path.realpath(path)
+    if os.path.commonpath([real_path, root]) != root:
+        raise MediaPathError(f"файл вне MEDIA_ROOT: {path}")
+    return real_path
+
+
+def is_upload(item):
+    """Вложение - файл на диске, которого ещё нет в кэше"""
+    return bool(item.get("path")) and not item.get("file_id")
+
+
+def from_cache(item):
+    """Вложение - файл на диске, file_id которого взят из кэша"""
+    return bool(item.get("path")) and bool(item.get("file_id"))
+
+
+def file_sha256(path):
+    """SHA-256 содержимого файла, чтением кусками"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileCache:
+    """file_id загруженных файлов по (бот, SHA-256, тип вложения) в SQLite"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS file_ids (
+            bot TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            used_at REAL NOT NULL,
+            PRIMARY KEY (bot, sha256, type)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_file_ids_used_at ON file_ids(used_at)",
+        # Хэш пути при неизменных размере и mtime - чтобы не читать файл на каждой отправке
+        """
+        CREATE TABLE IF NOT EXISTS file_digests (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            checked_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_file_digests_checked_at ON file_digests(checked_at)",
+    )
+
+    def __init__(self, bot, path=FILE_CACHE_DB, max_entries=FILE_CACHE_MAX_ENTRIES):
+        self.bot = str(bot)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def digest(self, path):
+        """SHA-256 файла; пересчитывается, только если изменились размер или mtime"""
+        stat = os.stat(path)
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT sha256 FROM file_digests WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row:
+            return row[0]
+        sha256 = file_sha256(path)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO file_digests (path, size, mtime_ns, sha256, checked_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                "sha256 = excluded.sha256, checked_at = excluded.checked_at",
+                (path, stat.st_size, stat.st_mtime_ns, sha256, time.time()),
+            )
+            self._evict(conn, "file_digests", "path", "checked_at")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return sha256
+
+    def get(self, sha256, media_type):
+        """file_id файла (None, если его ещё не загружали); отмечает использование"""
+        row = self._connect().execute(
+            "UPDATE file_ids SET used_at = ? WHERE bot = ? AND sha256 = ? AND type = ? RETURNING file_id",
+            (time.time(), self.bot, sha256, media_type),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, sha256, media_type, file_id):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO file_ids (bot, sha256, type, file_id, used_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(bot, sha256, type) DO UPDATE SET file_id = excluded.file_id, used_at = excluded.used_at",
+                (self.bot, sha256, media_type, file_id, time.time()),
+            )
+            self._evict(conn, "file_ids", "rowid", "used_at")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def forget(self, sha256, media_type):
+        self._connect().execute(
+            "DELETE FROM file_ids WHERE bot = ? AND sha256 = ? AND type = ?", (self.bot, sha256, media_type)
+        )
+
+    def _evict(self, conn, table, key, used_column):
+        """Удаляет записи, которыми дольше всего не пользовались, сверх предела.
+        Записи добавляются только при новой загрузке или новом файле, поэтому COUNT здесь не горячий путь"""
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} ORDER BY {used_column} LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def resolve(self, media):
+        """Копия media, где у файлов с диска есть sha256 и, если файл уже загружен, file_id.
+        Недоступный файл остаётся как есть: ошибка всплывёт при отправке и пойдёт в повторы.
+        Файл вне MEDIA_ROOT - MediaPathError: такой пост отправлять нельзя."""
+        resolved = []
+        for item in media:
+            if is_upload(item):
+                path = media_path(item["path"])
+                try:
+                    sha256 = self.digest(path)
+                except OSError:
+                    resolved.append(item)
+                    continue
+                item = dict(item, sha256=sha256)
+                file_id = self.get(sha256, item["type"])
+                if file_id:
+                    item["file_id"] = file_id
+            resolved.append(item)
+        return resolved
+
+    def remember(self, item, message):
+        """Запоминает file_id загруженного файла из ответа Telegram (dict сообщения)"""
+        file_id = sent_file_id(message, item["type"])
+        if file_id and item.get("sha256"):
+            self.put(item["sha256"], item["type"], file_id)
+
+    def forget_item(self, item):
+        if item.get("sha256"):
+            self.forget(item["sha256"], item["type"])
+
+
+def sent_file_id(message, media_type):
+    """file_id вложения из отправленного сообщения (для фото - самый крупный размер)"""
+    attachment = message.get(media_type)
+    if media_type == "photo":
+        return attachment[-1]["file_id"] if attachment else None
+    return attachment.get("file_id") if attachment else None
+
+
+class MultipartStream:
+    """Тело multipart/form-data, которое читается с диска во время отправки.
+    Длина известна заранее (Content-Length), так что запрос идёт без chunked-кодирования."""
+
+    def __init__(self, fields, files):
+        """fields - {имя: строка}, files - {имя поля: путь к файлу}"""
+        self.boundary = uuid.uuid4().hex
+        self._parts = []  # bytes или (путь, размер)
+        for name, value in fields.items():
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            )
+        for name, path in files.items():
+            file_name = os.path.basename(path).replace('"', "%22").replace("\r", "").replace("\n", "")
+            self._parts.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{file_name}"\r\n'
+                f"Content-Type: application/octet-stream\r\n\r\n".encode()
+            )
+            self._parts.append((path, os.path.getsize(path)))
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return sum(part[1] if isinstance(part, tuple) else len(part) for part in self._parts)
+
+    def __iter__(self):
+        for part in self._parts:
+            if not isinstance(part, tuple):
+                yield part
+                continue
+            path, remaining = part
+            # O_NOFOLLOW: путь уже раскрыт media_path, ссылка на его месте - подмена после проверки
+            with os.fdopen(os.open(path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0)), "rb") as file:
+                while remaining:
+                    chunk = file.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        # Content-Length уже отправлен: укороченный файл испортил бы запрос
+                        raise OSError(f"файл {path} изменился во время загрузки")
+                    remaining -= len(chunk)
+                    yield chunk
+
+
+def upload(token, method_name, params, files):
+    """Запрос к Bot API с файлами с диска, телом потоком (через bot_api). Возвращает result
+    ответа; ошибки - ApiTelegramException, как у методов TeleBot"""
+    body = MultipartStream({name: value for name, value in params.items() if value is not None}, files)
+    return call(token, method_name, body, headers={"Content-Type": body.content_type})
+
+
+def upload_file(token, chat_id, item, caption=None):
+    """Отправляет один файл с диска (только из MEDIA_ROOT); возвращает сообщение (dict)"""
+    params = {"chat_id": chat_id, "caption": caption}
+    return upload(token, UPLOAD_METHODS[item["type"]], params, {item["type"]: media_path(item["path"])})
+
+
+def upload_group(token, chat_id, group, files):
+    """send_media_group, где файлы с диска указаны в group ссылками attach://имя.
+    files - {имя: путь}, только из MEDIA_ROOT. Возвращает список сообщений (dict)"""
+    params = {"chat_id": chat_id, "media": json.dumps([media.to_dict() for media in group], ensure_ascii=False)}
+    return upload(token, "sendMediaGroup", params, {name: media_path(path) for name, path in files.items()})
+
+
+_file_caches = {}
+_file_caches_lock = threading.Lock()
+
+
+def get_file_cache(bot):
+    """Кэш file_id бота (id - часть токена до двоеточия); открывается при первой отправке файла"""
+    with _file_caches_lock:
+        if bot not in _file_caches:
+            _file_caches[bot] = FileCache(bot)
+        return _file_caches[bot]
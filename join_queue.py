@@ -0,0 +1,195 @@
+"""Очередь одобрения заявок на вступление
+
+Обработчик chat_join_request только кладёт заявку в очередь и сразу возвращается,
+поэтому во время наплыва заявок потоки бота остаются свободны для команд администратора.
+Заявки одобряет пул рабочих потоков с адаптивным ограничением частоты:
+после 429 скорость падает вдвое и все потоки выжидают retry_after.
+Повторные заявки той же пары (чат, пользователь) склеиваются в одну.
+Заявка, не одобренная из-за сети или 5xx, повторяется с экспоненциальной задержкой
+(retry_policy.retry_delay), чтобы при недоступном Telegram потоки не долбили API.
+Очередь ограничена JOIN_QUEUE_SIZE: лишние заявки не принимаются и остаются
+в Telegram - их можно одобрить вручную.
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+
+from telebot.apihelper import ApiTelegramException
+
+from rate_limit import AdaptiveTokenBucket, parse_retry_after
+from retry_policy import retry_delay
+
+JOIN_WORKERS = 4
+JOIN_MAX_RATE = 25  # одобрений в секунду, ниже глобального лимита бота
+JOIN_MAX_ATTEMPTS = 5  # попыток при сетевых ошибках и 5xx
+JOIN_RETRY_BASE_DELAY = 1  # секунд до первого повтора, дальше вдвое больше
+JOIN_RETRY_MAX_DELAY = 60
+JOIN_QUEUE_SIZE = 10_000  # заявок в очереди, включая ждущие повтора
+LATENCY_WINDOW = 1000  # по скольким последним заявкам считаем задержку
+
+
+class JoinApprovalQueue:
+    """Очередь заявок (chat_id, user_id) с пулом потоков для approve_chat_join_request"""
+
+    def __init__(self, approve, workers=JOIN_WORKERS, max_rate=JOIN_MAX_RATE, max_size=JOIN_QUEUE_SIZE):
+        self.approve = approve
+        self.workers = workers
+        self.max_size = max_size
+        self.bucket = AdaptiveTokenBucket(max_rate)
+        self._pending = OrderedDict()  # (chat_id, user_id) -> (время постановки, попытка)
+        self._delayed = []  # куча (когда повторить, ключ, время постановки, попытка)
+        self._delayed_keys = set()
+        self._in_flight = set()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        # Статистика
+        self.approved = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"join-approve-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, chat_id, user_id):
+        """Ставит заявку в очередь. Возвращает False, если такая заявка уже ждёт одобрения
+        или очередь заполнена."""
+        self.start()
+        key = (chat_id, user_id)
+        with self._cond:
+            if key in self._pending or key in self._in_flight or key in self._delayed_keys:
+                self.coalesced += 1
+                return False
+            if len(self._pending) + len(self._delayed) >= self.max_size:
+                self.dropped += 1
+                return False
+            self._pending[key] = (time.monotonic(), 1)
+            self._cond.notify()
+        return True
+
+    def _take(self):
+        with self._cond:
+            while not self._stopped:
+                # Заявки, чья задержка повтора истекла, возвращаются в конец очереди
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, key, enqueued_at, attempt = heapq.heappop(self._delayed)
+                    self._delayed_keys.discard(key)
+                    self._pending.setdefault(key, (enqueued_at, attempt))
+                if self._pending:
+                    break
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+            if self._stopped:
+                return None
+            key, (enqueued_at, attempt) = self._pending.popitem(last=False)
+            self._in_flight.add(key)
+            return key, enqueued_at, attempt
+
+    def _requeue(self, key, enqueued_at, attempt):
+        with self._cond:
+            self._in_flight.discard(key)
+            self._pending.setdefault(key, (enqueued_at, attempt))
+            self._cond.notify()
+
+    def _retry_later(self, key, enqueued_at, attempt):
+        """Повтор заявки после экспоненциальной задержки (attempt - номер следующей попытки)"""
+        delay = retry_delay(attempt - 1, base_delay=JOIN_RETRY_BASE_DELAY, max_delay=JOIN_RETRY_MAX_DELAY)
+        with self._cond:
+            self._in_flight.discard(key)
+            heapq.heappush(self._delayed, (time.monotonic() + delay, key, enqueued_at, attempt))
+            self._delayed_keys.add(key)
+            self._cond.notify()
+
+    def _done(self, key):
+        with self._cond:
+            self._in_flight.discard(key)
+
+    def _work(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+            key, enqueued_at, attempt = item
+            wait = self.bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.approve(*key)
+            except ApiTelegramException as e:
+                retry_after = parse_retry_after(e)
+                if retry_after is not None:
+                    # Притормаживаем все потоки и возвращаем заявку в очередь
+                    with self._cond:
+                        self.rate_limited += 1
+                    self.bucket.on_throttled(retry_after)
+                    self._requeue(key, enqueued_at, attempt)
+                    continue
+                if e.error_code >= 500 and attempt < JOIN_MAX_ATTEMPTS:
+                    self._retry_later(key, enqueued_at, attempt + 1)
+                    continue
+                # Ошибки вроде HIDE_REQUESTER_MISSING повторять бессмысленно
+                print(f"Не удалось одобрить заявку {key}: {e}")
+                with self._cond:
+                    self.failed += 1
+                self._done(key)
+                continue
+            except Exception as e:
+                if attempt < JOIN_MAX_ATTEMPTS:
+                    self._retry_later(key, enqueued_at, attempt + 1)
+                else:
+                    print(f"Не удалось одобрить заявку {key}: {e}")
+                    with self._cond:
+                        self.failed += 1
+                    self._done(key)
+                continue
+            self.bucket.on_success()
+            with self._cond:
+                self.approved += 1
+                self._latencies.append(time.monotonic() - enqueued_at)
+            self._done(key)
+
+    def stats(self):
+        """Очередь, счётчики и задержка одобрения (p50/p95 по последним заявкам), секунды"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            backlog = len(self._pending) + len(self._delayed)
+            in_flight = len(self._in_flight)
+            counters = (self.approved, self.failed, self.coalesced, self.rate_limited, self.dropped)
+
+        def percentile(share):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * share))]
+
+        approved, failed, coalesced, rate_limited, dropped = counters
+        return {
+            "backlog": backlog,
+            "in_flight": in_flight,
+            "approved": approved,
+            "failed": failed,
+            "coalesced": coalesced,
+            "rate_limited": rate_limited,
+            "dropped": dropped,
+            "rate": round(self.bucket.rate, 2),
+            "latency_p50": round(percentile(0.5), 3),
+            "latency_p95": round(percentile(0.95), 3),
+        }
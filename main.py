@@ -1,451 +1,288 @@
-import json
+import argparse
 import os
-import uuid
-from datetime import datetime, timedelta, timezone
-import threading
+import sys
 
 import telebot
-from dotenv import load_dotenv
-from telebot import types
-from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from telebot import apihelper, types
 
-# Часовые пояса
-MSK_TZ = timezone(timedelta(hours=3))  # МСК = UTC+3
-UTC_TZ = timezone.utc  # UTC
+from bot_common import (
+    ADMIN_ONLY_TEXT,
+    ALBUM_ADDED_TEXT,
+    ALLOWED_UPDATES,
+    ARCHIVE_PAGE_CALLBACK,
+    BOT_TOKEN,
+    IMPORT_PROMPT_TEXT,
+    MEDIA_ADDED_TEXT,
+    MEDIA_PROMPT_TEXT,
+    STATUS_PAGE_CALLBACK,
+    STEP_NOT_FOUND_TEXT,
+    AlbumCollector,
+    accept_message_text,
+    add_media,
+    awaiting_import,
+    awaiting_message_text,
+    cancel_repeat_rule,
+    collecting_media,
+    done_markup,
+    finish_media_upload,
+    import_document,
+    is_admin,
+    is_not_modified,
+    parse_archive_command,
+    parse_page,
+    parse_repeat_command,
+    parse_schedule_command,
+    render_archive,
+    render_dead_letters,
+    render_join_status,
+    render_repeat_status,
+    render_schedule_status,
+    requeue_dead_letters,
+    save_scheduled_post,
+    start_import,
+    start_schedule,
+)
+from join_queue import JoinApprovalQueue
+from metrics import instrument_api, start_metrics, timed_handler
 
-load_dotenv()
+bot = telebot.TeleBot(BOT_TOKEN)
+join_queue = JoinApprovalQueue(bot.approve_chat_join_request)
+album_collector = AlbumCollector(
+    lambda message, count: bot.reply_to(message, ALBUM_ADDED_TEXT.format(count=count), reply_markup=done_markup())
+)
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-ADMIN_ID = os.getenv("ADMIN_ID")
-SCHEDULE_FILE = os.path.join(os.path.dirname(__file__), "schedule.json")
 
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден в переменных окружения!")
-if not ADMIN_ID:
-    raise ValueError("ADMIN_ID не найден в переменных окружения!")
-try:
-    ADMIN_ID_INT = int(ADMIN_ID)
-except ValueError as exc:
-    raise ValueError("ADMIN_ID должен быть числом Telegram пользователя.") from exc
+# Регистрируется первым: следующее сообщение после /schedule - текст поста.
+# Шаг хранится в state_store, поэтому диалог переживает перезапуск бота
+@bot.message_handler(
+    func=lambda message: awaiting_message_text(message.from_user.id),
+    content_types=["text", "photo", "document", "video", "audio"],
+)
+@timed_handler
+def handle_schedule_message_text(message):
+    if not accept_message_text(message.from_user.id, message.text):
+        bot.reply_to(message, STEP_NOT_FOUND_TEXT)
+        return
+    bot.reply_to(message, MEDIA_PROMPT_TEXT, reply_markup=done_markup())
 
-bot = telebot.TeleBot(BOT_TOKEN)
 
-# Временное хранилище (user_id: dict)
-schedule_step_buffer = {}
-schedule_step_lock = threading.Lock()
+@bot.message_handler(commands=["schedule"])
+@timed_handler
+def handle_schedule(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
 
-SUPPORTED_MEDIA_TYPES = ("photo", "document", "video", "audio")
+    dispatch_at_utc, reply_text = parse_schedule_command(message.text)
+    if dispatch_at_utc is None:
+        bot.reply_to(message, reply_text)
+        return
 
+    start_schedule(message.from_user.id, dispatch_at_utc)
+    bot.reply_to(message, reply_text)
 
-def _read_schedule():
-    """Читает список запланированных постов из файла"""
-    if not os.path.exists(SCHEDULE_FILE):
-        return []
-    
-    try:
-        with open(SCHEDULE_FILE, "r", encoding="utf-8") as file:
-            data = json.load(file)
-    except (json.JSONDecodeError, IOError) as e:
-        # Если файл поврежден, удаляем его и возвращаем пустой список
-        print(f"Ошибка чтения файла расписания: {e}")
-        if os.path.exists(SCHEDULE_FILE):
-            os.remove(SCHEDULE_FILE)
-        return []
-    
-    # Поддержка старого формата (один пост) - автоматическая миграция
-    # ВАЖНО: это должно происходить только один раз при миграции
-    if isinstance(data, dict) and "dispatch_at" in data:
-        # Пропускаем уже отправленные посты старого формата
-        if data.get("sent", False):
-            # Удаляем файл старого формата
-            try:
-                os.remove(SCHEDULE_FILE)
-            except:
-                pass
-            return []
-        
-        # Мигрируем старый формат в новый
-        dispatch_at_str = data.get("dispatch_at")
-        if not dispatch_at_str:
-            try:
-                os.remove(SCHEDULE_FILE)
-            except:
-                pass
-            return []
-            
-        try:
-            dispatch_at = datetime.fromisoformat(dispatch_at_str)
-        except (ValueError, TypeError):
-            # Если не удается распарсить дату, удаляем файл
-            try:
-                os.remove(SCHEDULE_FILE)
-            except:
-                pass
-            return []
-        
-        # Если время без timezone, считаем его UTC
-        if dispatch_at.tzinfo is None:
-            dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-        
-        post = {
-            "id": data.get("id", str(uuid.uuid4())),
-            "dispatch_at": dispatch_at,
-            "message_text": data.get("message_text", "Привет"),
-        }
-        
-        # Сохраняем в новом формате и возвращаем список
-        # ВАЖНО: после миграции файл должен быть в новом формате
-        _write_schedule([post])
-        return [post]
-    
-    # Новый формат (список постов)
-    if isinstance(data, list):
-        posts = []
-        total_in_file = len(data)
-        skipped_count = 0
-        
-        for post_data in data:
-            # Пропускаем некорректные записи
-            if not isinstance(post_data, dict):
-                skipped_count += 1
-                continue
-                
-            # Пропускаем уже отправленные посты
-            if post_data.get("sent", False):
-                skipped_count += 1
-                continue
-            
-            # Создаем новый словарь для поста, чтобы не модифицировать исходный
-            dispatch_at_str = post_data.get("dispatch_at")
-            if not dispatch_at_str:
-                skipped_count += 1
-                continue
-                
-            try:
-                if isinstance(dispatch_at_str, str):
-                    dispatch_at = datetime.fromisoformat(dispatch_at_str)
-                elif isinstance(dispatch_at_str, datetime):
-                    dispatch_at = dispatch_at_str
-                else:
-                    skipped_count += 1
-                    continue  # Пропускаем посты с некорректным форматом времени
-            except (ValueError, TypeError):
-                skipped_count += 1
-                continue  # Пропускаем посты с некорректной датой
-            
-            # Если время без timezone, считаем его UTC
-            if dispatch_at.tzinfo is None:
-                dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-            
-            # Создаем новый пост с правильным форматом
-            post = {
-                "id": post_data.get("id", str(uuid.uuid4())),
-                "dispatch_at": dispatch_at,
-                "message_text": post_data.get("message_text", "Привет"),
-            }
-            posts.append(post)
-        
-        # Логируем, если мы пропустили посты
-        if skipped_count > 0:
-            print(f"При чтении пропущено {skipped_count} из {total_in_file} постов")
-        
-        return posts
-    
-    # Если формат не распознан, возвращаем пустой список
-    return []
-
-
-def _write_schedule(posts):
-    """Записывает список запланированных постов в файл"""
-    # Убеждаемся, что posts - это список
-    if not isinstance(posts, list):
-        posts = []
-    
-    if not posts:
-        # Если постов нет, не создаём файл или удаляем существующий
-        if os.path.exists(SCHEDULE_FILE):
-            os.remove(SCHEDULE_FILE)
+@bot.message_handler(commands=["schedule_repeat"])
+@timed_handler
+def handle_schedule_repeat(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
-    
-    # Создаем payload с правильной структурой
-    payload = []
-    skipped_count = 0
-    
-    for post in posts:
-        if not isinstance(post, dict):
-            skipped_count += 1
-            continue
-            
-        # Извлекаем dispatch_at
-        dispatch_at = post.get("dispatch_at")
-        if dispatch_at is None:
-            skipped_count += 1
-            continue
-            
-        if isinstance(dispatch_at, datetime):
-            dispatch_at_str = dispatch_at.isoformat()
-        elif isinstance(dispatch_at, str):
-            dispatch_at_str = dispatch_at
-        else:
-            skipped_count += 1
-            continue  # Пропускаем посты с некорректным форматом
-        
-        # Создаем запись для сохранения
-        payload_item = {
-            "id": post.get("id", str(uuid.uuid4())),
-            "dispatch_at": dispatch_at_str,
-            "message_text": post.get("message_text", "Привет"),
-            "media": post.get("media", []),
-        }
-        payload.append(payload_item)
-    
-    # Проверяем, что мы не потеряли посты
-    if skipped_count > 0:
-        print(f"Предупреждение: пропущено {skipped_count} постов при записи")
-    
-    if not payload:
-        # Если после обработки ничего не осталось, удаляем файл
-        if os.path.exists(SCHEDULE_FILE):
-            os.remove(SCHEDULE_FILE)
+
+    rule, next_run, reply_text = parse_repeat_command(message.text)
+    if rule is None:
+        bot.reply_to(message, reply_text)
         return
-    
-    # Записываем в файл (создаем временный файл для атомарности записи)
-    temp_file = SCHEDULE_FILE + ".tmp"
-    try:
-        with open(temp_file, "w", encoding="utf-8") as file:
-            json.dump(payload, file, ensure_ascii=False, indent=2)
-        
-        # Атомарно заменяем старый файл новым
-        if os.path.exists(temp_file):
-            if os.path.exists(SCHEDULE_FILE):
-                os.replace(temp_file, SCHEDULE_FILE)
-            else:
-                os.rename(temp_file, SCHEDULE_FILE)
-    except Exception as e:
-        print(f"Ошибка при записи файла расписания: {e}")
-        # Удаляем временный файл при ошибке
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
 
+    start_schedule(message.from_user.id, next_run, rule)
+    bot.reply_to(message, reply_text)
 
-@bot.message_handler(commands=["schedule"])
-def handle_schedule(message: types.Message):
-    if str(message.from_user.id) != ADMIN_ID:
-        bot.reply_to(message, "Эта команда доступна только администратору.")
+@bot.message_handler(commands=["repeat_status"])
+@timed_handler
+def handle_repeat_status(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
+    bot.reply_to(message, render_repeat_status())
 
-    parts = message.text.split(maxsplit=2)
-    if len(parts) < 3:
-        bot.reply_to(
-            message,
-            "Формат: /schedule YYYY-MM-DD HH:MM\n"
-            "Сначала отправьте дату и время, например:/schedule 2025-12-01 16:30",
-        )
+@bot.message_handler(commands=["repeat_cancel"])
+@timed_handler
+def handle_repeat_cancel(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
+    bot.reply_to(message, cancel_repeat_rule(message.text))
 
-    time_part = parts[1] + " " + parts[2]
-    try:
-        dispatch_at_msk = datetime.strptime(time_part, "%Y-%m-%d %H:%M")
-        dispatch_at_msk = dispatch_at_msk.replace(tzinfo=MSK_TZ)
-    except ValueError:
-        bot.reply_to(message, "Неверный формат даты. Используй YYYY-MM-DD HH:MM.")
+@bot.message_handler(commands=["dead_letters"])
+@timed_handler
+def handle_dead_letters(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
+    bot.reply_to(message, render_dead_letters())
 
-    dispatch_at_utc = dispatch_at_msk.astimezone(UTC_TZ)
-    now_utc = datetime.now(UTC_TZ)
-    if dispatch_at_utc <= now_utc:
-        bot.reply_to(message, "Время должно быть в будущем.")
+@bot.message_handler(commands=["requeue"])
+@timed_handler
+def handle_requeue(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
+    bot.reply_to(message, requeue_dead_letters(message.text))
 
-    with schedule_step_lock:
-        schedule_step_buffer[message.from_user.id] = {
-            "dispatch_at": dispatch_at_utc,
-        }
-    bot.reply_to(
-        message,
-        f"ОК! Дата и время запланированы: {dispatch_at_msk.strftime('%Y-%m-%d %H:%M')} МСК\nТеперь отправьте текст сообщения, который надо запланировать.",
-    )
-    bot.register_next_step_handler(message, handle_schedule_message_text)
-
+@bot.message_handler(commands=["import"])
+@timed_handler
+def handle_import(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    start_import(message.from_user.id)
+    bot.reply_to(message, IMPORT_PROMPT_TEXT)
 
-def handle_schedule_message_text(message):
-    user_id = message.from_user.id
-    with schedule_step_lock:
-        data = schedule_step_buffer.pop(user_id, None)
-    if data is None:
-        bot.reply_to(message, "Ошибка: этап не найден. Начните с /schedule.")
+# Раньше обработчика файлов поста: документ после /import - это файл импорта
+@bot.message_handler(func=awaiting_import, content_types=["document"])
+@timed_handler
+def handle_import_document(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
-    message_text = message.text if message.text else "Привет"
-    dispatch_at_utc = data["dispatch_at"]
-    # Начинаем этап сбора файлов
-    with schedule_step_lock:
-        schedule_step_buffer[user_id] = {
-            "dispatch_at": dispatch_at_utc,
-            "message_text": message_text,
-            "media": [],
-            "active": True,  # помечаем, что этап добавления файлов открыт
-        }
-    markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Продолжить", callback_data="done_media_upload"))
-    bot.reply_to(
-        message,
-        "Теперь вы можете отправить 1 или несколько файлов (фото, видео, документ, аудио).\nКогда закончите — нажмите 'Продолжить'.",
-        reply_markup=markup,
-    )
+    bot.reply_to(message, import_document(message.from_user.id, message.document.file_id, message.document.file_name))
 
 # Исправить: сообщения с медиа добавляются только если этап активен, и нет next_step_handler после каждого файла
 @bot.message_handler(content_types=["photo", "document", "video", "audio"])
+@timed_handler
 def handle_media_during_schedule(message):
-    user_id = message.from_user.id
-    with schedule_step_lock:
-        data = schedule_step_buffer.get(user_id)
-        if not data or not data.get("active"):
-            return  # Игнор отсутсвия этапа
-        # добавляем файл
-        added = False
-        for attr in SUPPORTED_MEDIA_TYPES:
-            file = getattr(message, attr, None)
-            if file:
-                if isinstance(file, list):
-                    for photo in file:
-                        data["media"].append({"type": attr, "file_id": photo.file_id})
-                        added = True
-                else:
-                    data["media"].append({"type": attr, "file_id": file.file_id})
-                    added = True
-        schedule_step_buffer[user_id] = data
-    if added:
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("Продолжить", callback_data="done_media_upload"))
-        bot.reply_to(
-            message,
-            "Файл добавлен! Можете отправить ещё или нажмите 'Продолжить' для завершения.",
-            reply_markup=markup,
-        )
+    if message.media_group_id:
+        # Альбом: файлы копятся и подтверждаются одним ответом после паузы
+        if collecting_media(message.from_user.id):
+            album_collector.add(message)
+        return
+    if add_media(message.from_user.id, message):
+        bot.reply_to(message, MEDIA_ADDED_TEXT, reply_markup=done_markup())
 
 @bot.callback_query_handler(func=lambda call: call.data == 'done_media_upload')
+@timed_handler
 def schedule_inline_finish(call):
-    user_id = call.from_user.id
-    with schedule_step_lock:
-        data = schedule_step_buffer.pop(user_id, None)
-    if data is None or not data.get("active"):
+    album_collector.flush_user(call.from_user.id)
+    data = finish_media_upload(call.from_user.id)
+    if data is None:
         bot.answer_callback_query(call.id, text="Этап не найден, начните сначала /schedule.")
         return
-    data["active"] = False
     finish_schedule_with_media(call.message, data)
     bot.answer_callback_query(call.id, text="Пост сохранён!")
 
 def finish_schedule_with_media(message, data):
-    dispatch_at_utc = data["dispatch_at"]
-    message_text = data["message_text"]
-    media = data.get("media", [])
-    # Читаем существующие посты
-    existing_posts = _read_schedule()
-    if not isinstance(existing_posts, list):
-        existing_posts = []
-    # Дубликаты запрещаем если совпадает всё
-    duplicate = False
-    for existing_post in existing_posts:
-        d1 = existing_post.get("dispatch_at")
-        if isinstance(d1, str):
-            try:
-                d1 = datetime.fromisoformat(d1)
-            except Exception:
-                pass
-        if isinstance(d1, datetime):
-            d1 = d1.astimezone(UTC_TZ).isoformat()
-        d2 = dispatch_at_utc.astimezone(UTC_TZ).isoformat()
-        if (
-            d1 == d2 and
-            existing_post.get("message_text", "Привет") == message_text and
-            existing_post.get("media", []) == media
-        ):
-            duplicate = True
-            break
-    if duplicate:
-        bot.reply_to(message, "Пост с таким содержимым уже есть!")
-        return
-    # Добавляем пост
-    new_post = {
-        "id": str(uuid.uuid4()),
-        "dispatch_at": dispatch_at_utc,
-        "message_text": message_text,
-        "media": media or [],
-    }
-    all_posts = [
-        {
-            "id": existing_post.get("id", str(uuid.uuid4())),
-            "dispatch_at": existing_post.get("dispatch_at"),
-            "message_text": existing_post.get("message_text", "Привет"),
-            "media": existing_post.get("media", []),
-        }
-        for existing_post in existing_posts
-    ]
-    all_posts.append(new_post)
-    _write_schedule(all_posts)
-    verify_posts = _read_schedule()
-    verify_count = len(verify_posts) if verify_posts else 0
-    bot.reply_to(
-        message,
-        f"Пост запланирован на {dispatch_at_utc.astimezone(MSK_TZ).strftime('%Y-%m-%d %H:%M')} МСК!\nВсего запланировано: {verify_count}\nФайлов прикреплено: {len(media)}",
-    )
+    bot.reply_to(message, save_scheduled_post(data))
 
 
 @bot.message_handler(commands=["schedule_status"])
+@timed_handler
 def handle_schedule_status(message: types.Message):
-    if str(message.from_user.id) != ADMIN_ID:
-        bot.reply_to(message, "Эта команда доступна только администратору.")
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
         return
+    text, markup = render_schedule_status()
+    bot.reply_to(message, text, reply_markup=markup)
 
-    posts = _read_schedule()
-    if not posts:
-        bot.reply_to(message, "Нет запланированных постов.")
+@bot.callback_query_handler(func=lambda call: call.data.startswith(STATUS_PAGE_CALLBACK))
+@timed_handler
+def handle_schedule_status_page(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, text=ADMIN_ONLY_TEXT)
         return
+    text, markup = render_schedule_status(parse_page(call.data))
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except apihelper.ApiTelegramException as e:
+        if not is_not_modified(e):
+            raise
+    bot.answer_callback_query(call.id)
 
-    def format_time_for_display(dt):
-        """Конвертирует UTC время в МСК для отображения"""
-        if isinstance(dt, str):
-            dt = datetime.fromisoformat(dt)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=UTC_TZ)
-        dt_msk = dt.astimezone(MSK_TZ)
-        return dt_msk.strftime('%Y-%m-%d %H:%M')
-
-    if len(posts) == 1:
-        post = posts[0]
-        dispatch_at = post['dispatch_at']
-        if isinstance(dispatch_at, str):
-            dispatch_at = datetime.fromisoformat(dispatch_at)
-        if dispatch_at.tzinfo is None:
-            dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-        dispatch_msk = dispatch_at.astimezone(MSK_TZ)
-        
-        bot.reply_to(
-            message,
-            f"Пост запланирован на {dispatch_msk.strftime('%Y-%m-%d %H:%M')} МСК.\n"
-            f"Текст: {post.get('message_text', 'Привет')}"
-        )
-    else:
-        text = f"Всего запланировано постов: {len(posts)}\n\n"
-        for i, post in enumerate(posts, 1):
-            dispatch_at = post['dispatch_at']
-            if isinstance(dispatch_at, str):
-                dispatch_at = datetime.fromisoformat(dispatch_at)
-            if dispatch_at.tzinfo is None:
-                dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-            dispatch_msk = dispatch_at.astimezone(MSK_TZ)
-            
-            dispatch_time = dispatch_msk.strftime('%Y-%m-%d %H:%M')
-            message_preview = post.get('message_text', 'Привет')[:30]
-            if len(post.get('message_text', 'Привет')) > 30:
-                message_preview += "..."
-            text += f"{i}. {dispatch_time} МСК - ⏳ ожидает отправки\n   {message_preview}\n"
-        bot.reply_to(message, text)
+@bot.message_handler(commands=["archive"])
+@timed_handler
+def handle_archive(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    text, markup = render_archive(parse_archive_command(message.text))
+    bot.reply_to(message, text, reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(ARCHIVE_PAGE_CALLBACK))
+@timed_handler
+def handle_archive_page(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, text=ADMIN_ONLY_TEXT)
+        return
+    text, markup = render_archive(parse_archive_command(call.data), parse_page(call.data))
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except apihelper.ApiTelegramException as e:
+        if not is_not_modified(e):
+            raise
+    bot.answer_callback_query(call.id)
+
+@bot.message_handler(commands=["join_status"])
+@timed_handler
+def handle_join_status(message: types.Message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, ADMIN_ONLY_TEXT)
+        return
+    bot.reply_to(message, render_join_status(join_queue.stats()))
 
 @bot.chat_join_request_handler()
+@timed_handler
 def approve_join_request(message):
-    bot.approve_chat_join_request(message.chat.id, message.from_user.id)
+    # Одобрение идёт в фоне через очередь, обработчик не ждёт ответа Telegram
+    join_queue.submit(message.chat.id, message.from_user.id)
 
 
 if __name__ == "__main__":
-    bot.infinity_polling(allowed_updates=["message", "callback_query", "chat_join_request"])
+    parser = argparse.ArgumentParser(description="Бот планирования постов")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="запустить на AsyncTeleBot (asyncio)")
+    parser.add_argument("--webhook", action="store_true", help="принимать апдейты через webhook вместо polling")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARDS", "0")),
+                        help="обрабатывать апдейты в N процессах (см. sharded.py); метрики рабочих процессов - "
+                             "на METRICS_PORT+1..N и в METRICS_FILE.shard<i>")
+    args = parser.parse_args()
+
+    if args.use_async and not args.webhook:
+        # Асинхронный режим - своя точка входа; синхронный бот этого модуля там не нужен
+        async_main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "async_main.py")
+        os.execv(sys.executable, [sys.executable, async_main])
+
+    start_metrics()
+    instrument_api()
+    if args.webhook:
+        from webhook import WebhookServer
+
+        webhook_url = os.getenv("WEBHOOK_URL")
+        if not webhook_url:
+            raise ValueError("WEBHOOK_URL не найден в переменных окружения!")
+        # Без секрета апдейт от имени администратора подделает любой, кто узнал адрес webhook
+        webhook_secret = os.getenv("WEBHOOK_SECRET")
+        if not webhook_secret:
+            raise ValueError("WEBHOOK_SECRET не найден в переменных окружения!")
+        server = WebhookServer(
+            bot,
+            os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            int(os.getenv("WEBHOOK_PORT", "8443")),
+            path=os.getenv("WEBHOOK_PATH", "/telegram"),
+            secret_token=webhook_secret,
+            workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+        )
+        # Обработчики выполняются в рабочих потоках сервера, собственный пул TeleBot не нужен
+        bot.threaded = False
+        bot.remove_webhook()
+        bot.set_webhook(
+            url=webhook_url,
+            secret_token=webhook_secret,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+        server.serve_forever()
+    elif args.shards > 0:
+        from sharded import run_sharded
+
+        bot.remove_webhook()
+        run_sharded(BOT_TOKEN, args.shards, ALLOWED_UPDATES)
+    else:
+        # После webhook-режима Telegram не отдаёт getUpdates, пока webhook не снят
+        bot.remove_webhook()
+        bot.infinity_polling(allowed_updates=ALLOWED_UPDATES)
@@ -0,0 +1,92 @@
+"""План отправки вложений поста с учётом ограничений sendMediaGroup
+
+Telegram принимает в одной группе от 2 до 10 файлов, причём фото и видео можно
+смешивать, а документы и аудио - только с файлами своего типа. План делит
+вложения на допустимые группы так, чтобы запросов было как можно меньше:
+файлы одного вида собираются вместе (в порядке первого появления вида) и режутся
+по 10, одиночный остаток уходит обычным send_photo/send_video/...
+Подпись (текст поста) ставится на первый файл первой группы; если текст длиннее
+лимита подписи, он уходит отдельным сообщением перед файлами.
+
+План строится один раз на пост и переиспользуется для всех чатов рассылки.
+Файлы с диска без file_id (см. file_cache) попадают в группу ссылками attach://,
+сами файлы прикладывает к запросу отправляющий.
+"""
+from telebot import types
+
+MEDIA_GROUP_LIMIT = 10
+CAPTION_LIMIT = 1024
+
+# Вид группы: файлы разных видов в одну группу не попадают
+GROUP_KINDS = {"photo": "visual", "video": "visual", "document": "document", "audio": "audio"}
+INPUT_MEDIA = {
+    "photo": types.InputMediaPhoto,
+    "video": types.InputMediaVideo,
+    "document": types.InputMediaDocument,
+    "audio": types.InputMediaAudio,
+}
+SEND_METHODS = {"photo": "send_photo", "video": "send_video", "document": "send_document", "audio": "send_audio"}
+
+
+def _chunks(items, size):
+    """Делит список на части не больше size, выравнивая размеры (23 -> 8, 8, 7),
+    чтобы не оставлять одиночный файл, если его можно положить в группу"""
+    count = -(-len(items) // size)
+    base, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for number in range(count):
+        end = start + base + (1 if number < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def attach_name(index):
+    """Имя части запроса для файла с диска на позиции index группы"""
+    return f"file{index}"
+
+
+def media_group(items, caption):
+    """InputMedia группы, подпись - на первом файле"""
+    group = [INPUT_MEDIA[item["type"]](item.get("file_id") or f"attach://{attach_name(index)}")
+             for index, item in enumerate(items)]
+    group[0].caption = caption
+    return group
+
+
+def step_items(step):
+    """Вложения шага плана (пустой список для текстового сообщения)"""
+    if step[0] == "single":
+        return [step[1]]
+    if step[0] == "group":
+        return step[2]
+    return []
+
+
+def plan_media(media, text):
+    """Шаги отправки поста, каждый шаг - один запрос к API:
+      ("message", text)            - send_message
+      ("single", item, caption)    - send_photo/send_video/... одного файла
+      ("group", [InputMedia, ...], items) - send_media_group (подпись уже внутри первого файла)"""
+    by_kind = {}
+    for item in media:
+        kind = GROUP_KINDS.get(item.get("type"))
+        if kind is not None:
+            by_kind.setdefault(kind, []).append(item)
+    if not by_kind:
+        return [("message", text)]
+
+    plan = []
+    caption = text
+    if text and len(text) > CAPTION_LIMIT:
+        plan.append(("message", text))
+        caption = None
+    for items in by_kind.values():
+        for chunk in _chunks(items, MEDIA_GROUP_LIMIT):
+            if len(chunk) == 1:
+                plan.append(("single", chunk[0], caption))
+            else:
+                plan.append(("group", media_group(chunk, caption), chunk))
+            caption = None
+    return plan
+
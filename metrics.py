@@ -0,0 +1,274 @@
+"""Метрики бота и рассылки: счётчики, гистограммы и значения (gauge)
+
+Собираются всегда, это дёшево (словарь и bisect под блокировкой). Наружу отдаются,
+только если заданы переменные окружения:
+  METRICS_PORT  - HTTP-эндпоинт /metrics в формате Prometheus (METRICS_HOST, по умолчанию 127.0.0.1)
+  METRICS_FILE  - JSON-снимок, переписывается раз в METRICS_DUMP_INTERVAL секунд и при выходе
+
+Что меряем:
+  bot_handler_seconds{handler}          - время обработчиков бота
+  telegram_api_seconds{method}          - время запросов к Bot API
+  telegram_api_errors_total{method,code} - ошибки Bot API (code="network" - сбой соединения)
+  schedule_store_seconds{operation}     - чтение/запись расписания
+  schedule_posts                        - размер расписания
+  dispatch_lag_seconds                  - опоздание отправки: время доставки минус dispatch_at
+"""
+import asyncio
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import apihelper
+
+from bot_api import session
+
+METRICS_DUMP_INTERVAL = 60
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 86400)
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    parts = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in labels)
+    return "{" + parts + "}"
+
+
+class Metric:
+    """Общая часть: значения по наборам меток, блокировка"""
+
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}  # кортеж (имя, значение) меток -> значение
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return [f"{self.name}{_label_text(labels)} {value}"]
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(labels), "value": self._snapshot_value(value)}
+                    for labels, value in self._values.items()]
+
+    def _snapshot_value(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными границами корзин, как в Prometheus"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счётчики по корзинам (последняя - +Inf), сумма, количество
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, labels, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{self.name}_sum{_label_text(labels)} {total}")
+        lines.append(f"{self.name}_count{_label_text(labels)} {count}")
+        return lines
+
+    def _snapshot_value(self, value):
+        counts, total, count = value
+        return {"buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], counts)),
+                "sum": total, "count": count}
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Текст в формате Prometheus (text exposition 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+
+registry = Registry()
+HANDLER_SECONDS = registry.add(Histogram("bot_handler_seconds", "Время обработчиков бота"))
+API_SECONDS = registry.add(Histogram("telegram_api_seconds", "Время запросов к Bot API"))
+API_ERRORS = registry.add(Counter("telegram_api_errors_total", "Ошибки запросов к Bot API"))
+STORE_SECONDS = registry.add(Histogram("schedule_store_seconds", "Время чтения и записи расписания"))
+SCHEDULE_POSTS = registry.add(Gauge("schedule_posts", "Постов в расписании"))
+DISPATCH_LAG = registry.add(Histogram("dispatch_lag_seconds", "Время доставки минус dispatch_at", LAG_BUCKETS))
+DEAD_LETTERS = registry.add(Counter("dead_letters_total", "Постов, снятых с рассылки в мёртвые письма"))
+
+
+def timed_handler(func):
+    """Декоратор обработчика бота: время попадает в bot_handler_seconds{handler=имя функции}"""
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with HANDLER_SECONDS.time(handler=func.__name__):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with HANDLER_SECONDS.time(handler=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def instrument_api():
+    """Замеряет запросы синхронного TeleBot через apihelper.CUSTOM_REQUEST_SENDER"""
+    send = apihelper.CUSTOM_REQUEST_SENDER or (lambda method, url, **kwargs: session().request(method, url, **kwargs))
+
+    def timed_send(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            response = send(method, url, **kwargs)
+        except Exception:
+            API_ERRORS.inc(method=api_method, code="network")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        if response.status_code != 200:
+            API_ERRORS.inc(method=api_method, code=response.status_code)
+        return response
+
+    apihelper.CUSTOM_REQUEST_SENDER = timed_send
+
+
+def instrument_async_api():
+    """То же для AsyncTeleBot: оборачивает asyncio_helper._process_request"""
+    from telebot import asyncio_helper
+
+    process_request = asyncio_helper._process_request
+
+    async def timed_process_request(token, url, method="get", params=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await process_request(token, url, method, params, files, **kwargs)
+        except asyncio_helper.ApiTelegramException as e:  # свой класс, не apihelper.ApiTelegramException
+            API_ERRORS.inc(method=url, code=e.error_code)
+            raise
+        except Exception:
+            API_ERRORS.inc(method=url, code="network")
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=url)
+
+    asyncio_helper._process_request = timed_process_request
+
+
+def dump_metrics(path):
+    """Атомарно записывает JSON-снимок метрик"""
+    snapshot = {"time": time.time(), "metrics": registry.snapshot()}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(snapshot, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _dump_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            dump_metrics(path)
+        except OSError as e:
+            print(f"Не удалось записать метрики в {path}: {e}")
+
+
+def start_metrics():
+    """Включает эндпоинт и JSON-снимки по переменным окружения; без них ничего не делает"""
+    port = os.getenv("METRICS_PORT")
+    if port:
+        server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "127.0.0.1"), int(port)), _MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Метрики: http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    path = os.getenv("METRICS_FILE")
+    if path:
+        interval = float(os.getenv("METRICS_DUMP_INTERVAL", METRICS_DUMP_INTERVAL))
+        threading.Thread(target=_dump_loop, args=(path, interval), name="metrics-dump", daemon=True).start()
+        # Последний снимок при выходе - для разовых запусков send_post.py из cron
+        atexit.register(dump_metrics, path)
@@ -0,0 +1,63 @@
+"""Файл-подсказка с ближайшим временем отправки для быстрого запуска send_post.py из cron
+
+Хранилище расписания после каждой записи обновляет рядом с собой маленький файл
+(schedule.db.next, schedule.bin.next, ...) с минимальным dispatch_at постов и next_run
+повторяющихся правил. send_post.py читает его до импорта telebot и хранилища и,
+если отправлять нечего, сразу выходит. Модуль намеренно без зависимостей.
+
+Содержимое - epoch-секунды ближайшей отправки или "-", если отправлять нечего.
+Нет файла или он не читается - время неизвестно, нужен полный проход.
+"""
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+NEXT_DUE_SUFFIX = ".next"
+NOTHING = "-"
+
+# Бэкенд -> (переменная окружения с путём, файл по умолчанию), как в schedule_store.get_store
+SCHEDULE_PATHS = {
+    "sqlite": ("SCHEDULE_DB", "schedule.db"),
+    "binary": ("SCHEDULE_BIN", "schedule.bin"),
+    "json": ("SCHEDULE_FILE", "schedule.json"),
+}
+
+
+def next_due_path():
+    """Путь файла-подсказки для хранилища, выбранного переменными окружения"""
+    backend = os.getenv("SCHEDULE_BACKEND", "sqlite").lower()
+    if backend not in SCHEDULE_PATHS:
+        return None
+    variable, file_name = SCHEDULE_PATHS[backend]
+    return os.getenv(variable, os.path.join(BASE_DIR, file_name)) + NEXT_DUE_SUFFIX
+
+
+def read_next_due(path):
+    """(известно ли время, epoch ближайшей отправки или None - отправлять нечего)"""
+    try:
+        with open(path, "r", encoding="ascii") as file:
+            text = file.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return False, None
+    if text == NOTHING:
+        return True, None
+    try:
+        return True, int(text)
+    except ValueError:
+        return False, None
+
+
+def write_next_due(path, epoch):
+    """Атомарно записывает время ближайшей отправки (None - отправлять нечего)"""
+    temp_file = path + ".tmp"
+    with open(temp_file, "w", encoding="ascii") as file:
+        file.write(NOTHING if epoch is None else str(int(epoch)))
+    os.replace(temp_file, path)
+
+
+def nothing_due(now):
+    """True, если по файлу-подсказке к моменту now отправлять нечего"""
+    path = next_due_path()
+    if path is None:
+        return False
+    known, epoch = read_next_due(path)
+    return known and (epoch is None or epoch > now)
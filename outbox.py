@@ -0,0 +1,60 @@
+"""Журнал доставки (outbox) для send_post.py
+
+Каждая успешная отправка сразу дописывается в журнал и сбрасывается на диск,
+поэтому после падения посреди пачки уже доставленные посты не уходят повторно.
+Ключ - пара (id поста, чат), поэтому при рассылке в несколько чатов
+повторяются только недоставленные. Журнал хранит только ключи текущей пачки и очищается,
+как только удаление доставленных постов зафиксировано в расписании.
+"""
+import os
+import threading
+
+from schedule_store import BASE_DIR
+
+OUTBOX_FILE = os.path.join(BASE_DIR, "schedule.outbox")
+
+
+def delivery_key(post, chat_id):
+    """Ключ идемпотентности доставки поста в конкретный чат"""
+    return f"{post.id}:{chat_id}"
+
+
+def parse_delivery_key(key):
+    """Разбирает ключ на (id поста, id чата); id чата не содержит двоеточий"""
+    post_id, _, chat_id = key.rpartition(":")
+    return post_id, chat_id
+
+
+class DeliveryLog:
+    """Append-only журнал ключей доставленных постов, одна строка - один ключ"""
+
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()  # пишут параллельные задачи рассылки
+
+    def delivered(self):
+        """Ключи, записанные в журнал (после падения - ещё не удалённые из расписания)"""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, "r", encoding="utf-8") as file:
+            # Недописанная последняя строка (падение во время записи) не считается доставкой
+            return {line[:-1] for line in file if line.endswith("\n")}
+
+    def record(self, key):
+        """Дописывает ключ и сразу сбрасывает его на диск (fsync)"""
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(key + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def clear(self):
+        """Очищает журнал после того, как расписание зафиксировало удаление"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,180 @@
+"""Общий ограничитель частоты запросов к Telegram Bot API
+
+Лимиты Telegram (https://core.telegram.org/bots/faq#broadcasting-to-users):
+  - не больше ~30 сообщений в секунду суммарно;
+  - не больше 1 сообщения в секунду в один чат;
+  - не больше 20 сообщений в минуту в одну группу или канал.
+Ответ 429 содержит parameters.retry_after - столько секунд чат заблокирован.
+"""
+import math
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+GLOBAL_RATE = 30  # сообщений в секунду на бота
+CHAT_RATE = 1  # сообщений в секунду на чат
+GROUP_RATE = 20 / 60  # сообщений в секунду на группу/канал
+GROUP_BURST = 20
+
+# 429 с retry_after не больше этого значения пережидаем на месте, иначе пост переносится
+MAX_INLINE_RETRY_AFTER = 5
+MAX_INLINE_RETRIES = 3
+
+
+class RetryAfter(Exception):
+    """Telegram попросил подождать дольше, чем имеет смысл ждать на месте"""
+
+    def __init__(self, retry_after, description=""):
+        super().__init__(f"Flood control: повторить через {retry_after} с. {description}".strip())
+        self.retry_after = retry_after
+
+
+def parse_retry_after(exc):
+    """Достаёт retry_after из ответа 429 (None, если это другая ошибка)"""
+    if not isinstance(exc, ApiTelegramException) or exc.error_code != 429:
+        return None
+    parameters = (exc.result_json or {}).get("parameters") or {}
+    try:
+        return float(parameters.get("retry_after", 1))
+    except (TypeError, ValueError):
+        return 1.0
+
+
+class TokenBucket:
+    """Token bucket с резервированием: токены можно взять в долг, вызывающий ждёт отдачи долга"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """Резервирует amount токенов и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            debt_wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(debt_wait, self.blocked_until - now, 0.0)
+
+    def blocked_for(self):
+        """Сколько секунд корзина ещё заблокирована после 429"""
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def block(self, seconds):
+        """Блокирует корзину на seconds (после ответа 429)"""
+        with self._lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0
+            self.updated = now
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """Корзина с подстройкой скорости (AIMD): после 429 скорость падает вдвое,
+    после каждого успешного запроса понемногу растёт обратно до max_rate"""
+
+    def __init__(self, max_rate, min_rate=1.0, increase=0.5):
+        super().__init__(max_rate, max_rate)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttled(self, retry_after):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+        self.block(retry_after)
+
+
+class RateLimiter:
+    """Глобальная корзина на бота и отдельные корзины на каждый чат"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, group_rate=GROUP_RATE):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self._chat_buckets = {}
+        self._lock = threading.Lock()
+        # Статистика использования
+        self.started = time.monotonic()
+        self.calls = 0
+        self.tokens_used = 0
+        self.waited = 0.0
+        self.rate_limited = 0
+
+    def _buckets_for(self, chat_id):
+        key = str(chat_id)
+        with self._lock:
+            buckets = self._chat_buckets.get(key)
+            if buckets is None:
+                buckets = [TokenBucket(self.chat_rate, 1)]
+                # Отрицательные id - группы и каналы, у них ещё и минутный лимит
+                if key.startswith("-"):
+                    buckets.append(TokenBucket(self.group_rate, GROUP_BURST))
+                self._chat_buckets[key] = buckets
+            return buckets
+
+    def acquire(self, chat_id, cost=1):
+        """Ждёт, пока запрос стоимостью cost сообщений можно отправить в chat_id.
+        Если чат заблокирован ответом 429 надолго, бросает RetryAfter."""
+        buckets = [self.global_bucket] + self._buckets_for(chat_id)
+        # Чат под долгой блокировкой: не ждём на месте, а сразу просим перенести отправку
+        blocked = max(bucket.blocked_for() for bucket in buckets)
+        if blocked > MAX_INLINE_RETRY_AFTER:
+            raise RetryAfter(math.ceil(blocked))
+        wait = max(bucket.reserve(cost) for bucket in buckets)
+        with self._lock:
+            self.calls += 1
+            self.tokens_used += cost
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def call(self, chat_id, func, *args, cost=1, **kwargs):
+        """Вызывает метод бота с учётом лимитов. Короткий 429 пережидается на месте,
+        длинный превращается в RetryAfter, чтобы вызывающий перенёс отправку."""
+        for _ in range(MAX_INLINE_RETRIES + 1):
+            self.acquire(chat_id, cost)
+            try:
+                return func(*args, **kwargs)
+            except ApiTelegramException as e:
+                retry_after = parse_retry_after(e)
+                if retry_after is None:
+                    raise
+                with self._lock:
+                    self.rate_limited += 1
+                for bucket in self._buckets_for(chat_id):
+                    bucket.block(retry_after)
+                if retry_after > MAX_INLINE_RETRY_AFTER:
+                    raise RetryAfter(retry_after, e.description) from e
+        raise RetryAfter(MAX_INLINE_RETRY_AFTER)
+
+    def stats(self):
+        """Загрузка лимитов: доля использованного глобального лимита, ожидание и число 429"""
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            capacity = self.global_bucket.rate * elapsed
+            return {
+                "calls": self.calls,
+                "messages": self.tokens_used,
+                "utilization": min(self.tokens_used / capacity, 1.0),
+                "waited_seconds": round(self.waited, 3),
+                "rate_limited": self.rate_limited,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (
+            f"Лимиты Telegram: запросов {stats['calls']}, сообщений {stats['messages']}, "
+            f"загрузка {stats['utilization']:.0%}, ожидание {stats['waited_seconds']} с, "
+            f"ответов 429: {stats['rate_limited']}"
+        )
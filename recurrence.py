@@ -0,0 +1,100 @@
+"""Повторяющиеся посты: расписание в формате cron
+
+Правило хранится одной записью (schedule_store.Rule) с моментом ближайшей отправки
+next_run. Будущие отправки заранее не создаются: когда next_run наступает,
+рассылка кладёт в расписание один обычный пост и сдвигает next_run на следующее
+совпадение (CronRule.next_after), поэтому размер расписания и работа на каждом
+проходе зависят от числа правил, а не от числа повторов.
+
+Выражение - пять полей cron по московскому времени: минута, час, день месяца,
+месяц, день недели (0 и 7 - воскресенье). Поддерживаются *, списки, диапазоны,
+шаг и сокращения @hourly, @daily, @weekly, @monthly:
+    0 9 * * *       каждый день в 09:00
+    30 18 * * 1-5   по будням в 18:30
+    0 12 1,15 * *   1-го и 15-го числа в полдень
+"""
+from datetime import datetime, timedelta, timezone
+
+MSK_TZ = timezone(timedelta(hours=3))  # правила задаются по Москве, как и /schedule
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+# (минимум, максимум) полей: минута, час, день месяца, месяц, день недели
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# Дальше этого горизонта совпадений не ищем (например, '0 0 31 2 *' не наступит никогда)
+SEARCH_DAYS = 366 * 5
+
+
+def _parse_field(text, low, high):
+    """Множество значений поля cron"""
+    values = set()
+    for part in text.split(","):
+        part, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(value) for value in part.split("-", 1))
+        else:
+            start = end = int(part)
+            if step != 1:
+                end = high
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"значение вне диапазона {low}-{high}: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronRule:
+    """Разобранное cron-выражение"""
+
+    def __init__(self, expression):
+        expression = ALIASES.get(expression.strip(), expression.strip())
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("нужно пять полей: минута час день месяц день_недели")
+        parsed = [_parse_field(text, low, high) for text, (low, high) in zip(fields, FIELD_RANGES)]
+        self.expression = expression
+        self.minutes = sorted(parsed[0])
+        self.hours = sorted(parsed[1])
+        self.days = parsed[2]
+        self.months = parsed[3]
+        self.weekdays = {day % 7 for day in parsed[4]}  # 0 - воскресенье
+        # Как в cron: если ограничены и день месяца, и день недели, подходит любой из них
+        self._any_day = fields[2] != "*" and fields[4] != "*"
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        day_ok = day.day in self.days
+        weekday_ok = day.isoweekday() % 7 in self.weekdays
+        return day_ok or weekday_ok if self._any_day else day_ok and weekday_ok
+
+    def next_after(self, epoch):
+        """Ближайшее совпадение строго после epoch (epoch-секунды UTC); None, если его нет"""
+        start = datetime.fromtimestamp(int(epoch) // 60 * 60 + 60, MSK_TZ)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(SEARCH_DAYS):
+            if self._day_matches(day):
+                first_day = day.date() == start.date()
+                for hour in self.hours:
+                    if first_day and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if first_day and hour == start.hour and minute < start.minute:
+                            continue
+                        return int(day.replace(hour=hour, minute=minute).timestamp())
+            day += timedelta(days=1)
+        return None
+
+
+def parse_rule(expression):
+    """CronRule из выражения или None, если оно неверное"""
+    try:
+        return CronRule(expression)
+    except ValueError:
+        return None
@@ -0,0 +1,47 @@
+"""Повторы неудачных отправок: классификация ошибок и экспоненциальная задержка
+
+Временные ошибки (сеть, 5xx, неизвестные) повторяются с задержкой
+RETRY_BASE_DELAY * 2^(попытка - 1), не больше RETRY_MAX_DELAY, со случайной
+добавкой до RETRY_JITTER, чтобы упавшие вместе посты не повторялись все разом.
+Постоянные ошибки (400 - неверный file_id или набор вложений, 403 - бота убрали
+из чата, 404, файл вне MEDIA_ROOT) повтором не лечатся: пост сразу уходит в мёртвые письма, как и
+пост, не отправленный за MAX_ATTEMPTS попыток. Flood control (RetryAfter) -
+не ошибка поста: он переносится на названное Telegram время без учёта попытки.
+"""
+import os
+import random
+
+from telebot.apihelper import ApiTelegramException
+
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", "6"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "60"))  # секунд до первого повтора
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "3600"))
+RETRY_JITTER = 0.1  # доля задержки
+# Коды ответов Bot API, при которых повтор того же запроса бессмысленен.
+# 401 (неверный токен) и 429 сюда не входят: это беда бота, а не поста
+PERMANENT_ERROR_CODES = (400, 403, 404)
+
+
+class PermanentError(Exception):
+    """Ошибка поста вне Bot API, которую повтор не исправит"""
+
+
+def is_permanent(error):
+    """Ошибка, которую повтор не исправит"""
+    if isinstance(error, PermanentError):
+        return True
+    return isinstance(error, ApiTelegramException) and error.error_code in PERMANENT_ERROR_CODES
+
+
+def retry_delay(attempts, rng=random, base_delay=None, max_delay=None):
+    """Задержка (секунды) перед повтором после attempts неудачных попыток.
+    base_delay и max_delay по умолчанию - RETRY_BASE_DELAY и RETRY_MAX_DELAY"""
+    base_delay = RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = RETRY_MAX_DELAY if max_delay is None else max_delay
+    delay = min(base_delay * 2 ** max(attempts - 1, 0), max_delay)
+    return delay * (1 + RETRY_JITTER * rng.random())
+
+
+def describe_errors(failed):
+    """Текст ошибок по чатам для журнала и мёртвого письма"""
+    return "; ".join(f"{chat_id}: {error}" for chat_id, error in failed.items())
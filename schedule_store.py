@@ -0,0 +1,1332 @@
+"""Общее хранилище расписания постов для main.py и send_post.py
+
+Бэкенд выбирается переменной окружения SCHEDULE_BACKEND:
+  sqlite (по умолчанию) - встроенная база SQLite (WAL, индекс по dispatch_at)
+  binary                - компактный двоичный файл schedule.bin (struct-записи)
+  json                  - старый формат: весь список в schedule.json
+
+После каждой записи рядом с расписанием обновляется файл-подсказка с ближайшим
+временем отправки (path + '.next', см. next_due.py) для быстрого выхода send_post.py.
+
+JSON остаётся форматом импорта и экспорта:
+    python schedule_store.py export backup.json
+    python schedule_store.py import backup.json
+"""
+import argparse
+import bisect
+import gc
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import uuid
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import accumulate
+
+from next_due import NEXT_DUE_SUFFIX, read_next_due, write_next_due
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+UTC_TZ = timezone.utc  # UTC
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEDULE_FILE = os.path.join(BASE_DIR, "schedule.json")
+SCHEDULE_DB = os.path.join(BASE_DIR, "schedule.db")
+SCHEDULE_BIN = os.path.join(BASE_DIR, "schedule.bin")
+# Отметка рядом с schedule.json: отправленные записи старого формата уже в архиве
+LEGACY_SENT_MARKER_SUFFIX = ".legacy-archived"
+
+DEFAULT_MESSAGE_TEXT = "Привет"
+
+
+@dataclass(slots=True)
+class Post:
+    """Запланированный пост. dispatch_at - epoch-секунды UTC, media - список
+    {"type", "file_id"} или {"type", "path"} для файлов с диска (см. file_cache), targets - свои чаты поста (None - чаты по умолчанию),
+    attempts - сколько раз отправка уже не удалась (см. retry_policy)."""
+
+    id: str
+    dispatch_at: int
+    message_text: str = DEFAULT_MESSAGE_TEXT
+    media: list = field(default_factory=list)
+    targets: list = None
+    attempts: int = 0
+
+    @property
+    def dispatch_datetime(self):
+        """dispatch_at как aware datetime в UTC (для вывода)"""
+        return datetime.fromtimestamp(self.dispatch_at, UTC_TZ)
+
+    def to_json(self):
+        """Запись для JSON-файла расписания (время - ISO-строкой, как в старом формате)"""
+        data = {
+            "id": self.id,
+            "dispatch_at": self.dispatch_datetime.isoformat(),
+            "message_text": self.message_text,
+            "media": self.media,
+        }
+        if self.targets:
+            data["targets"] = self.targets
+        if self.attempts:
+            data["attempts"] = self.attempts
+        return data
+
+
+@dataclass(slots=True)
+class Rule:
+    """Повторяющийся пост (см. recurrence): cron - выражение по Москве, next_run -
+    ближайшая отправка в epoch-секундах UTC. Остальные поля - как у Post."""
+
+    id: str
+    cron: str
+    next_run: int
+    message_text: str = DEFAULT_MESSAGE_TEXT
+    media: list = field(default_factory=list)
+    targets: list = None
+
+    def occurrence(self):
+        """Пост для отправки в next_run. id зависит от времени, поэтому повторная
+        попытка после сбоя заменяет тот же пост, а не создаёт второй"""
+        return Post(f"{self.id}@{self.next_run}", self.next_run, self.message_text, self.media, self.targets)
+
+    def to_json(self):
+        data = {
+            "id": self.id,
+            "cron": self.cron,
+            "next_run": self.next_run,
+            "message_text": self.message_text,
+            "media": self.media,
+        }
+        if self.targets:
+            data["targets"] = self.targets
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["id"], data["cron"], data["next_run"], data.get("message_text", DEFAULT_MESSAGE_TEXT),
+                   data.get("media") or [], data.get("targets") or None)
+
+
+@dataclass(slots=True)
+class DeadLetter:
+    """Пост, снятый с рассылки (мёртвое письмо): постоянная ошибка или исчерпаны
+    попытки. failed_at - время последней попытки (epoch-секунды UTC), error - её ошибка."""
+
+    post: Post
+    failed_at: int
+    error: str
+
+    def to_json(self):
+        return {"post": self.post.to_json(), "failed_at": self.failed_at, "error": self.error}
+
+    @classmethod
+    def from_json(cls, data):
+        post = normalize_post(data["post"])
+        if post is None:
+            raise ValueError("неверная запись поста")
+        return cls(post, data["failed_at"], data.get("error", ""))
+
+
+def to_epoch(value):
+    """Приводит epoch-секунды, datetime или ISO-строку к целым epoch-секундам UTC (None, если не удалось)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        # Если время без timezone, считаем его UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=UTC_TZ)
+        return int(value.timestamp())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    return None
+
+
+def normalize_post(post_data):
+    """Приводит запись поста (Post или dict из JSON) к Post
+    (None для некорректных и отправленных записей)"""
+    if isinstance(post_data, Post):
+        return post_data
+    if not isinstance(post_data, dict):
+        return None
+    # Пропускаем уже отправленные посты
+    if post_data.get("sent", False):
+        return None
+    dispatch_at = to_epoch(post_data.get("dispatch_at"))
+    if dispatch_at is None:
+        return None
+    media = post_data.get("media") or []
+    if not isinstance(media, list):
+        media = []
+    # Свой список чатов для поста; None - отправка в чаты по умолчанию
+    targets = post_data.get("targets") or None
+    if targets is not None:
+        targets = [str(chat_id) for chat_id in targets] if isinstance(targets, list) else None
+    attempts = post_data.get("attempts") or 0
+    return Post(
+        str(post_data.get("id") or uuid.uuid4()),
+        dispatch_at,
+        post_data.get("message_text", DEFAULT_MESSAGE_TEXT),
+        media,
+        targets,
+        attempts if isinstance(attempts, int) and not isinstance(attempts, bool) else 0,
+    )
+
+
+def content_hash(post):
+    """Хэш содержимого поста (время отправки, текст, file_id или пути вложений) для поиска дубликатов"""
+    digest = hashlib.sha256()
+    digest.update(str(post.dispatch_at).encode())
+    digest.update(b"\0" + post.message_text.encode())
+    for item in post.media:
+        digest.update(b"\0" + str(item.get("file_id") or item.get("path")).encode())
+    return digest.hexdigest()
+
+
+def _merge_targets(first, second):
+    """Объединение списков чатов двух частей одного поста (None - все чаты по умолчанию)"""
+    if first is None or second is None:
+        return None
+    return first + [chat_id for chat_id in second if chat_id not in first]
+
+
+def load_json_schedule(path=SCHEDULE_FILE):
+    """Читает посты из JSON-файла расписания (новый формат - список, старый - один dict)"""
+    if not os.path.exists(path):
+        return []
+
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (json.JSONDecodeError, IOError) as e:
+        # Если файл поврежден, удаляем его и возвращаем пустой список
+        print(f"Ошибка чтения файла расписания: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+        return []
+
+    # Поддержка старого формата (один пост)
+    if isinstance(data, dict) and "dispatch_at" in data:
+        data = [data]
+
+    if not isinstance(data, list):
+        # Если формат не распознан, возвращаем пустой список
+        return []
+
+    posts = []
+    for post_data in data:
+        post = normalize_post(post_data)
+        if post is not None:
+            posts.append(post)
+
+    skipped_count = len(data) - len(posts)
+    if skipped_count > 0:
+        print(f"При чтении пропущено {skipped_count} из {len(data)} постов")
+    return posts
+
+
+def dump_json_schedule(posts, path=SCHEDULE_FILE):
+    """Атомарно записывает посты в JSON-файл (пустой список удаляет файл)"""
+    payload = [post.to_json() for post in posts]
+    if not payload:
+        # Если постов нет, не создаём файл или удаляем существующий
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    # Записываем во временный файл и атомарно заменяем старый
+    temp_file = path + ".tmp"
+    try:
+        with open(temp_file, "w", encoding="utf-8") as file:
+            json.dump(payload, file, ensure_ascii=False, indent=2)
+        os.replace(temp_file, path)
+    except Exception as e:
+        print(f"Ошибка при записи файла расписания: {e}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+class FileLock:
+    """Блокировка писателей файлового расписания: threading.Lock между потоками и
+    advisory-блокировка fcntl.flock на файле-замке между процессами (бот и рассылка).
+    Читатели её не берут: писатели заменяют файл атомарно (os.replace) или дописывают
+    в конец, поэтому читатель всегда видит целый снимок."""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a+b")
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class ScheduleStore:
+    """Интерфейс хранилища расписания. Посты - объекты Post; на вход add/add_many
+    принимают и dict в формате JSON-файла. Время (dispatch_at, moment) - epoch-секунды
+    или datetime."""
+
+    # Сколько постов массовой загрузке (bulk_import) выгодно писать одним add_many;
+    # None - всё за одну запись
+    write_batch = 1000
+
+    def add(self, post):
+        """Добавляет один пост"""
+        raise NotImplementedError
+
+    def add_many(self, posts):
+        """Добавляет несколько постов"""
+        for post in posts:
+            self.add(post)
+
+    def delete(self, post_id):
+        """Удаляет пост по id"""
+        self.delete_many([post_id])
+
+    def delete_many(self, post_ids):
+        """Удаляет несколько постов за одну запись"""
+        raise NotImplementedError
+
+    def reschedule(self, post_id, dispatch_at):
+        """Переносит пост на новое время"""
+        raise NotImplementedError
+
+    def set_targets(self, post_id, targets):
+        """Заменяет список чатов поста (например, оставляет только недоставленные)"""
+        raise NotImplementedError
+
+    def get(self, post_id):
+        """Пост по id (None, если его нет)"""
+        for post in self.all():
+            if post.id == post_id:
+                return post
+        return None
+
+    def due_before(self, moment):
+        """Посты с dispatch_at <= moment, по возрастанию времени"""
+        raise NotImplementedError
+
+    def has_duplicate(self, post):
+        """Есть ли уже пост с тем же временем, текстом и вложениями"""
+        post_hash = content_hash(normalize_post(post))
+        return any(content_hash(existing) == post_hash for existing in self.all())
+
+    def all(self):
+        """Все посты, по возрастанию времени"""
+        raise NotImplementedError
+
+    def existing_hashes(self, hashes):
+        """Какие из хэшей содержимого (content_hash) уже есть в расписании"""
+        hashes = set(hashes)
+        return {post_hash for post_hash in map(content_hash, self.all()) if post_hash in hashes}
+
+    def count(self):
+        """Количество запланированных постов"""
+        return len(self.all())
+
+    def page(self, offset, limit):
+        """limit постов по возрастанию времени, начиная с позиции offset"""
+        return self.all()[offset:offset + limit]
+
+    def version(self):
+        """Метка состояния расписания для кэшей: меняется при любом изменении.
+        По умолчанию - inode, время изменения и размер файлов из watch_paths()."""
+        signature = []
+        for path in self.watch_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def added_since(self, seq):
+        """Посты, добавленные после отметки seq, и новая отметка.
+        Отметка None означает, что бэкенд отдал всё расписание целиком."""
+        return self.all(), None
+
+    def watch_paths(self):
+        """Файлы, изменение которых означает изменение расписания"""
+        return []
+
+    # Повторяющиеся правила. Их мало (единицы-сотни), поэтому храним рядом с постами
+
+    def add_rule(self, rule):
+        """Добавляет или заменяет правило"""
+        raise NotImplementedError
+
+    def delete_rule(self, rule_id):
+        """Удаляет правило; False, если его не было"""
+        raise NotImplementedError
+
+    def rules(self):
+        """Все правила по возрастанию next_run"""
+        raise NotImplementedError
+
+    def due_rules(self, moment):
+        """Правила с next_run <= moment"""
+        moment = to_epoch(moment)
+        return [rule for rule in self.rules() if rule.next_run <= moment]
+
+    def next_rule_run(self):
+        """Ближайший next_run среди правил (None, если правил нет)"""
+        rules = self.rules()
+        return rules[0].next_run if rules else None
+
+    def advance_rule(self, rule_id, next_run):
+        """Сдвигает правило на следующую отправку (None - повторов больше нет, правило удаляется)"""
+        raise NotImplementedError
+
+    # Неудачные отправки. Посты, которые больше не повторяются, переносятся в мёртвые
+    # письма (dead letters); их единицы, поэтому они хранятся рядом с постами, как правила
+
+    def record_failure(self, post_id, retry_at):
+        """Учитывает неудачную попытку отправки: attempts + 1 и перенос на retry_at.
+        Возвращает новое число попыток (None, если поста нет)."""
+        raise NotImplementedError
+
+    def add_dead_letter(self, letter):
+        """Добавляет или заменяет мёртвое письмо (ключ - id поста)"""
+        raise NotImplementedError
+
+    def delete_dead_letter(self, post_id):
+        """Удаляет мёртвое письмо; False, если его не было"""
+        raise NotImplementedError
+
+    def dead_letters(self):
+        """Все мёртвые письма по времени последней попытки"""
+        raise NotImplementedError
+
+    def _dead_letter(self, post, error, failed_at):
+        """Письмо для post; если у поста уже есть письмо (часть чатов отпала раньше),
+        его чаты и ошибки сохраняются в новом"""
+        previous = next((letter for letter in self.dead_letters() if letter.post.id == post.id), None)
+        if previous is None:
+            return DeadLetter(post, int(failed_at), error)
+        targets = _merge_targets(previous.post.targets, post.targets)
+        post = Post(post.id, post.dispatch_at, post.message_text, post.media, targets, post.attempts)
+        return DeadLetter(post, int(failed_at), f"{previous.error}; {error}")
+
+    def bury(self, post, error, failed_at):
+        """Снимает пост с рассылки в мёртвые письма. Сначала запись письма, потом удаление:
+        при падении между ними пост останется и там, и там, а не пропадёт."""
+        self.add_dead_letter(self._dead_letter(post, error, failed_at))
+        self.delete(post.id)
+
+    def bury_targets(self, post, error, failed_at):
+        """Пишет в мёртвое письмо только чаты post.targets (постоянная ошибка части чатов);
+        сам пост остаётся в расписании, оставшиеся чаты задаёт вызывающий (set_targets)"""
+        self.add_dead_letter(self._dead_letter(post, error, failed_at))
+
+    def requeue(self, post_id, dispatch_at):
+        """Возвращает мёртвое письмо в расписание на dispatch_at со сброшенным счётчиком
+        попыток. Возвращает пост (None, если письма нет). Если остальные чаты поста
+        ещё в повторах, чаты письма добавляются к ним."""
+        for letter in self.dead_letters():
+            if letter.post.id == post_id:
+                scheduled = self.get(post_id)
+                if scheduled is not None:
+                    self.set_targets(post_id, _merge_targets(scheduled.targets, letter.post.targets) or [])
+                    self.delete_dead_letter(post_id)
+                    return self.get(post_id)
+                post = letter.post
+                post = Post(post.id, to_epoch(dispatch_at), post.message_text, post.media, post.targets)
+                self.add(post)
+                self.delete_dead_letter(post_id)
+                return post
+        return None
+
+    def first_dispatch(self):
+        """Наименьший dispatch_at среди постов (None, если постов нет)"""
+        posts = self.page(0, 1)
+        return posts[0].dispatch_at if posts else None
+
+    def refresh_next_due(self):
+        """Записывает файл-подсказку path + '.next' для быстрого запуска send_post.py
+        (см. next_due.py). Вызывается после каждой записи, меняющей время отправок.
+        Время читается заново под отдельной FileLock уже после записи: последний
+        обновивший видит изменения всех писателей, и подсказка не бывает позже правды."""
+        path = self.path + NEXT_DUE_SUFFIX
+        with self._next_due_lock:
+            times = [epoch for epoch in (self.first_dispatch(), self.next_rule_run()) if epoch is not None]
+            next_due = min(times, default=None)
+            # Большинство записей ближайшее время не меняет - чтение дешевле перезаписи файла
+            if read_next_due(path) != (True, next_due):
+                write_next_due(path, next_due)
+
+
+def _load_side_file(path, from_json, what):
+    """Записи маленького JSON-файла рядом с расписанием (правила, мёртвые письма)"""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return [from_json(item) for item in json.load(file)]
+    except FileNotFoundError:
+        return []
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        print(f"Ошибка чтения файла {what}: {e}")
+        return []
+
+
+def _save_side_file(path, items):
+    temp_file = path + ".tmp"
+    with open(temp_file, "w", encoding="utf-8") as file:
+        json.dump([item.to_json() for item in items], file, ensure_ascii=False, indent=2)
+    os.replace(temp_file, path)
+
+
+class FileRulesMixin:
+    """Правила файловых бэкендов: JSON-файл рядом с расписанием (path + '.rules.json').
+    Файл маленький, поэтому каждая запись переписывает его целиком под своей FileLock."""
+
+    def _rules_path(self):
+        return self.path + ".rules.json"
+
+    def _load_rules(self):
+        return _load_side_file(self._rules_path(), Rule.from_json, "правил")
+
+    def _save_rules(self, rules):
+        _save_side_file(self._rules_path(), rules)
+
+    def _change_rules(self, change):
+        with self._rules_lock:
+            rules = self._load_rules()
+            changed, result = change(rules)
+            if changed:
+                self._save_rules(rules)
+        if changed:
+            self.refresh_next_due()
+        return result
+
+    def add_rule(self, rule):
+        def change(rules):
+            rules[:] = [existing for existing in rules if existing.id != rule.id] + [rule]
+            return True, None
+        self._change_rules(change)
+
+    def delete_rule(self, rule_id):
+        def change(rules):
+            remaining = [rule for rule in rules if rule.id != rule_id]
+            found = len(remaining) != len(rules)
+            rules[:] = remaining
+            return found, found
+        return self._change_rules(change)
+
+    def rules(self):
+        return sorted(self._load_rules(), key=lambda rule: rule.next_run)
+
+    def advance_rule(self, rule_id, next_run):
+        def change(rules):
+            for rule in rules:
+                if rule.id == rule_id:
+                    rule.next_run = next_run
+            rules[:] = [rule for rule in rules if rule.next_run is not None]
+            return True, None
+        self._change_rules(change)
+
+
+class FileDeadLettersMixin:
+    """Мёртвые письма файловых бэкендов: JSON-файл path + '.dead.json' под своей FileLock"""
+
+    def _dead_path(self):
+        return self.path + ".dead.json"
+
+    def add_dead_letter(self, letter):
+        with self._dead_lock:
+            letters = _load_side_file(self._dead_path(), DeadLetter.from_json, "мёртвых писем")
+            letters = [existing for existing in letters if existing.post.id != letter.post.id] + [letter]
+            _save_side_file(self._dead_path(), letters)
+
+    def delete_dead_letter(self, post_id):
+        with self._dead_lock:
+            letters = _load_side_file(self._dead_path(), DeadLetter.from_json, "мёртвых писем")
+            remaining = [letter for letter in letters if letter.post.id != post_id]
+            if len(remaining) == len(letters):
+                return False
+            _save_side_file(self._dead_path(), remaining)
+            return True
+
+    def dead_letters(self):
+        letters = _load_side_file(self._dead_path(), DeadLetter.from_json, "мёртвых писем")
+        return sorted(letters, key=lambda letter: letter.failed_at)
+
+
+class JsonScheduleStore(FileRulesMixin, FileDeadLettersMixin, ScheduleStore):
+    """Старый бэкенд: весь список постов в одном JSON-файле.
+    Каждая операция читает и переписывает файл целиком под FileLock."""
+
+    # Каждая запись переписывает весь файл, а расписание и так целиком в памяти
+    write_batch = None
+
+    def __init__(self, path=SCHEDULE_FILE):
+        self.path = path
+        self._lock = FileLock(path + ".lock")
+        self._rules_lock = FileLock(path + ".rules.lock")
+        self._dead_lock = FileLock(path + ".dead.lock")
+        self._next_due_lock = FileLock(path + NEXT_DUE_SUFFIX + ".lock")
+        self._cache = None  # (version(), посты по времени) для count и page
+
+    def add(self, post):
+        self.add_many([post])
+
+    def add_many(self, posts):
+        posts = [normalize_post(post) for post in posts]
+        posts = [post for post in posts if post is not None]
+        ids = {post.id for post in posts}
+        with self._lock:
+            # Пост с тем же id заменяется, как в остальных бэкендах
+            current = [post for post in load_json_schedule(self.path) if post.id not in ids]
+            current.extend(posts)
+            self._dump(current)
+        self.refresh_next_due()
+
+    def delete_many(self, post_ids):
+        post_ids = set(post_ids)
+        if not post_ids:
+            return
+        with self._lock:
+            current = load_json_schedule(self.path)
+            remaining = [post for post in current if post.id not in post_ids]
+            if len(remaining) == len(current):
+                return
+            self._dump(remaining)
+        self.refresh_next_due()
+
+    def _dump(self, posts):
+        """Записывает файл и сразу кладёт записанное в кэш, чтобы не разбирать его заново"""
+        dump_json_schedule(posts, self.path)
+        self._cache = (self.version(), sorted(posts, key=lambda post: post.dispatch_at))
+
+    def _update(self, post_id, **fields):
+        """Меняет поля поста (значение-функция получает старое значение) и возвращает
+        изменённый пост (None, если его нет)"""
+        updated = None
+        with self._lock:
+            current = load_json_schedule(self.path)
+            for post in current:
+                if post.id == post_id:
+                    for name, value in fields.items():
+                        setattr(post, name, value(getattr(post, name)) if callable(value) else value)
+                    updated = post
+            self._dump(current)
+        return updated
+
+    def reschedule(self, post_id, dispatch_at):
+        self._update(post_id, dispatch_at=to_epoch(dispatch_at))
+        self.refresh_next_due()
+
+    def set_targets(self, post_id, targets):
+        self._update(post_id, targets=[str(chat_id) for chat_id in targets] or None)
+
+    def record_failure(self, post_id, retry_at):
+        post = self._update(post_id, attempts=lambda attempts: attempts + 1, dispatch_at=to_epoch(retry_at))
+        self.refresh_next_due()
+        return post.attempts if post else None
+
+    def due_before(self, moment):
+        moment = to_epoch(moment)
+        return [post for post in self.all() if post.dispatch_at <= moment]
+
+    def all(self):
+        return sorted(load_json_schedule(self.path), key=lambda post: post.dispatch_at)
+
+    def _cached(self):
+        """Отсортированные посты, перечитываются только после изменения файла"""
+        version = self.version()
+        if self._cache is None or self._cache[0] != version:
+            self._cache = (version, self.all())
+        return self._cache[1]
+
+    def count(self):
+        return len(self._cached())
+
+    def page(self, offset, limit):
+        return self._cached()[offset:offset + limit]
+
+    def existing_hashes(self, hashes):
+        hashes = set(hashes)
+        return {post_hash for post_hash in map(content_hash, self._cached()) if post_hash in hashes}
+
+    def watch_paths(self):
+        return [self.path, self._rules_path()]
+
+
+class BinaryScheduleStore(FileRulesMixin, FileDeadLettersMixin, ScheduleStore):
+    """Файловый бэкенд в компактном двоичном формате.
+
+    Файл - заголовок BINARY_MAGIC и блоки подряд. Блок хранит пачку постов по
+    столбцам: массив dispatch_at (int64), строки (id, текст, типы, file_id и пути
+    вложений, чаты) одним UTF-8 буфером на столбец с массивом смещений. Чтение - один decode
+    и срезы на столбец, без разбора JSON и дат. add_many дописывает в конец новый блок,
+    удаление и изменение (и накопление BINARY_MAX_BLOCKS блоков) переписывают файл
+    одним блоком. Писатели разных процессов сериализуются через FileLock, читатели
+    работают без блокировок. Прочитанное расписание кэшируется до изменения файла."""
+
+    # Расписание целиком в памяти, а поиск дубликатов перебирает его на каждой пачке
+    write_batch = 10_000
+
+    BINARY_MAGIC = b"SCHB\x02"
+    BLOCK_MAGIC = b"BLK1"
+    BLOCK_HEAD = struct.Struct("<4sII")  # метка, число постов, длина тела блока
+    SECTION_LENGTH = struct.Struct("<I")
+    BINARY_MAX_BLOCKS = 64
+
+    def __init__(self, path=SCHEDULE_BIN):
+        self.path = path
+        self._lock = FileLock(path + ".lock")
+        self._rules_lock = FileLock(path + ".rules.lock")
+        self._dead_lock = FileLock(path + ".dead.lock")
+        self._next_due_lock = FileLock(path + NEXT_DUE_SUFFIX + ".lock")
+        # (отпечаток файла, посты по возрастанию времени, число блоков, файл без обрыва)
+        self._cache = None
+
+    @staticmethod
+    def _array(typecode, values=()):
+        result = array(typecode, values)
+        if sys.byteorder == "big":
+            result.byteswap()  # в файле всегда little-endian
+        return result.tobytes()
+
+    @staticmethod
+    def _from_bytes(typecode, data):
+        result = array(typecode)
+        result.frombytes(data)
+        if sys.byteorder == "big":
+            result.byteswap()
+        return result
+
+    @classmethod
+    def _pack_strings(cls, values):
+        """Столбец строк: смещения в символах и общий UTF-8 буфер"""
+        return [
+            cls._array("I", accumulate(map(len, values), initial=0)),
+            "".join(values).encode("utf-8", "surrogatepass"),
+        ]
+
+    @classmethod
+    def _unpack_strings(cls, offsets, blob):
+        offsets = cls._from_bytes("I", offsets)
+        text = str(blob, "utf-8", "surrogatepass")
+        return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    @classmethod
+    def pack_block(cls, posts):
+        """Двоичный блок с постами"""
+        media = [item for post in posts for item in post.media]
+        targets = [str(chat_id) for post in posts for chat_id in post.targets or ()]
+        sections = [
+            cls._array("q", (post.dispatch_at for post in posts)),
+            *cls._pack_strings([post.id for post in posts]),
+            *cls._pack_strings([post.message_text for post in posts]),
+            cls._array("H", (len(post.media) for post in posts)),
+            *cls._pack_strings([str(item.get("type", "")) for item in media]),
+            *cls._pack_strings([str(item.get("file_id", "")) for item in media]),
+            cls._array("h", (-1 if post.targets is None else len(post.targets) for post in posts)),
+            *cls._pack_strings(targets),
+            cls._array("H", (min(post.attempts, 0xFFFF) for post in posts)),
+            *cls._pack_strings([str(item.get("path", "")) for item in media]),
+        ]
+        body = b"".join(cls.SECTION_LENGTH.pack(len(section)) + section for section in sections)
+        return cls.BLOCK_HEAD.pack(cls.BLOCK_MAGIC, len(posts), len(body)) + body
+
+    @classmethod
+    def unpack_block(cls, body):
+        sections = []
+        offset = 0
+        while offset < len(body):
+            (length,) = cls.SECTION_LENGTH.unpack_from(body, offset)
+            offset += cls.SECTION_LENGTH.size
+            sections.append(body[offset:offset + length])
+            offset += length
+        dispatch_at = cls._from_bytes("q", sections[0])
+        ids = cls._unpack_strings(sections[1], sections[2])
+        texts = cls._unpack_strings(sections[3], sections[4])
+        media_counts = cls._from_bytes("H", sections[5])
+        media = [{"type": media_type, "file_id": file_id} for media_type, file_id in zip(
+            cls._unpack_strings(sections[6], sections[7]), cls._unpack_strings(sections[8], sections[9]))]
+        # Пути файлов с диска - в блоках, записанных после их появления; "" - вложение из Telegram
+        if len(sections) > 15:
+            for item, path in zip(media, cls._unpack_strings(sections[14], sections[15])):
+                if path:
+                    item["path"] = path
+                    if not item["file_id"]:
+                        del item["file_id"]
+        targets_counts = cls._from_bytes("h", sections[10])
+        targets = cls._unpack_strings(sections[11], sections[12])
+        # Блоки, записанные до появления счётчика попыток, его не содержат
+        attempts = cls._from_bytes("H", sections[13]) if len(sections) > 13 else [0] * len(ids)
+
+        # Границы вложений и чатов каждого поста в общих списках столбца
+        media_ends = list(accumulate(media_counts))
+        post_media = [media[end - count:end] for end, count in zip(media_ends, media_counts)]
+        targets_ends = list(accumulate(max(count, 0) for count in targets_counts))
+        post_targets = [targets[end - count:end] if count >= 0 else None
+                        for end, count in zip(targets_ends, targets_counts)]
+        return list(map(Post, ids, dispatch_at, texts, post_media, post_targets, attempts))
+
+    @classmethod
+    def unpack_all(cls, data):
+        """Разбирает содержимое файла. Возвращает (посты, число блоков, файл без обрыва):
+        недописанный последний блок (падение во время добавления) пропускается."""
+        if not data.startswith(cls.BINARY_MAGIC):
+            raise ValueError("не файл расписания")
+        posts = []
+        blocks = 0
+        offset = len(cls.BINARY_MAGIC)
+        view = memoryview(data)
+        while offset + cls.BLOCK_HEAD.size <= len(data):
+            magic, _, length = cls.BLOCK_HEAD.unpack_from(view, offset)
+            body_start = offset + cls.BLOCK_HEAD.size
+            if magic != cls.BLOCK_MAGIC or body_start + length > len(data):
+                break
+            posts.extend(cls.unpack_block(view[body_start:body_start + length]))
+            blocks += 1
+            offset = body_start + length
+        return posts, blocks, offset == len(data)
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # inode меняется при атомарной замене файла, размер - при дописывании блока
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read(self):
+        """(посты, число блоков, файл без обрыва) - из кэша, если файл не менялся"""
+        signature = self._signature()
+        cache = self._cache
+        if cache is not None and cache[0] == signature:
+            return cache[1:]
+        posts, blocks, clean = [], 0, True
+        if signature is not None:
+            # Сборщик мусора на время разбора выключен: сотни тысяч новых объектов
+            # иначе запускают его многократно впустую
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with open(self.path, "rb") as file:
+                    posts, blocks, clean = self.unpack_all(file.read())
+            except (OSError, ValueError, IndexError, struct.error, UnicodeDecodeError) as e:
+                print(f"Ошибка чтения файла расписания: {e}")
+                clean = False
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        posts.sort(key=lambda post: post.dispatch_at)
+        self._cache = (signature, posts, blocks, clean)
+        return posts, blocks, clean
+
+    def _load(self):
+        """Посты файла по возрастанию времени"""
+        return self._read()[0]
+
+    def _rewrite(self, posts):
+        """Атомарно записывает файл одним блоком (пустой список удаляет файл)"""
+        posts = sorted(posts, key=lambda post: post.dispatch_at)
+        if not posts:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        else:
+            temp_file = self.path + ".tmp"
+            with open(temp_file, "wb") as file:
+                file.write(self.BINARY_MAGIC + self.pack_block(posts))
+            os.replace(temp_file, self.path)
+        self._cache = (self._signature(), posts, 1, True)
+
+    def add(self, post):
+        self.add_many([post])
+
+    def add_many(self, posts):
+        posts = [post for post in map(normalize_post, posts) if post is not None]
+        if not posts:
+            return
+        with self._lock:
+            current, blocks, clean = self._read()
+            ids = {post.id for post in posts}
+            if not clean or blocks >= self.BINARY_MAX_BLOCKS or any(post.id in ids for post in current):
+                # Обрыв в конце файла, слишком много мелких блоков или замена существующих постов
+                self._rewrite([post for post in current if post.id not in ids] + posts)
+            else:
+                with open(self.path, "ab") as file:
+                    if file.tell() == 0:
+                        file.write(self.BINARY_MAGIC)
+                    file.write(self.pack_block(posts))
+                merged = sorted(current + posts, key=lambda post: post.dispatch_at)
+                self._cache = (self._signature(), merged, blocks + 1, True)
+        self.refresh_next_due()
+
+    def delete_many(self, post_ids):
+        post_ids = set(post_ids)
+        if not post_ids:
+            return
+        with self._lock:
+            current = self._load()
+            remaining = [post for post in current if post.id not in post_ids]
+            if len(remaining) == len(current):
+                return
+            self._rewrite(remaining)
+        self.refresh_next_due()
+
+    def _update(self, post_id, **fields):
+        """Как JsonScheduleStore._update"""
+        updated = None
+        with self._lock:
+            current = []
+            for post in self._load():
+                if post.id == post_id:
+                    # Кэш отдаётся наружу, поэтому меняем копию
+                    post = Post(post.id, post.dispatch_at, post.message_text, post.media, post.targets, post.attempts)
+                    for name, value in fields.items():
+                        setattr(post, name, value(getattr(post, name)) if callable(value) else value)
+                    updated = post
+                current.append(post)
+            self._rewrite(current)
+        return updated
+
+    def reschedule(self, post_id, dispatch_at):
+        self._update(post_id, dispatch_at=to_epoch(dispatch_at))
+        self.refresh_next_due()
+
+    def set_targets(self, post_id, targets):
+        self._update(post_id, targets=[str(chat_id) for chat_id in targets] or None)
+
+    def record_failure(self, post_id, retry_at):
+        post = self._update(post_id, attempts=lambda attempts: attempts + 1, dispatch_at=to_epoch(retry_at))
+        self.refresh_next_due()
+        return post.attempts if post else None
+
+    def due_before(self, moment):
+        posts = self._load()
+        # Посты в кэше отсортированы по времени - граница ищется бинарным поиском
+        return posts[:bisect.bisect_right(posts, to_epoch(moment), key=lambda post: post.dispatch_at)]
+
+    def all(self):
+        return list(self._load())
+
+    def count(self):
+        return len(self._load())
+
+    def page(self, offset, limit):
+        return self._load()[offset:offset + limit]
+
+    def watch_paths(self):
+        return [self.path, self._rules_path()]
+
+
+class SQLiteScheduleStore(ScheduleStore):
+    """Бэкенд на SQLite: WAL-журнал, индекс по dispatch_at (epoch-секунды UTC).
+    Соединение открывается отдельно для каждого потока."""
+
+    # Миграции схемы: после применения N-го набора PRAGMA user_version = N
+    MIGRATIONS = (
+        (
+            """
+            CREATE TABLE IF NOT EXISTS posts (
+                id TEXT PRIMARY KEY,
+                dispatch_at INTEGER NOT NULL,
+                message_text TEXT NOT NULL,
+                media TEXT NOT NULL DEFAULT '[]'
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_posts_dispatch_at ON posts(dispatch_at)",
+        ),
+        (
+            # Порядковый номер вставки - по нему демон подхватывает новые посты
+            "ALTER TABLE posts ADD COLUMN seq INTEGER NOT NULL DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS idx_posts_seq ON posts(seq)",
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        ),
+        (
+            # JSON-список чатов поста, NULL - чаты по умолчанию
+            "ALTER TABLE posts ADD COLUMN targets TEXT",
+        ),
+        (
+            # Индекс хэшей содержимого для O(log n) поиска дубликатов
+            "ALTER TABLE posts ADD COLUMN content_hash TEXT",
+            lambda conn: conn.executemany(
+                "UPDATE posts SET content_hash = ? WHERE id = ?",
+                [
+                    (content_hash(SQLiteScheduleStore._row_to_post(row + (0,))), row[0])
+                    for row in conn.execute("SELECT id, dispatch_at, message_text, media, targets FROM posts").fetchall()
+                ],
+            ),
+            "CREATE INDEX IF NOT EXISTS idx_posts_content_hash ON posts(content_hash)",
+            # Счётчик постов поддерживается триггерами, чтобы не делать COUNT(*) по таблице
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('count', (SELECT COUNT(*) FROM posts))",
+            """
+            CREATE TRIGGER IF NOT EXISTS posts_count_insert AFTER INSERT ON posts BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'count';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS posts_count_delete AFTER DELETE ON posts BEGIN
+                UPDATE meta SET value = value - 1 WHERE key = 'count';
+            END
+            """,
+        ),
+        (
+            # Повторяющиеся правила; индекс по next_run - очередь ближайших отправок
+            """
+            CREATE TABLE IF NOT EXISTS rules (
+                id TEXT PRIMARY KEY,
+                cron TEXT NOT NULL,
+                next_run INTEGER NOT NULL,
+                message_text TEXT NOT NULL,
+                media TEXT NOT NULL DEFAULT '[]',
+                targets TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_rules_next_run ON rules(next_run)",
+        ),
+        (
+            # Счётчик неудачных попыток и мёртвые письма (пост - в формате JSON-файла)
+            "ALTER TABLE posts ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id TEXT PRIMARY KEY,
+                failed_at INTEGER NOT NULL,
+                error TEXT NOT NULL,
+                post TEXT NOT NULL
+            )
+            """,
+        ),
+    )
+
+    COLUMNS = "id, dispatch_at, message_text, media, targets, attempts"
+
+    def __init__(self, path=SCHEDULE_DB):
+        self.path = path
+        self._local = threading.local()
+        self._next_due_lock = FileLock(path + NEXT_DUE_SUFFIX + ".lock")
+        self._migrate()
+
+    def _migrate(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, statements in enumerate(self.MIGRATIONS[version:], version + 1):
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_post(row):
+        post_id, dispatch_at, message_text, media, targets, attempts = row
+        return Post(post_id, dispatch_at, message_text, json.loads(media), json.loads(targets) if targets else None,
+                    attempts)
+
+    @staticmethod
+    def _post_to_row(post):
+        return (
+            post.id,
+            post.dispatch_at,
+            post.message_text,
+            json.dumps(post.media, ensure_ascii=False),
+            json.dumps(post.targets) if post.targets else None,
+            post.attempts,
+        )
+
+    def add(self, post):
+        self.add_many([post])
+
+    @staticmethod
+    def _bump_counter(conn, key, amount=1):
+        """Увеличивает счётчик в таблице meta и возвращает новое значение"""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+            (key, amount),
+        )
+        return conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def add_many(self, posts):
+        rows = []
+        for post in posts:
+            post = normalize_post(post)
+            if post is not None:
+                rows.append((self._post_to_row(post), content_hash(post)))
+        if not rows:
+            return
+        with self._connect() as conn:
+            last_seq = self._bump_counter(conn, "seq", len(rows))
+            self._bump_counter(conn, "version")
+            first_seq = last_seq - len(rows) + 1
+            # UPSERT, а не INSERT OR REPLACE: REPLACE не вызывает триггер удаления и сбил бы счётчик
+            conn.executemany(
+                f"INSERT INTO posts ({self.COLUMNS}, content_hash, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET dispatch_at = excluded.dispatch_at, "
+                "message_text = excluded.message_text, media = excluded.media, targets = excluded.targets, "
+                "attempts = excluded.attempts, content_hash = excluded.content_hash, seq = excluded.seq",
+                [row + (post_hash, first_seq + offset) for offset, (row, post_hash) in enumerate(rows)],
+            )
+        self.refresh_next_due()
+
+    def delete_many(self, post_ids):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM posts WHERE id = ?", [(post_id,) for post_id in post_ids])
+            self._bump_counter(conn, "version")
+        self.refresh_next_due()
+
+    def reschedule(self, post_id, dispatch_at):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE posts SET dispatch_at = ? WHERE id = ?",
+                (to_epoch(dispatch_at), post_id),
+            )
+            self._bump_counter(conn, "version")
+        self.refresh_next_due()
+
+    def set_targets(self, post_id, targets):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE posts SET targets = ? WHERE id = ?",
+                (json.dumps([str(chat_id) for chat_id in targets]) if targets else None, post_id),
+            )
+            self._bump_counter(conn, "version")
+
+    def record_failure(self, post_id, retry_at):
+        with self._connect() as conn:
+            row = conn.execute(
+                "UPDATE posts SET attempts = attempts + 1, dispatch_at = ? WHERE id = ? RETURNING attempts",
+                (to_epoch(retry_at), post_id),
+            ).fetchone()
+            self._bump_counter(conn, "version")
+        self.refresh_next_due()
+        return row[0] if row else None
+
+    def add_dead_letter(self, letter):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO dead_letters (id, failed_at, error, post) VALUES (?, ?, ?, ?)",
+                (letter.post.id, letter.failed_at, letter.error, json.dumps(letter.post.to_json(), ensure_ascii=False)),
+            )
+
+    def delete_dead_letter(self, post_id):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM dead_letters WHERE id = ?", (post_id,)).rowcount > 0
+
+    def dead_letters(self):
+        rows = self._connect().execute("SELECT failed_at, error, post FROM dead_letters ORDER BY failed_at")
+        return [DeadLetter(normalize_post(json.loads(post)), failed_at, error) for failed_at, error, post in rows]
+
+    def get(self, post_id):
+        row = self._connect().execute(f"SELECT {self.COLUMNS} FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return self._row_to_post(row) if row else None
+
+    def due_before(self, moment):
+        rows = self._connect().execute(
+            f"SELECT {self.COLUMNS} FROM posts WHERE dispatch_at <= ? ORDER BY dispatch_at",
+            (to_epoch(moment),),
+        )
+        return [self._row_to_post(row) for row in rows]
+
+    def has_duplicate(self, post):
+        post = normalize_post(post)
+        row = self._connect().execute(
+            "SELECT 1 FROM posts WHERE content_hash = ? LIMIT 1", (content_hash(post),)
+        ).fetchone()
+        return row is not None
+
+    def all(self):
+        rows = self._connect().execute(
+            f"SELECT {self.COLUMNS} FROM posts ORDER BY dispatch_at"
+        )
+        return [self._row_to_post(row) for row in rows]
+
+    def existing_hashes(self, hashes):
+        hashes = list(hashes)
+        conn = self._connect()
+        found = set()
+        # Пачками, чтобы не упереться в лимит параметров запроса
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            rows = conn.execute(
+                f"SELECT content_hash FROM posts WHERE content_hash IN ({','.join('?' * len(chunk))})", chunk
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def count(self):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'count'").fetchone()
+        return row[0] if row else 0
+
+    def first_dispatch(self):
+        return self._connect().execute("SELECT MIN(dispatch_at) FROM posts").fetchone()[0]
+
+    def page(self, offset, limit):
+        rows = self._connect().execute(
+            f"SELECT {self.COLUMNS} FROM posts ORDER BY dispatch_at, id LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [self._row_to_post(row) for row in rows]
+
+    def version(self):
+        # Счётчик в meta увеличивается каждой записью, в том числе из других процессов;
+        # время изменения файла WAL для этого ненадёжно (WAL переиспользуется после checkpoint)
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def added_since(self, seq):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+        last_seq = row[0] if row else 0
+        # Без отметки отдаём всё (посты, импортированные до появления seq, имеют seq = 0)
+        rows = conn.execute(
+            f"SELECT {self.COLUMNS} FROM posts WHERE seq > ? AND seq <= ?",
+            (-1 if seq is None else seq, last_seq),
+        )
+        return [self._row_to_post(row) for row in rows], last_seq
+
+    def watch_paths(self):
+        return [self.path, self.path + "-wal"]
+
+    RULE_COLUMNS = "id, cron, next_run, message_text, media, targets"
+
+    @staticmethod
+    def _row_to_rule(row):
+        rule_id, cron, next_run, message_text, media, targets = row
+        return Rule(rule_id, cron, next_run, message_text, json.loads(media), json.loads(targets) if targets else None)
+
+    def add_rule(self, rule):
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO rules ({self.RULE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (rule.id, rule.cron, rule.next_run, rule.message_text, json.dumps(rule.media, ensure_ascii=False),
+                 json.dumps(rule.targets) if rule.targets else None),
+            )
+        self.refresh_next_due()
+
+    def delete_rule(self, rule_id):
+        with self._connect() as conn:
+            found = conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,)).rowcount > 0
+        if found:
+            self.refresh_next_due()
+        return found
+
+    def rules(self):
+        rows = self._connect().execute(f"SELECT {self.RULE_COLUMNS} FROM rules ORDER BY next_run")
+        return [self._row_to_rule(row) for row in rows]
+
+    def due_rules(self, moment):
+        rows = self._connect().execute(
+            f"SELECT {self.RULE_COLUMNS} FROM rules WHERE next_run <= ? ORDER BY next_run", (to_epoch(moment),)
+        )
+        return [self._row_to_rule(row) for row in rows]
+
+    def next_rule_run(self):
+        return self._connect().execute("SELECT MIN(next_run) FROM rules").fetchone()[0]
+
+    def advance_rule(self, rule_id, next_run):
+        with self._connect() as conn:
+            if next_run is None:
+                conn.execute("DELETE FROM rules WHERE id = ?", (rule_id,))
+            else:
+                conn.execute("UPDATE rules SET next_run = ? WHERE id = ?", (next_run, rule_id))
+        self.refresh_next_due()
+
+
+def import_json_schedule(store, path=SCHEDULE_FILE):
+    """Одноразовый импорт schedule.json (в том числе старого формата с одним постом).
+    После импорта файл переименовывается в *.imported. Возвращает число постов."""
+    if not os.path.exists(path):
+        return 0
+    from archive import archive_legacy_sent, get_archive
+
+    # Отправленные записи старого формата уходят в архив, а не пропускаются при каждом чтении
+    archive_legacy_sent(path, get_archive())
+    posts = load_json_schedule(path)
+    store.add_many(posts)
+    if os.path.exists(path):
+        os.replace(path, path + ".imported")
+    print(f"Импортировано постов из {os.path.basename(path)}: {len(posts)}")
+    return len(posts)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Возвращает хранилище расписания, выбранное через SCHEDULE_BACKEND"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.getenv("SCHEDULE_BACKEND", "sqlite").lower()
+            if backend == "json":
+                from archive import archive_legacy_sent, get_archive
+
+                _store = JsonScheduleStore(os.getenv("SCHEDULE_FILE", SCHEDULE_FILE))
+                # Одноразовый перенос: после него отметка, и файл при запуске не разбирается
+                archive_legacy_sent(_store.path, get_archive(), _store.path + LEGACY_SENT_MARKER_SUFFIX)
+            elif backend == "binary":
+                _store = BinaryScheduleStore(os.getenv("SCHEDULE_BIN", SCHEDULE_BIN))
+                import_json_schedule(_store, os.getenv("SCHEDULE_FILE", SCHEDULE_FILE))
+            elif backend == "sqlite":
+                _store = SQLiteScheduleStore(os.getenv("SCHEDULE_DB", SCHEDULE_DB))
+                import_json_schedule(_store, os.getenv("SCHEDULE_FILE", SCHEDULE_FILE))
+            else:
+                raise ValueError(f"Неизвестный SCHEDULE_BACKEND: {backend}")
+        return _store
+
+
+def export_json_schedule(store, path):
+    """Выгружает всё расписание в JSON-файл. Возвращает число постов."""
+    posts = store.all()
+    dump_json_schedule(posts, path)
+    return len(posts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт и экспорт расписания в JSON")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="JSON-файл")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Выгружено постов: {export_json_schedule(get_store(), args.path)}")
+    else:
+        posts = load_json_schedule(args.path)
+        get_store().add_many(posts)
+        print(f"Загружено постов: {len(posts)}")
@@ -1,228 +1,372 @@
-import json
+"""Рассылка запланированных постов: одним проходом из cron или постоянным демоном (--daemon)
+
+Из cron скрипт запускается каждую минуту, а посты обычно наступают гораздо реже.
+Поэтому до импорта telebot и хранилища проверяется файл-подсказка с ближайшим
+временем отправки (next_due.py): если отправлять нечего, проход завершается за
+время запуска интерпретатора. Без подсказки (первый запуск, другой бэкенд) -
+обычный полный проход, который её и создаёт.
+"""
+import argparse
+import heapq
+import math
 import os
-import uuid
-from datetime import datetime, timezone
+import signal
+import sys
+import threading
+import time
+from functools import partial
 
-import telebot
 from dotenv import load_dotenv
-import time
 
-UTC_TZ = timezone.utc  # UTC
+from next_due import nothing_due
 
 load_dotenv()
 
+if __name__ == "__main__" and "--daemon" not in sys.argv[1:] and nothing_due(time.time()):
+    sys.exit(0)
+
+import telebot  # noqa: E402
+from telebot import apihelper  # noqa: E402
+
+from archive import get_archive  # noqa: E402
+from fanout import FANOUT_WORKERS, FanOut  # noqa: E402
+from file_cache import from_cache, get_file_cache, is_upload, upload_file, upload_group  # noqa: E402
+from media_plan import SEND_METHODS, attach_name, media_group, plan_media, step_items  # noqa: E402
+from metrics import DEAD_LETTERS, DISPATCH_LAG, SCHEDULE_POSTS, STORE_SECONDS, instrument_api, start_metrics  # noqa: E402
+from outbox import OUTBOX_FILE as DEFAULT_OUTBOX_FILE, DeliveryLog, delivery_key, parse_delivery_key  # noqa: E402
+from rate_limit import RateLimiter, RetryAfter  # noqa: E402
+from recurrence import parse_rule  # noqa: E402
+from retry_policy import MAX_ATTEMPTS, describe_errors, is_permanent, retry_delay  # noqa: E402
+from schedule_store import Post, get_store  # noqa: E402
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-TARGET_CHAT_ID = os.getenv("TARGET_CHAT_ID")
-SCHEDULE_FILE = os.path.join(os.path.dirname(__file__), "schedule.json")
+# Адрес Bot API (например, локальный bench/fake_api.py), по умолчанию - настоящий
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+TARGET_CHAT_ID = os.getenv("TARGET_CHAT_ID")  # один чат или несколько через запятую
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", DEFAULT_OUTBOX_FILE)
+# Как часто демон проверяет файлы расписания на изменения (секунды)
+DAEMON_POLL_INTERVAL = float(os.getenv("DAEMON_POLL_INTERVAL", "1"))
+DAEMON_ERROR_DELAY_MAX = 60  # предел паузы демона после ошибки (секунды), пауза растёт вдвое
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения!")
 if not TARGET_CHAT_ID:
     raise ValueError("TARGET_CHAT_ID не найден в переменных окружения!")
+TARGET_CHAT_IDS = [chat_id.strip() for chat_id in TARGET_CHAT_ID.split(",") if chat_id.strip()]
+BOT_ID = BOT_TOKEN.split(":")[0]  # file_id в кэше файлов действуют только для этого бота
+
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL
 
 bot = telebot.TeleBot(BOT_TOKEN)
+limiter = RateLimiter()
+fanout = FanOut(int(os.getenv("FANOUT_WORKERS", FANOUT_WORKERS)))
+
+
+def post_plan(post):
+    """План отправки поста (см. media_plan): какие запросы к API и в каком порядке.
+    Файлы с диска, уже загруженные раньше, подставляются из кэша по file_id."""
+    media = post.media
+    if any(map(is_upload, media)):
+        media = get_file_cache(BOT_ID).resolve(media)
+    return plan_media(media, post.message_text)
+
+
+def needs_upload(plan):
+    """Есть ли в плане файлы с диска, которых ещё нет в кэше"""
+    return any(is_upload(item) for step in plan for item in step_items(step))
+
+
+def _send_media(chat_id, step):
+    items = step_items(step)
+    if step[0] == "single":
+        _, item, caption = step
+        if is_upload(item):
+            # upload_file/upload_group заново проверяют путь по MEDIA_ROOT: файл могли подменить после импорта
+            get_file_cache(BOT_ID).remember(item, upload_file(BOT_TOKEN, chat_id, item, caption))
+        else:
+            getattr(bot, SEND_METHODS[item["type"]])(chat_id, item["file_id"], caption=caption)
+    elif any(map(is_upload, items)):
+        files = {attach_name(index): item["path"] for index, item in enumerate(items) if is_upload(item)}
+        messages = upload_group(BOT_TOKEN, chat_id, step[1], files)
+        cache = get_file_cache(BOT_ID)
+        for item, message in zip(items, messages):
+            if is_upload(item):
+                cache.remember(item, message)
+    else:
+        bot.send_media_group(chat_id, step[1])
 
 
-def _read_schedule():
-    """Читает список запланированных постов из файла"""
-    if not os.path.exists(SCHEDULE_FILE):
-        return []
-    
+def send_media(chat_id, step):
+    """Шаг плана с вложениями. Если Telegram отверг file_id из кэша файлов,
+    он забывается и файлы шага загружаются заново"""
     try:
-        with open(SCHEDULE_FILE, "r", encoding="utf-8") as file:
-            data = json.load(file)
-    except (json.JSONDecodeError, IOError) as e:
-        # Если файл поврежден, удаляем его и возвращаем пустой список
-        print(f"Ошибка чтения файла расписания: {e}")
-        if os.path.exists(SCHEDULE_FILE):
-            os.remove(SCHEDULE_FILE)
-        return []
-    
-    # Поддержка старого формата (один пост)
-    if isinstance(data, dict) and "dispatch_at" in data:
-        # Пропускаем уже отправленные посты старого формата
-        if data.get("sent", False):
-            return []
-        try:
-            dispatch_at = datetime.fromisoformat(data["dispatch_at"])
-        except (ValueError, TypeError):
-            return []
-        # Если время без timezone, считаем его UTC
-        if dispatch_at.tzinfo is None:
-            dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-        post = {
-            "id": data.get("id", str(uuid.uuid4())),
-            "dispatch_at": dispatch_at,
-            "message_text": data.get("message_text", "Привет"),
-            "media": data.get("media", []),  # Вот это добавлено
-        }
-        return [post]
-    
-    # Новый формат (список постов)
-    if isinstance(data, list):
-        posts = []
-        for post_data in data:
-            # Пропускаем некорректные записи
-            if not isinstance(post_data, dict):
-                continue
-                
-            # Пропускаем уже отправленные посты
-            if post_data.get("sent", False):
-                continue
-            
-            # Создаем новый словарь для поста
-            dispatch_at_str = post_data.get("dispatch_at")
-            if not dispatch_at_str:
-                continue
-                
-            try:
-                if isinstance(dispatch_at_str, str):
-                    dispatch_at = datetime.fromisoformat(dispatch_at_str)
-                elif isinstance(dispatch_at_str, datetime):
-                    dispatch_at = dispatch_at_str
-                else:
-                    continue
-            except (ValueError, TypeError):
-                continue
-            
-            # Если время без timezone, считаем его UTC
-            if dispatch_at.tzinfo is None:
-                dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-            
-            # Создаем новый пост с правильным форматом
-            post = {
-                "id": post_data.get("id", str(uuid.uuid4())),
-                "dispatch_at": dispatch_at,
-                "message_text": post_data.get("message_text", "Привет"),
-                "media": post_data.get("media", []),
-            }
-            posts.append(post)
-        return posts
-    
-    return []
-
-
-def _write_schedule(posts):
-    """Записывает список запланированных постов в файл"""
-    # Убеждаемся, что posts - это список
-    if not isinstance(posts, list):
-        posts = []
-    
-    if not posts:
-        # Если постов нет, не создаём файл или удаляем существующий
-        if os.path.exists(SCHEDULE_FILE):
-            os.remove(SCHEDULE_FILE)
-        return
-    
-    # Создаем payload с правильной структурой
-    payload = []
-    for post in posts:
-        # Извлекаем dispatch_at
-        dispatch_at = post.get("dispatch_at")
-        if isinstance(dispatch_at, datetime):
-            dispatch_at_str = dispatch_at.isoformat()
-        elif isinstance(dispatch_at, str):
-            dispatch_at_str = dispatch_at
+        _send_media(chat_id, step)
+    except apihelper.ApiTelegramException as e:
+        cached = [item for item in step_items(step) if from_cache(item)]
+        if e.error_code != 400 or not cached:
+            raise
+        print(f"Telegram отверг file_id из кэша ({e.description}), загружаем файлы заново")
+        cache = get_file_cache(BOT_ID)
+        for item in cached:
+            cache.forget_item(item)
+        items = [{key: value for key, value in item.items() if key != "file_id"} if from_cache(item) else item
+                 for item in step_items(step)]
+        if step[0] == "single":
+            _send_media(chat_id, ("single", items[0], step[2]))
         else:
-            continue  # Пропускаем посты с некорректным форматом
-        
-        # Создаем запись для сохранения
-        payload_item = {
-            "id": post.get("id", str(uuid.uuid4())),
-            "dispatch_at": dispatch_at_str,
-            "message_text": post.get("message_text", "Привет"),
-            "media": post.get("media", []),
-        }
-        payload.append(payload_item)
-    
-    # Записываем в файл (создаем временный файл для атомарности записи)
-    temp_file = SCHEDULE_FILE + ".tmp"
-    with open(temp_file, "w", encoding="utf-8") as file:
-        json.dump(payload, file, ensure_ascii=False, indent=2)
-    
-    # Атомарно заменяем старый файл новым
-    if os.path.exists(temp_file):
-        if os.path.exists(SCHEDULE_FILE):
-            os.replace(temp_file, SCHEDULE_FILE)
+            _send_media(chat_id, ("group", media_group(items, step[1][0].caption), items))
+
+
+def send_post(post, chat_id, plan=None):
+    """Отправляет один пост в чат chat_id. plan можно передать готовым,
+    чтобы не строить его заново для каждого чата рассылки."""
+    if plan is None:
+        plan = post_plan(post)
+    # Шаги идут строго по порядку: подпись на первой группе должна прийти первой
+    for step in plan:
+        if step[0] == "message":
+            limiter.call(chat_id, bot.send_message, chat_id, step[1])
         else:
-            os.rename(temp_file, SCHEDULE_FILE)
+            limiter.call(chat_id, send_media, chat_id, step, cost=len(step_items(step)))
 
 
-def main():
-    posts = _read_schedule()
-    if not posts:
+def post_targets(post):
+    """Чаты, в которые нужно отправить пост"""
+    return post.targets or TARGET_CHAT_IDS
+
+
+def _recover(store, outbox):
+    """Восстановление после падения: доставки из журнала убираем из расписания"""
+    delivered = outbox.delivered()
+    if not delivered:
         return
+    print(f"Восстановление после сбоя: {len(delivered)} доставок уже выполнены")
+    delivered_chats = {}
+    for key in delivered:
+        post_id, chat_id = parse_delivery_key(key)
+        delivered_chats.setdefault(post_id, {})[chat_id] = None
+    posts = []
+    for post_id, chats in delivered_chats.items():
+        post = store.get(post_id)
+        if post is not None:
+            posts.append((post, [chat_id for chat_id in post_targets(post) if chat_id not in chats]))
+    # В архив - чаты, куда пост дошёл; записи одного поста архив объединяет, поэтому
+    # запись, сделанная ещё до падения, повтором не искажается
+    get_archive().append([delivered_part(post, list(delivered_chats[post.id])) for post, _ in posts])
+    for post, remaining in posts:
+        if remaining:
+            store.set_targets(post.id, remaining)
+    store.delete_many([post.id for post, remaining in posts if not remaining])
+    outbox.clear()
 
-    now = datetime.now(UTC_TZ)  # Используем UTC время
-    posts_to_keep = []
-    updated = False
-
-    for post in posts:
-        dispatch_at = post["dispatch_at"]
-        # Убеждаемся, что время в UTC
-        if isinstance(dispatch_at, str):
-            dispatch_at = datetime.fromisoformat(dispatch_at)
-        if dispatch_at.tzinfo is None:
-            dispatch_at = dispatch_at.replace(tzinfo=UTC_TZ)
-        post["dispatch_at"] = dispatch_at
-
-        # Проверяем, наступило ли время отправки
-        if now >= dispatch_at:
+
+def delivered_part(post, chat_ids):
+    """Пост с чатами, куда он уже доставлен, - запись архива при частичной доставке"""
+    return Post(post.id, post.dispatch_at, post.message_text, post.media, chat_ids, post.attempts)
+
+
+def materialize_rules(store, now):
+    """Наступившие повторяющиеся правила превращаются в обычные посты расписания
+    (по одному на правило) и сдвигаются на следующее совпадение после now.
+    Пропущенные за время простоя повторы не навёрстываются - уходит один."""
+    due = store.due_rules(now)
+    if not due:
+        return
+    # Сначала посты, потом сдвиг правил: при падении между ними пост с тем же id просто заменится
+    store.add_many([rule.occurrence() for rule in due])
+    for rule in due:
+        cron = parse_rule(rule.cron)
+        store.advance_rule(rule.id, cron.next_after(max(now, rule.next_run)) if cron else None)
+
+
+def dispatch_due(store, now, outbox):
+    """Отправляет все посты, время которых наступило к моменту now (epoch-секунды).
+    Возвращает (timestamp, id) постов, которые нужно повторить позже."""
+    _recover(store, outbox)
+    materialize_rules(store, now)
+
+    retries = []
+    sent = []
+    recorded = False
+    # Берём из индекса только посты, время которых уже наступило
+    with STORE_SECONDS.time(operation="read"):
+        due = store.due_before(now)
+    for post in due:
+        targets = post_targets(post)
+        try:
+            plan = post_plan(post)
+        except Exception as e:
+            # Некорректная запись или сбой кэша файлов: иначе пост срывал бы весь проход на каждом запуске
+            store.bury(Post(post.id, post.dispatch_at, post.message_text, post.media, post.targets, post.attempts + 1),
+                       f"план отправки: {e!r}", time.time())
+            DEAD_LETTERS.inc(reason="invalid")
+            print(f"Пост {post.id} перенесён в мёртвые письма: не удалось построить план отправки ({e!r})")
+            continue
+
+        def deliver(chat_id, post=post, plan=plan):
+            send_post(post, chat_id, plan)
+            DISPATCH_LAG.observe(time.time() - post.dispatch_at)
+            # Фиксируем доставку в чат сразу, не дожидаясь остальных чатов
+            outbox.record(delivery_key(post, chat_id))
+
+        results = {}
+        if len(targets) > 1 and needs_upload(plan):
+            # Файлы с диска загружает первый чат, остальные получают их по file_id из кэша
+            results = fanout.deliver(targets[:1], deliver)
             try:
-                media = post.get("media", [])
-                text = post.get("message_text", "Привет")
-                if media:
-                    # group of photos or videos
-                    media_group = []
-                    has_text = False
-                    for idx, m in enumerate(media):
-                        if m["type"] == "photo":
-                            input_media = telebot.types.InputMediaPhoto(m["file_id"], caption=text if not has_text else None)
-                            has_text = True
-                        elif m["type"] == "video":
-                            input_media = telebot.types.InputMediaVideo(m["file_id"], caption=text if not has_text else None)
-                            has_text = True
-                        elif m["type"] == "document":
-                            input_media = telebot.types.InputMediaDocument(m["file_id"], caption=text if not has_text else None)
-                            has_text = True
-                        elif m["type"] == "audio":
-                            input_media = telebot.types.InputMediaAudio(m["file_id"], caption=text if not has_text else None)
-                            has_text = True
-                        else:
-                            continue
-                        media_group.append(input_media)
-                    if len(media_group) > 1:
-                        bot.send_media_group(TARGET_CHAT_ID, media_group)
-                    elif len(media_group) == 1:
-                        if media[0]["type"] == "photo":
-                            bot.send_photo(TARGET_CHAT_ID, media[0]["file_id"], caption=text)
-                        elif media[0]["type"] == "document":
-                            bot.send_document(TARGET_CHAT_ID, media[0]["file_id"], caption=text)
-                        elif media[0]["type"] == "video":
-                            bot.send_video(TARGET_CHAT_ID, media[0]["file_id"], caption=text)
-                        elif media[0]["type"] == "audio":
-                            bot.send_audio(TARGET_CHAT_ID, media[0]["file_id"], caption=text)
-                        else:
-                            bot.send_message(TARGET_CHAT_ID, text)
-                    else:
-                        bot.send_message(TARGET_CHAT_ID, text)
-                    time.sleep(1) # чтобы Telegram не ругался на флуд
-                else:
-                    bot.send_message(TARGET_CHAT_ID, text)
-                updated = True
+                plan = post_plan(post)
             except Exception as e:
-                print(f"Ошибка при отправке поста {post.get('id')}: {e}")
-                posts_to_keep.append(post)
+                print(f"Пост {post.id}: не удалось взять file_id из кэша ({e!r}), остальные чаты загрузят файлы сами")
+        results.update(fanout.deliver(targets[len(results):], partial(deliver, plan=plan)))
+        failed = {chat_id: error for chat_id, error in results.items() if error is not None}
+        recorded = recorded or len(failed) < len(targets)
+        if not failed:
+            sent.append(post)
+            continue
+
+        print(f"Пост {post.id}: доставлено в {len(targets) - len(failed)} из {len(targets)} чатов")
+        for chat_id, error in failed.items():
+            print(f"  {chat_id}: {error}")
+        # Повторять будем только недоставленные чаты; доставленные сразу уходят в архив,
+        # иначе запись архива после повтора назвала бы только последние чаты
+        if len(failed) < len(targets):
+            get_archive().append([delivered_part(post, [chat_id for chat_id in targets if chat_id not in failed])])
+        # Чаты с постоянной ошибкой (бота убрали из канала) сразу в мёртвые письма,
+        # иначе они повторялись бы вместе с временными до MAX_ATTEMPTS
+        permanent = {chat_id: error for chat_id, error in failed.items() if is_permanent(error)}
+        if permanent and len(permanent) < len(failed):
+            part = Post(post.id, post.dispatch_at, post.message_text, post.media, list(permanent), post.attempts + 1)
+            store.bury_targets(part, describe_errors(permanent), time.time())
+            DEAD_LETTERS.inc(reason="permanent")
+            print(f"Пост {post.id}: чаты {', '.join(permanent)} перенесены в мёртвые письма (/dead_letters)")
+            failed = {chat_id: error for chat_id, error in failed.items() if chat_id not in permanent}
+        if len(failed) < len(targets):
+            store.set_targets(post.id, list(failed))
+        retry_after = [error.retry_after for error in failed.values() if isinstance(error, RetryAfter)]
+        attempts = post.attempts + 1
+        if len(retry_after) == len(failed):
+            # Flood control: переносим пост ровно на время, которое назвал Telegram
+            retry_at = math.ceil(time.time() + max(retry_after))
+            store.reschedule(post.id, retry_at)
+            retries.append((retry_at, post.id))
+        elif all(map(is_permanent, failed.values())) or attempts >= MAX_ATTEMPTS:
+            # Повтор не поможет или попытки кончились: пост больше не занимает рассылку
+            dead_targets = list(failed) if len(failed) < len(targets) else post.targets
+            dead = Post(post.id, post.dispatch_at, post.message_text, post.media, dead_targets, attempts)
+            store.bury(dead, describe_errors(failed), time.time())
+            DEAD_LETTERS.inc(reason="permanent" if attempts < MAX_ATTEMPTS else "attempts")
+            print(f"Пост {post.id} перенесён в мёртвые письма после попыток: {attempts} (/dead_letters)")
         else:
-            # Пост ещё не готов к отправке - сохраняем его
-            posts_to_keep.append(post)
+            # Временная ошибка: повтор с экспоненциально растущей задержкой
+            retry_at = math.ceil(time.time() + retry_delay(attempts))
+            store.record_failure(post.id, retry_at)
+            retries.append((retry_at, post.id))
+
+    # Доставленные посты переносятся в архив, затем одна запись в расписание на всю пачку;
+    # после неё журнал больше не нужен
+    if sent:
+        get_archive().append(sent)
+        with STORE_SECONDS.time(operation="write"):
+            store.delete_many([post.id for post in sent])
+    if recorded:
+        outbox.clear()
+        print(limiter.report())
+        SCHEDULE_POSTS.set(store.count())
+    return retries
 
-    # Сохраняем только неотправленные посты (удаляем отправленные)
-    # Обновляем файл если что-то изменилось или если список постов изменился
-    if updated or len(posts) != len(posts_to_keep):
-        _write_schedule(posts_to_keep)
+
+def main():
+    store = get_store()
+    outbox = DeliveryLog(OUTBOX_FILE)
+    dispatch_due(store, time.time(), outbox)
+    # Подсказка для следующих запусков из cron, даже если расписание не менялось
+    store.refresh_next_due()
+
+
+def _watch_signature(store):
+    """Отпечаток файлов расписания (mtime и размер) для отслеживания изменений"""
+    signature = []
+    for path in store.watch_paths():
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+
+def run_daemon(stop_event=None):
+    """Постоянный режим: ждёт ближайший пост по min-куче вместо перезапусков из cron.
+    Новые посты подхватываются по изменению файлов расписания."""
+    store = get_store()
+    outbox = DeliveryLog(OUTBOX_FILE)
+    stop_event = stop_event or threading.Event()
+
+    heap = []  # (dispatch_at timestamp, post id)
+    seq = None
+    signature = None
+    rule_at = None  # ближайший next_run повторяющихся правил (из индекса хранилища)
+    errors = 0
+    print("Демон рассылки запущен")
+    while not stop_event.is_set():
+        try:
+            current_signature = _watch_signature(store)
+            if current_signature != signature:
+                signature = current_signature
+                posts, new_seq = store.added_since(seq)
+                if new_seq is None or seq is None:
+                    # Бэкенд отдал расписание целиком - собираем кучу заново
+                    heap = []
+                for post in posts:
+                    heap.append((post.dispatch_at, post.id))
+                heapq.heapify(heap)
+                seq = new_seq
+                rule_at = store.next_rule_run()
+
+            now = time.time()
+            if (heap and heap[0][0] <= now) or (rule_at is not None and rule_at <= now):
+                # Лишние записи кучи (удалённые или уже отправленные посты) просто выбрасываются
+                while heap and heap[0][0] <= now:
+                    heapq.heappop(heap)
+                for retry in dispatch_due(store, now, outbox):
+                    heapq.heappush(heap, retry)
+                rule_at = store.next_rule_run()
+                continue
+
+            # Спим до ближайшего поста или правила, но не дольше интервала проверки файлов
+            timeout = DAEMON_POLL_INTERVAL
+            if heap:
+                timeout = min(timeout, heap[0][0] - now)
+            if rule_at is not None:
+                timeout = min(timeout, rule_at - now)
+            stop_event.wait(max(timeout, 0))
+        except Exception as e:
+            # Занятая база, сбой файла или сети не должны останавливать демон насовсем
+            errors += 1
+            delay = min(DAEMON_POLL_INTERVAL * 2 ** errors, DAEMON_ERROR_DELAY_MAX)
+            print(f"Ошибка демона рассылки: {e!r}. Повтор через {delay:g} с")
+            signature = None  # после ошибки перечитываем расписание целиком
+            seq = None
+            stop_event.wait(delay)
+            continue
+        errors = 0
+    print("Демон рассылки остановлен")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Отправка запланированных постов")
+    parser.add_argument("--daemon", action="store_true", help="работать постоянно, а не одним проходом из cron")
+    args = parser.parse_args()
 
+    start_metrics()
+    instrument_api()
+    if args.daemon:
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            run_daemon(stop)
+        except KeyboardInterrupt:
+            pass
+    else:
+        main()
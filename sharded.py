@@ -0,0 +1,238 @@
+"""Многопроцессный режим main.py: один получатель апдейтов и N рабочих процессов
+
+    python main.py --shards 4
+
+Родительский процесс забирает апдейты long polling'ом (getUpdates) и раздаёт их
+рабочим процессам через ограниченные очереди. Процесс выбирается согласованным
+хэшированием (HashRing) по id пользователя, поэтому все апдейты одного
+пользователя - шаги /schedule, файлы альбома, нажатия кнопок - попадают в один
+процесс и обрабатываются строго по порядку. Заявки на вступление распределяются
+по id чата: очередь одобрений одного канала живёт в одном процессе и соблюдает
+его лимит. Рабочий процесс - отдельный интерпретатор со своим GIL: он импортирует
+main.py и вызывает обработчики по одному апдейту, без пула потоков TeleBot.
+
+Общей памяти процессам не нужно: шаги диалогов лежат в state_store, расписание -
+в schedule_store. Метрики у каждого процесса свои: получатель выводит их на
+METRICS_PORT и в METRICS_FILE, рабочий процесс номер i - на METRICS_PORT + 1 + i
+и в METRICS_FILE.shard<i> (там время обработчиков и запросов к API).
+
+Остановка (SIGTERM или Ctrl+C): получатель дожидается текущего getUpdates, отдаёт
+рабочим уже полученные апдейты и сигнал завершения, ждёт, пока они доработают
+свои очереди, и подтверждает offset, чтобы Telegram не прислал их повторно.
+Упавший рабочий процесс перезапускается.
+"""
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+from telebot import apihelper
+
+from bot_api import call
+
+SHARD_REPLICAS = 64  # точек процесса на кольце: чем больше, тем ровнее распределение
+SHARD_QUEUE_SIZE = 1000  # апдейтов в очереди процесса; полная очередь приостанавливает getUpdates
+POLL_TIMEOUT = 10  # секунд long polling - столько же может ждать остановка
+STOP_TIMEOUT = 30  # секунд на то, чтобы рабочие доработали очереди
+STOP_PUT_TIMEOUT = 5  # секунд ждать места в очереди для сигнала завершения
+ERROR_DELAY_MAX = 60
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Кольцо согласованного хэширования: при изменении числа процессов
+    к другому процессу переезжает лишь ~1/N ключей"""
+
+    def __init__(self, shards, replicas=SHARD_REPLICAS):
+        points = sorted((_hash(f"{shard}:{replica}"), shard) for shard in range(shards) for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        """Номер процесса для ключа: первая точка кольца по часовой стрелке"""
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+
+def update_key(update):
+    """Ключ распределения апдейта (dict из getUpdates): пользователь,
+    для заявок на вступление - чат; без того и другого - сам апдейт"""
+    for kind, payload in update.items():
+        if not isinstance(payload, dict):
+            continue
+        if kind == "chat_join_request":
+            return f"chat:{payload['chat']['id']}"
+        sender = payload.get("from") or {}
+        if "id" in sender:
+            return f"user:{sender['id']}"
+        chat = payload.get("chat") or {}
+        if "id" in chat:
+            return f"chat:{chat['id']}"
+    return f"update:{update.get('update_id')}"
+
+
+def _worker(index, updates):
+    """Рабочий процесс: апдейты своей очереди по одному, до None от получателя"""
+    # Останавливает получатель: сначала раздаёт полученное, потом присылает None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    from telebot import types
+
+    # При запуске 'python main.py --shards N' spawn уже выполнил main.py в этом процессе
+    # под именем __mp_main__ - берём его, а не создаём второй бот повторным импортом
+    spawned_main = sys.modules.get("__mp_main__")
+    if os.path.basename(getattr(spawned_main, "__file__", None) or "") == "main.py":
+        sys.modules.setdefault("main", spawned_main)
+    import main
+    from metrics import instrument_api, start_metrics
+
+    # Свой порт и файл метрик: получатель занимает METRICS_PORT и METRICS_FILE
+    port = os.getenv("METRICS_PORT")
+    if port:
+        os.environ["METRICS_PORT"] = str(int(port) + 1 + index)
+    path = os.getenv("METRICS_FILE")
+    if path:
+        os.environ["METRICS_FILE"] = f"{path}.shard{index}"
+    start_metrics()
+    instrument_api()
+    # Порядок апдейтов одного пользователя сохраняется, только если обработчики не уходят в пул
+    main.bot.threaded = False
+    parent = os.getppid()
+    while True:
+        try:
+            update = updates.get(timeout=1)
+        except queue.Empty:
+            if os.getppid() != parent:
+                return  # получатель погиб, новых апдейтов не будет
+            continue
+        if update is None:
+            break
+        try:
+            main.bot.process_new_updates([types.Update.de_json(update)])
+        except Exception as e:
+            print(f"Процесс {index}: ошибка обработки апдейта {update.get('update_id')}: {e}")
+    # Принятые заявки на вступление одобряются до выхода
+    deadline = time.monotonic() + STOP_TIMEOUT
+    while time.monotonic() < deadline:
+        stats = main.join_queue.stats()
+        if not stats["backlog"] and not stats["in_flight"]:
+            break
+        time.sleep(0.1)
+
+
+class ShardedPolling:
+    """Получатель апдейтов и пул рабочих процессов"""
+
+    def __init__(self, token, shards, allowed_updates=None, queue_size=SHARD_QUEUE_SIZE,
+                 poll_timeout=POLL_TIMEOUT):
+        self.token = token
+        self.shards = shards
+        self.allowed_updates = allowed_updates
+        self.poll_timeout = poll_timeout
+        self.ring = HashRing(shards)
+        # spawn, а не fork: у родителя уже есть потоки и соединения, которые нельзя копировать
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.processes = [None] * shards
+        self.dispatched = [0] * shards
+        self.restarts = 0
+        self._stop = threading.Event()
+
+    def _start_worker(self, index):
+        process = self._context.Process(target=_worker, args=(index, self.queues[index]),
+                                        name=f"shard-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def _ensure_worker(self, index):
+        process = self.processes[index]
+        if not process.is_alive():
+            print(f"Процесс {index} завершился с кодом {process.exitcode}, перезапускаем")
+            self.restarts += 1
+            self._start_worker(index)
+
+    def dispatch(self, update):
+        """Кладёт апдейт в очередь его процесса; ждёт, если очередь полна"""
+        index = self.ring.shard_for(update_key(update))
+        while True:
+            try:
+                self.queues[index].put(update, timeout=1)
+                break
+            except queue.Full:
+                self._ensure_worker(index)
+        self.dispatched[index] += 1
+
+    def stop(self):
+        """Просит остановиться после текущего getUpdates (можно вызывать из обработчика сигнала)"""
+        self._stop.set()
+
+    def run(self):
+        """Цикл получения апдейтов до stop(); затем корректное завершение рабочих"""
+        for index in range(self.shards):
+            self._start_worker(index)
+        print(f"Рабочих процессов: {self.shards}")
+        offset = None
+        errors = 0
+        try:
+            while not self._stop.is_set():
+                try:
+                    updates = apihelper.get_updates(self.token, offset, allowed_updates=self.allowed_updates,
+                                                    long_polling_timeout=self.poll_timeout)
+                except Exception as e:
+                    # Как infinity_polling: сетевые ошибки не останавливают бота
+                    errors += 1
+                    delay = min(2 ** errors, ERROR_DELAY_MAX)
+                    print(f"Ошибка getUpdates: {e}. Повтор через {delay} с")
+                    self._stop.wait(delay)
+                    continue
+                errors = 0
+                for update in updates:
+                    self.dispatch(update)
+                    offset = update["update_id"] + 1
+                for index in range(self.shards):
+                    self._ensure_worker(index)
+        finally:
+            self._shutdown(offset)
+
+    def _shutdown(self, offset):
+        for process, updates in zip(self.processes, self.queues):
+            if process is None or not process.is_alive():
+                continue  # очередь погибшего процесса может быть полна - put завис бы
+            try:
+                updates.put(None, timeout=STOP_PUT_TIMEOUT)
+            except queue.Full:
+                print(f"Процесс {process.name} не освободил очередь за {STOP_PUT_TIMEOUT} с, останавливаем")
+                process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                print(f"Процесс {process.name} не завершился за {STOP_TIMEOUT} с, останавливаем")
+                process.terminate()
+                process.join(1)
+        if offset is not None:
+            # Подтверждаем розданные апдейты, иначе после перезапуска Telegram пришлёт их снова.
+            # Без long polling: get_updates подставил бы вместо 0 таймаут по умолчанию
+            try:
+                call(self.token, "getUpdates", {"offset": offset, "limit": 1})
+            except Exception as e:
+                print(f"Не удалось подтвердить offset {offset}: {e}")
+        print(f"Рабочие процессы остановлены, апдейтов по процессам: {self.dispatched}")
+
+
+def run_sharded(token, shards, allowed_updates=None):
+    """Запуск из main.py: SIGTERM и Ctrl+C - корректная остановка"""
+    polling = ShardedPolling(token, shards, allowed_updates)
+    signal.signal(signal.SIGTERM, lambda *_: polling.stop())
+    signal.signal(signal.SIGINT, lambda *_: polling.stop())
+    polling.run()
@@ -0,0 +1,201 @@
+"""Хранилище состояния диалога /schedule (какой шаг, введённые время, текст и файлы)
+
+Бэкенд выбирается переменной окружения STATE_BACKEND:
+  sqlite (по умолчанию) - файл state.db, переживает перезапуск и общий для нескольких процессов бота
+  memory                - словарь в памяти процесса
+У записей есть TTL (брошенный диалог удаляется) и жёсткий предел количества
+(при переполнении вытесняются самые давние). Блокировки - по полосам
+(lock striping): пользователи с разными id почти никогда не ждут друг друга.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from schedule_store import BASE_DIR
+
+STATE_DB = os.path.join(BASE_DIR, "state.db")
+STATE_TTL = 60 * 60  # секунд с последнего шага
+STATE_MAX_ENTRIES = 10_000
+LOCK_STRIPES = 64
+
+
+class StripedLock:
+    """Набор блокировок, ключ попадает в одну из полос по хэшу"""
+
+    def __init__(self, stripes=LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+class StateStore:
+    """Интерфейс хранилища. Состояние - JSON-совместимый dict."""
+
+    def __init__(self, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = StripedLock()
+
+    def get(self, user_id):
+        """Состояние пользователя (None, если его нет или оно истекло)"""
+        raise NotImplementedError
+
+    def update(self, user_id, func):
+        """Атомарно заменяет состояние на func(текущее). func возвращает (новое состояние, результат);
+        новое состояние None удаляет запись. Возвращает результат."""
+        raise NotImplementedError
+
+    def set(self, user_id, data):
+        self.update(user_id, lambda _: (data, None))
+
+    def pop(self, user_id):
+        return self.update(user_id, lambda data: (None, data))
+
+
+class MemoryStateStore(StateStore):
+    """Состояние в памяти процесса (теряется при перезапуске)"""
+
+    def __init__(self, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self._entries = OrderedDict()  # user_id -> (время обновления, состояние)
+        self._entries_lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._entries_lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[user_id]
+                return None
+            return entry[1]
+
+    def update(self, user_id, func):
+        with self.lock(user_id):
+            new_data, result = func(self.get(user_id))
+            with self._entries_lock:
+                if new_data is None:
+                    self._entries.pop(user_id, None)
+                else:
+                    self._entries[user_id] = (time.time(), new_data)
+                    self._entries.move_to_end(user_id)
+                    # Вытесняем самые давние записи сверх предела
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return result
+
+
+class SQLiteStateStore(StateStore):
+    """Состояние в SQLite: переживает перезапуск, доступно нескольким процессам бота"""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_state_updated_at ON conversation_state(updated_at)",
+        # Количество записей поддерживается триггерами, чтобы проверка предела не сканировала таблицу
+        "CREATE TABLE IF NOT EXISTS state_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO state_meta (key, value) VALUES ('count', (SELECT COUNT(*) FROM conversation_state))",
+        """
+        CREATE TRIGGER IF NOT EXISTS state_count_insert AFTER INSERT ON conversation_state BEGIN
+            UPDATE state_meta SET value = value + 1 WHERE key = 'count';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS state_count_delete AFTER DELETE ON conversation_state BEGIN
+            UPDATE state_meta SET value = value - 1 WHERE key = 'count';
+        END
+        """,
+    )
+
+    def __init__(self, path=STATE_DB, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, conn, user_id):
+        row = conn.execute(
+            "SELECT data FROM conversation_state WHERE user_id = ? AND updated_at > ?",
+            (user_id, time.time() - self.ttl),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, user_id):
+        return self._read(self._connect(), user_id)
+
+    def update(self, user_id, func):
+        with self.lock(user_id):
+            conn = self._connect()
+            # BEGIN IMMEDIATE - чтение и запись атомарны и между процессами
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                new_data, result = func(self._read(conn, user_id))
+                now = time.time()
+                if new_data is None:
+                    conn.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+                else:
+                    conn.execute(
+                        "INSERT INTO conversation_state (user_id, data, updated_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                        (user_id, json.dumps(new_data, ensure_ascii=False), now),
+                    )
+                    self._evict(conn, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def _evict(self, conn, now):
+        """Удаляет истёкшие записи и самые давние сверх предела"""
+        conn.execute("DELETE FROM conversation_state WHERE updated_at <= ?", (now - self.ttl,))
+        count = conn.execute("SELECT value FROM state_meta WHERE key = 'count'").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM conversation_state WHERE user_id IN ("
+                "SELECT user_id FROM conversation_state ORDER BY updated_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+_state_store = None
+_state_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Возвращает хранилище состояния, выбранное через STATE_BACKEND"""
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            backend = os.getenv("STATE_BACKEND", "sqlite").lower()
+            ttl = int(os.getenv("STATE_TTL", STATE_TTL))
+            max_entries = int(os.getenv("STATE_MAX_ENTRIES", STATE_MAX_ENTRIES))
+            if backend == "memory":
+                _state_store = MemoryStateStore(ttl, max_entries)
+            elif backend == "sqlite":
+                _state_store = SQLiteStateStore(os.getenv("STATE_DB", STATE_DB), ttl, max_entries)
+            else:
+                raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
+        return _state_store
@@ -0,0 +1,141 @@
+"""Webhook-режим для main.py: встроенный HTTP-сервер вместо long polling
+
+Telegram присылает апдейты POST-запросами. Сервер проверяет секрет из заголовка
+X-Telegram-Bot-Api-Secret-Token (без секрета сервер не запускается: иначе любой,
+кто узнал адрес, подделает апдейт от имени администратора), кладёт апдейт в ограниченную очередь и сразу
+отвечает 200; обработчики бота вызываются пулом рабочих потоков через
+bot.process_new_updates. У каждого потока своя очередь, поток выбирается по
+пользователю (sharded.update_key), поэтому апдейты одного пользователя
+обрабатываются по порядку. Если очередь переполнена, отвечаем 503 - Telegram
+повторит доставку позже.
+
+Локально сервер можно нагружать, отправляя POST с JSON апдейта:
+
+    curl -X POST -H 'X-Telegram-Bot-Api-Secret-Token: secret' \
+         -d '{"update_id": 1, "message": {...}}' http://127.0.0.1:8443/telegram
+"""
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+from sharded import update_key
+
+WEBHOOK_WORKERS = 4
+WEBHOOK_QUEUE_SIZE = 1000  # на все рабочие потоки вместе
+MAX_BODY_SIZE = 1024 * 1024  # апдейт Telegram заведомо меньше
+
+
+class WebhookServer:
+    """HTTP-сервер приёма апдейтов с пулом обработчиков"""
+
+    def __init__(self, bot, host, port, path="/telegram", secret_token=None,
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        if not secret_token:
+            raise ValueError("secret_token обязателен: без него апдейт может прислать кто угодно")
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queues = [queue.Queue(maxsize=max(queue_size // workers, 1)) for _ in range(workers)]
+        self.received = 0
+        self.rejected = 0
+        self._counters_lock = threading.Lock()  # счётчики меняют потоки HTTP-сервера
+        self._threads = []
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._httpd.server_address
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._respond(404)
+                    return
+                token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+                if not hmac.compare_digest(token, server.secret_token):
+                    self._respond(403)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_SIZE:
+                    self._respond(400)
+                    return
+                try:
+                    data = json.loads(self.rfile.read(length))
+                    key = update_key(data)
+                    update = types.Update.de_json(data)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self._respond(400)
+                    return
+                if not server.enqueue(update, key):
+                    self._respond(503)
+                    return
+                self._respond(200)
+
+            def _respond(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass  # не пишем строку в лог на каждый апдейт
+
+        return Handler
+
+    def enqueue(self, update, key=None):
+        """Кладёт апдейт в очередь потока, выбранного по ключу (см. sharded.update_key);
+        False, если очередь заполнена"""
+        updates = self.queues[hash(key if key is not None else update.update_id) % self.workers]
+        try:
+            updates.put_nowait(update)
+        except queue.Full:
+            with self._counters_lock:
+                self.rejected += 1
+            return False
+        with self._counters_lock:
+            self.received += 1
+        return True
+
+    def _work(self, updates):
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"Ошибка обработки апдейта {update.update_id}: {e}")
+
+    def start(self):
+        """Запускает рабочие потоки и HTTP-сервер в фоне"""
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(self.queues[number],),
+                                      name=f"webhook-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._httpd.serve_forever, name="webhook-http", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._threads[-1].join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for updates in self.queues:
+            updates.put(None)